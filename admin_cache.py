@@ -0,0 +1,155 @@
+"""
+Cached administrator rosters per chat
+
+is_admin used to cost one getChatMember call per check. The roster of a
+chat is fetched with a single getChatAdministrators call instead and kept
+for ADMIN_CACHE_TTL_SECONDS; concurrent lookups for a chat share one
+in-flight request, and chat_member updates promoting or demoting someone
+drop the chat's roster so the next check sees the change.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Tuple
+from telegram import Bot, ChatMemberUpdated
+from telegram.constants import ChatMemberStatus
+from config import Config
+from metrics import ADMIN_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+class AdminCache:
+    """
+    Administrator user IDs per chat, with expiry and request coalescing
+
+    Rosters are facts about the chat, so one cache can serve several bots.
+    getChatAdministrators lists bot administrators too, so bots count as
+    admins exactly as they did with one getChatMember call per check.
+    """
+
+    def __init__(self, ttl: float = None, max_chats: int = None):
+        """
+        Initialize the cache
+
+        Args:
+            ttl: Seconds a roster is trusted (optional)
+            max_chats: Number of chats to keep rosters for (optional)
+        """
+        self.ttl = Config.ADMIN_CACHE_TTL_SECONDS if ttl is None else ttl
+        self.max_chats = max_chats or Config.ADMIN_CACHE_MAX_CHATS
+        # Chat ID -> (expiry on the monotonic clock, admin user IDs), least recently used first
+        self._rosters: OrderedDict = OrderedDict()
+        self._inflight: Dict[int, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._rosters)
+
+    def _cached(self, chat_id: int) -> Tuple[bool, FrozenSet[int]]:
+        entry = self._rosters.get(chat_id)
+        if entry is None:
+            return False, frozenset()
+        if entry[0] <= time.monotonic():
+            del self._rosters[chat_id]
+            return False, frozenset()
+        self._rosters.move_to_end(chat_id)
+        return True, entry[1]
+
+    def _store(self, chat_id: int, task: asyncio.Future):
+        """Cache a finished fetch unless it was invalidated meanwhile"""
+        if self._inflight.get(chat_id) is not task:
+            return
+        del self._inflight[chat_id]
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        admins = frozenset(member.user.id for member in task.result() if member.status in ADMIN_STATUSES)
+        self._rosters[chat_id] = (time.monotonic() + self.ttl, admins)
+        self._rosters.move_to_end(chat_id)
+        if len(self._rosters) > self.max_chats:
+            self._rosters.popitem(last=False)
+
+    async def admins(self, bot: Bot, chat_id: int) -> FrozenSet[int]:
+        """
+        Get the administrators of a chat
+
+        Args:
+            bot: Telegram Bot instance
+            chat_id: Chat ID
+
+        Returns:
+            frozenset: User IDs of the owner and administrators
+
+        Raises:
+            TelegramError: If the roster could not be fetched
+        """
+        found, admins = self._cached(chat_id)
+        if found:
+            ADMIN_LOOKUPS.inc('hit')
+            return admins
+
+        task = self._inflight.get(chat_id)
+        if task is None:
+            ADMIN_LOOKUPS.inc('miss')
+            task = asyncio.ensure_future(bot.get_chat_administrators(chat_id))
+            self._inflight[chat_id] = task
+            task.add_done_callback(lambda done: self._store(chat_id, done))
+        else:
+            ADMIN_LOOKUPS.inc('coalesced')
+
+        # A cancelled caller must not cancel the fetch the others wait for
+        members = await asyncio.shield(task)
+        return frozenset(member.user.id for member in members if member.status in ADMIN_STATUSES)
+
+    async def is_admin(self, bot: Bot, chat_id: int, user_id: int) -> bool:
+        """
+        Check if a user is an administrator in a chat
+
+        Args:
+            bot: Telegram Bot instance
+            chat_id: Chat ID to check
+            user_id: User ID to check
+
+        Returns:
+            bool: True if user is admin
+
+        Raises:
+            TelegramError: If the roster could not be fetched
+        """
+        return user_id in await self.admins(bot, chat_id)
+
+    def invalidate(self, chat_id: int):
+        """
+        Forget the roster of a chat, including a fetch still in flight
+
+        Args:
+            chat_id: Chat ID
+        """
+        self._rosters.pop(chat_id, None)
+        self._inflight.pop(chat_id, None)
+
+    def on_member_update(self, member_update: ChatMemberUpdated) -> bool:
+        """
+        Apply a chat_member update
+
+        Args:
+            member_update: Membership change of a user
+
+        Returns:
+            bool: True if the change touched admin status and the roster was dropped
+        """
+        was_admin = member_update.old_chat_member.status in ADMIN_STATUSES
+        is_admin = member_update.new_chat_member.status in ADMIN_STATUSES
+        # Admins whose rights changed are refetched as well
+        if not (was_admin or is_admin):
+            return False
+
+        self.invalidate(member_update.chat.id)
+        logger.debug(f"Admin roster of chat {member_update.chat.id} invalidated")
+        return True
+
+# Shared by utils.is_admin when ADMIN_CACHE_ENABLED is set
+admin_cache = AdminCache()
@@ -0,0 +1,282 @@
+"""
+In-memory join/leave analytics per chat
+
+Events are counted in per-chat ring buffers of minute, hour and day
+buckets, all in one flat uint32 array per chat, so recording an event is a
+handful of counter increments. Running totals are rolled up into the chat
+settings ('stats') and the store metadata in one batch per interval
+instead of one storage write per event.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Event kinds, also the counter names in the persisted totals
+JOIN = 0
+LEAVE = 1
+DELETED = 2
+KINDS = ('joins', 'leaves', 'deleted')
+
+# (name, seconds per bucket, buckets, window): the last hour by minute, day by hour, month by day
+RESOLUTIONS = (
+    ('minute', 60, 60, 'last_hour'),
+    ('hour', 3600, 24, 'last_day'),
+    ('day', 86400, 30, 'last_30_days'),
+)
+
+# Chat settings key and metadata key of the persisted totals
+SETTINGS_KEY = 'stats'
+METADATA_KEY = 'analytics_totals'
+
+_OFFSETS = []
+_offset = 0
+for _name, _span, _buckets, _window in RESOLUTIONS:
+    _OFFSETS.append(_offset)
+    _offset += _buckets * len(KINDS)
+_ARRAY_SIZE = _offset
+
+class _Counters:
+    """Ring buffers of one chat (or of all chats together)"""
+
+    __slots__ = ('counts', 'periods', 'last_event')
+
+    def __init__(self):
+        self.counts = array('I', bytes(4 * _ARRAY_SIZE))
+        # Period number of the newest bucket, per resolution
+        self.periods = array('q', bytes(8 * len(RESOLUTIONS)))
+        self.last_event = 0
+
+    def add(self, kind: int, now: int, count: int = 1):
+        self.last_event = now
+        counts = self.counts
+        for r, (_, span, buckets, _) in enumerate(RESOLUTIONS):
+            period = now // span
+            newest = self.periods[r]
+            if period != newest:
+                if period < newest:
+                    # Clock went backwards; count into the newest bucket
+                    period = newest
+                else:
+                    self._clear(r, newest, period)
+                    self.periods[r] = period
+            counts[_OFFSETS[r] + (period % buckets) * 3 + kind] += count
+
+    def _clear(self, r: int, newest: int, period: int):
+        """Zero the buckets between the newest one and a new period"""
+        buckets = RESOLUTIONS[r][2]
+        base = _OFFSETS[r]
+        for stale in range(newest + 1, newest + 1 + min(period - newest, buckets)):
+            index = base + (stale % buckets) * 3
+            self.counts[index] = self.counts[index + 1] = self.counts[index + 2] = 0
+
+    def series(self, r: int, now: int) -> List[Tuple[int, int, int, int]]:
+        """(bucket start, joins, leaves, deleted) of the current window, oldest first"""
+        _, span, buckets, _ = RESOLUTIONS[r]
+        period = now // span
+        newest = self.periods[r]
+        base = _OFFSETS[r]
+        result = []
+        for p in range(period - buckets + 1, period + 1):
+            # Buckets after the newest one written are stale until reused
+            if p > newest or newest - p >= buckets:
+                result.append((p * span, 0, 0, 0))
+            else:
+                index = base + (p % buckets) * 3
+                result.append((p * span, self.counts[index], self.counts[index + 1], self.counts[index + 2]))
+        return result
+
+    def window(self, r: int, now: int) -> Dict[str, int]:
+        """Counts over the whole window of a resolution"""
+        sums = [0, 0, 0]
+        for _, joins, leaves, deleted in self.series(r, now):
+            sums[JOIN] += joins
+            sums[LEAVE] += leaves
+            sums[DELETED] += deleted
+        return dict(zip(KINDS, sums))
+
+class ChatAnalytics:
+    """Counts join, leave and delete events per chat and rolls them up into Storage"""
+
+    def __init__(self, storage: Storage):
+        """
+        Initialize the analytics
+
+        Args:
+            storage: Storage the totals are rolled up into
+        """
+        self.storage = storage
+        self._chats: Dict[int, _Counters] = {}
+        self._global = _Counters()
+        # Events not rolled up yet: chat ID -> [joins, leaves, deleted]
+        self._pending: Dict[int, List[int]] = {}
+        self._totals: Optional[List[int]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, chat_id: int, kind: int, count: int = 1, now: float = None):
+        """
+        Count an event
+
+        Args:
+            chat_id: Telegram chat ID
+            kind: JOIN, LEAVE or DELETED
+            count: Number of events, e.g. members joining with one message (optional)
+            now: Event time in seconds since the epoch (optional)
+        """
+        now = int(time.time() if now is None else now)
+        counters = self._chats.get(chat_id)
+        if counters is None:
+            counters = self._chats[chat_id] = _Counters()
+        counters.add(kind, now, count)
+        self._global.add(kind, now, count)
+
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            pending = self._pending[chat_id] = [0, 0, 0]
+        pending[kind] += count
+
+    def _load_totals(self) -> List[int]:
+        if self._totals is None:
+            saved = self.storage.get_metadata(METADATA_KEY)
+            totals = json.loads(saved) if saved else {}
+            self._totals = [totals.get(name, 0) for name in KINDS]
+        return self._totals
+
+    def chat_summary(self, chat_id: int, now: float = None) -> dict:
+        """
+        Get the counts of a chat
+
+        Args:
+            chat_id: Telegram chat ID
+            now: Reference time (optional)
+
+        Returns:
+            dict: All-time totals and the counts of the last hour, day and 30 days
+        """
+        now = int(time.time() if now is None else now)
+        settings = self.storage.peek_chat_settings(chat_id)
+        stored = (settings.get(SETTINGS_KEY) if settings else None) or {}
+        pending = self._pending.get(chat_id, (0, 0, 0))
+        summary = {'total': {name: stored.get(name, 0) + pending[i] for i, name in enumerate(KINDS)}}
+
+        counters = self._chats.get(chat_id)
+        for r, (_, _, _, window) in enumerate(RESOLUTIONS):
+            summary[window] = counters.window(r, now) if counters else dict.fromkeys(KINDS, 0)
+        return summary
+
+    def global_summary(self, now: float = None) -> dict:
+        """
+        Get the counts over all chats
+
+        Args:
+            now: Reference time (optional)
+
+        Returns:
+            dict: All-time totals, counts of the last hour, day and 30 days, and tracked chats
+        """
+        now = int(time.time() if now is None else now)
+        totals = list(self._load_totals())
+        for pending in self._pending.values():
+            for kind in range(len(KINDS)):
+                totals[kind] += pending[kind]
+
+        summary = {'total': dict(zip(KINDS, totals))}
+        for r, (_, _, _, window) in enumerate(RESOLUTIONS):
+            summary[window] = self._global.window(r, now)
+        summary['tracked_chats'] = len(self._chats)
+        return summary
+
+    def series(self, chat_id: Optional[int], resolution: str, now: float = None) -> List[dict]:
+        """
+        Get the buckets of one resolution
+
+        Args:
+            chat_id: Telegram chat ID, or None for all chats
+            resolution: 'minute', 'hour' or 'day'
+            now: Reference time (optional)
+
+        Returns:
+            list: {'start', 'joins', 'leaves', 'deleted'} per bucket, oldest first
+
+        Raises:
+            ValueError: If the resolution is unknown
+        """
+        names = [name for name, _, _, _ in RESOLUTIONS]
+        if resolution not in names:
+            raise ValueError(f"Unknown resolution {resolution!r}, expected one of {', '.join(names)}")
+
+        counters = self._global if chat_id is None else self._chats.get(chat_id)
+        if counters is None:
+            counters = _Counters()
+        now = int(time.time() if now is None else now)
+        return [
+            {'start': start, 'joins': joins, 'leaves': leaves, 'deleted': deleted}
+            for start, joins, leaves, deleted in counters.series(names.index(resolution), now)
+        ]
+
+    def rollup(self, now: float = None) -> int:
+        """
+        Persist the pending counts in one batch and forget idle chats
+
+        Must run on the thread recording events (the event loop); the storage
+        write itself is cheap for the write-behind JSON backend and one
+        transaction for SQLite.
+
+        Args:
+            now: Reference time (optional)
+
+        Returns:
+            int: Number of chats written
+        """
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        totals = self._load_totals()
+        deltas = {}
+        for chat_id, counts in pending.items():
+            deltas[chat_id] = {name: counts[i] for i, name in enumerate(KINDS) if counts[i]}
+            for kind in range(len(KINDS)):
+                totals[kind] += counts[kind]
+
+        self.storage.add_chat_counters(SETTINGS_KEY, deltas)
+        self.storage.set_metadata(METADATA_KEY, json.dumps(dict(zip(KINDS, totals))))
+
+        # Chats without events for a whole day window carry no information in memory
+        cutoff = int(time.time() if now is None else now) - RESOLUTIONS[-1][1] * RESOLUTIONS[-1][2]
+        for chat_id in [chat_id for chat_id, counters in self._chats.items() if counters.last_event < cutoff]:
+            del self._chats[chat_id]
+
+        logger.debug(f"Rolled up analytics of {len(deltas)} chats")
+        return len(deltas)
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.rollup()
+            except Exception as e:
+                logger.error(f"Analytics rollup failed: {e}")
+
+    def start(self, interval: float = None):
+        """
+        Roll up periodically
+
+        Args:
+            interval: Seconds between rollups (optional)
+        """
+        self._task = asyncio.ensure_future(self._run(interval or Config.ANALYTICS_ROLLUP_SECONDS))
+
+    def stop(self):
+        """Stop the periodic rollup and persist what is pending"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.rollup()
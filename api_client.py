@@ -0,0 +1,145 @@
+"""
+HTTP clients for Bot API traffic
+
+Long polling and outbound calls use separate connection pools, so a
+getUpdates call waiting for updates never holds a connection a delete
+needs. Idle connections are kept alive long enough to survive the gaps
+between bursts, and HTTP/2 can multiplex calls over one connection.
+"""
+
+import logging
+from typing import Dict, Tuple
+import httpx
+from telegram._utils.defaultvalue import DefaultValue
+from config import Config
+from metrics import InstrumentedRequest
+
+logger = logging.getLogger(__name__)
+
+def parse_method_timeouts(spec: str) -> Dict[str, float]:
+    """
+    Parse per-method read timeouts
+
+    Args:
+        spec: Comma separated method=seconds pairs, e.g. "deleteMessages=10,sendMessage=8"
+
+    Returns:
+        dict: Read timeout in seconds by Bot API method name
+    """
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        method, _, seconds = item.partition('=')
+        try:
+            timeouts[method.strip()] = float(seconds)
+        except ValueError:
+            logger.warning(f"Ignoring invalid method timeout {item!r}")
+    return timeouts
+
+def _http_version(requested: str) -> str:
+    """Fall back to HTTP/1.1 if HTTP/2 is requested but the h2 package is missing"""
+    if requested == '1.1':
+        return requested
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+        return '1.1'
+    return requested
+
+class BotAPIRequest(InstrumentedRequest):
+    """Instrumented request with keep-alive expiry and per-method read timeouts"""
+
+    def __init__(self, connection_pool_size: int, keepalive_expiry: float = None,
+                 method_timeouts: Dict[str, float] = None, http_version: str = '1.1', **kwargs):
+        """
+        Initialize the request
+
+        Args:
+            connection_pool_size: Maximum number of connections
+            keepalive_expiry: Seconds an idle connection is kept open (optional)
+            method_timeouts: Read timeout by Bot API method, for calls without an explicit one (optional)
+            http_version: '1.1' or '2' (optional)
+            **kwargs: Further HTTPXRequest arguments (timeouts)
+        """
+        # Read by _build_client, which the base class calls from its __init__
+        self._keepalive_expiry = keepalive_expiry
+        self.method_timeouts = method_timeouts or {}
+        super().__init__(connection_pool_size=connection_pool_size,
+                         http_version=_http_version(http_version), **kwargs)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits: httpx.Limits = self._client_kwargs['limits']
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=self._keepalive_expiry,
+        )
+        return super()._build_client()
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None,
+                         *args, **kwargs) -> Tuple[int, bytes]:
+        if isinstance(read_timeout, DefaultValue):
+            read_timeout = self.method_timeouts.get(url.rsplit('/', 1)[-1], read_timeout)
+        return await super().do_request(url, method, request_data, read_timeout, *args, **kwargs)
+
+class SharedBotAPIRequest(BotAPIRequest):
+    """
+    BotAPIRequest used by several bots in one process
+
+    Every bot initializes and shuts down its requests; the connection pool
+    is opened by the first bot and closed only when the last one shuts down.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._users = 0
+
+    async def initialize(self) -> None:
+        self._users += 1
+        await super().initialize()
+
+    async def shutdown(self) -> None:
+        self._users -= 1
+        if self._users <= 0:
+            await super().shutdown()
+
+def _timeouts() -> Dict[str, float]:
+    return {
+        'connect_timeout': Config.BOT_API_CONNECT_TIMEOUT,
+        'read_timeout': Config.BOT_API_READ_TIMEOUT,
+        'write_timeout': Config.BOT_API_WRITE_TIMEOUT,
+        'pool_timeout': Config.BOT_API_POOL_TIMEOUT,
+    }
+
+def build_request(shared: bool = False) -> BotAPIRequest:
+    """
+    Build the request object for outbound calls
+
+    Args:
+        shared: Build a request several bots can use (optional)
+
+    Returns:
+        BotAPIRequest: Request with the configured pool, keep-alive and timeouts
+    """
+    request_class = SharedBotAPIRequest if shared else BotAPIRequest
+    return request_class(
+        Config.BOT_API_POOL_SIZE,
+        keepalive_expiry=Config.BOT_API_KEEPALIVE_SECONDS,
+        method_timeouts=parse_method_timeouts(Config.BOT_API_METHOD_TIMEOUTS),
+        http_version=Config.BOT_API_HTTP_VERSION,
+        **_timeouts()
+    )
+
+def build_get_updates_request() -> BotAPIRequest:
+    """
+    Build the request object for getUpdates
+
+    Returns:
+        BotAPIRequest: Request with its own small pool
+    """
+    # Long polling holds its connection open; one is enough and it stays on HTTP/1.1
+    return BotAPIRequest(
+        Config.BOT_API_UPDATES_POOL_SIZE,
+        keepalive_expiry=Config.BOT_API_KEEPALIVE_SECONDS,
+        **_timeouts()
+    )
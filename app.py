@@ -1,132 +1,135 @@
 #!/usr/bin/env python3
 """
 Telegram Join/Leave Message Hider Bot
-Main Flask application with webhook handling
+Entry point: ASGI server by default, legacy Flask application with SERVER_MODE=flask
 """
 
+from startup import startup_timer
+
 import os
 import logging
-from flask import Flask, request, jsonify
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 from config import Config
-from bot_handlers import BotHandlers
+from logging_setup import configure_logging
+
+# Configure logging before the other modules start logging
+configure_logging()
+
+from bot_setup import build_application
 from storage import Storage
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-
-# Initialize storage
-storage = Storage()
-
-# Initialize bot handlers
-bot_handlers = BotHandlers(storage)
-
-# Initialize Telegram bot application
-bot_token = os.getenv('TELEGRAM_BOT_TOKEN', '')
-if not bot_token:
-    logger.error("TELEGRAM_BOT_TOKEN environment variable is required")
-    exit(1)
-
-application = Application.builder().token(bot_token).build()
-
-# Add handlers
-application.add_handler(CommandHandler("start", bot_handlers.start_command))
-application.add_handler(MessageHandler(
-    filters.StatusUpdate.NEW_CHAT_MEMBERS | filters.StatusUpdate.LEFT_CHAT_MEMBER,
-    bot_handlers.handle_join_leave
-))
-
-@app.route('/')
-def index():
-    """Basic health check endpoint"""
-    return """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Telegram Join/Leave Hider Bot</title>
-        <style>
-            body { font-family: Arial, sans-serif; margin: 40px; }
-            .container { max-width: 600px; margin: 0 auto; }
-            .status { color: green; font-weight: bold; }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🤖 Telegram Join/Leave Hider Bot</h1>
-            <p class="status">✅ Bot is running and ready!</p>
-            <p>This bot automatically hides join/leave messages in Telegram groups.</p>
-            <h3>Features:</h3>
-            <ul>
-                <li>Automatically delete join/leave notifications</li>
-                <li>Works immediately once given admin permissions</li>
-                <li>No configuration required</li>
-                <li>Simple and reliable operation</li>
-            </ul>
-            <h3>Commands:</h3>
-            <ul>
-                <li><code>/start</code> - Welcome message and setup info</li>
-            </ul>
-        </div>
-    </body>
-    </html>
+def create_application():
+    """
+    Build storage and the Telegram Application without waiting for either to be ready
+
+    Storage loads in the background; the Application is only initialized
+    once the server starts.
+
+    Returns:
+        tuple: (Application, Storage)
     """
+    bot_token = os.getenv('TELEGRAM_BOT_TOKEN', '')
+    if not bot_token:
+        logger.error("TELEGRAM_BOT_TOKEN environment variable is required")
+        exit(1)
+
+    storage = Storage()
+    application = build_application(bot_token, storage)
+    startup_timer.mark('application_built')
+    return application, storage
+
+def create_flask_app(application):
+    """
+    Build the legacy Flask app
+
+    Args:
+        application: Telegram Application
+
+    Returns:
+        Flask: Flask application
+    """
+    from flask import Flask, request, jsonify
+    from telegram import Update
+    from asgi import INDEX_HTML
+    from dedup import UpdateDeduplicator
+    from prefilter import is_relevant
+
+    app = Flask(__name__)
+    dedup = UpdateDeduplicator()
+
+    @app.route('/')
+    def index():
+        """Basic health check endpoint"""
+        return INDEX_HTML
+
+    @app.route('/webhook', methods=['POST'])
+    def webhook():
+        """Handle incoming webhook updates from Telegram"""
+        body = request.get_data()
+        if not is_relevant(body) or dedup.check_body(body):
+            return jsonify({"status": "ok"})
+
+        try:
+            update_data = request.get_json()
+            if update_data:
+                update = Update.de_json(update_data, application.bot)
+                application.update_queue.put_nowait(update)
+            return jsonify({"status": "ok"})
+        except Exception as e:
+            # Telegram redelivers the update after an error, which must not count as a replay
+            dedup.forget_body(body)
+            logger.error(f"Error processing webhook: {e}")
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    @app.route('/metrics')
+    def metrics():
+        """Metrics endpoint in the Prometheus text format"""
+        from metrics import REGISTRY
+        return REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Handle incoming webhook updates from Telegram"""
-    try:
-        update_data = request.get_json()
-        if update_data:
-            update = Update.de_json(update_data, application.bot)
-            application.update_queue.put_nowait(update)
-        return jsonify({"status": "ok"})
-    except Exception as e:
-        logger.error(f"Error processing webhook: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500
-
-@app.route('/health')
-def health():
-    """Health check endpoint"""
-    return {"status": "healthy", "bot": "running"}
-
-def setup_webhook():
+    @app.route('/health')
+    def health():
+        """Health check endpoint"""
+        return {"status": "healthy", "bot": "running" if startup_timer.ready else "starting"}
+
+    return app
+
+def setup_webhook(application):
     """Set up webhook URL if WEBHOOK_URL is provided"""
     webhook_url = os.getenv('WEBHOOK_URL')
     if webhook_url:
         try:
             import asyncio
-            asyncio.run(application.bot.set_webhook(f"{webhook_url}/webhook"))
+            from prefilter import ALLOWED_UPDATES
+            asyncio.run(application.bot.set_webhook(f"{webhook_url}/webhook", allowed_updates=ALLOWED_UPDATES))
             logger.info(f"Webhook set to: {webhook_url}/webhook")
         except Exception as e:
             logger.error(f"Failed to set webhook: {e}")
 
-if __name__ == '__main__':
+def run_flask(application, storage):
+    """Run the legacy Flask server with the bot on separate event loops"""
     import asyncio
     import threading
-    
+
+    app = create_flask_app(application)
+    storage.wait_ready()
+
     # Initialize the bot application
     asyncio.run(application.initialize())
-    
+
     # Set up webhook if URL is provided, otherwise use polling
     webhook_url = os.getenv('WEBHOOK_URL')
-    
+
     if webhook_url:
-        setup_webhook()
+        setup_webhook(application)
         # Run Flask app for webhook mode
         port = int(os.getenv('PORT', 5000))
         app.run(host='0.0.0.0', port=port, debug=False)
     else:
         # Run both Flask and bot in polling mode
         logger.info("Starting bot in polling mode with web interface...")
-        
+
         def run_bot():
             """Run bot in a separate thread"""
             try:
@@ -134,21 +137,51 @@ if __name__ == '__main__':
                 import asyncio
                 loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(loop)
-                
+
                 # Run polling without signal handlers (background thread limitation)
-                application.run_polling(drop_pending_updates=True, close_loop=False, stop_signals=None)
+                from prefilter import ALLOWED_UPDATES
+                application.run_polling(drop_pending_updates=True, close_loop=False, stop_signals=None,
+                                        allowed_updates=ALLOWED_UPDATES)
             except Exception as e:
                 logger.error(f"Bot polling error: {e}")
-        
+
         # Start bot in background thread
         bot_thread = threading.Thread(target=run_bot, daemon=True)
         bot_thread.start()
-        
-        # Give bot time to start
-        import time
-        time.sleep(2)
+
+        # Wait for the bot to report that it is initialized
+        if not startup_timer.wait_ready(timeout=30):
+            logger.warning("Bot did not become ready within 30s, starting Flask anyway")
         logger.info("Bot started in background, Flask starting on port 5000...")
-        
+
         # Run Flask app on main thread
         port = int(os.getenv('PORT', 5000))
         app.run(host='0.0.0.0', port=port, debug=False)
+
+if __name__ == '__main__':
+    if Config.BOT_TOKENS:
+        # Several bots sharing this process, one webhook route and storage namespace each
+        from multibot import serve_multi_bot
+        if Config.SERVER_MODE != 'asgi' or Config.WORKER_PROCESSES > 1:
+            logger.warning("BOT_TOKENS is served by the ASGI server in one process; "
+                           "ignoring SERVER_MODE and WORKER_PROCESSES")
+        serve_multi_bot(Config.BOT_TOKENS)
+        exit(0)
+
+    if Config.WORKER_PROCESSES > 1:
+        # Front process routing updates to one worker process per shard of chats
+        from sharding import serve_sharded
+        if not Config.BOT_TOKEN:
+            logger.error("TELEGRAM_BOT_TOKEN environment variable is required")
+            exit(1)
+        serve_sharded(Config.BOT_TOKEN)
+        exit(0)
+
+    application, storage = create_application()
+
+    if Config.SERVER_MODE == 'asgi':
+        # Web server and bot share one event loop
+        from asgi import serve
+        serve(application, storage)
+    else:
+        run_flask(application, storage)
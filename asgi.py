@@ -0,0 +1,443 @@
+"""
+ASGI web server for the bot
+
+The web routes and the Telegram Application share a single event loop:
+webhook updates are handed to the running Application directly, without
+a worker thread per request or a second event loop.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+from telegram import Update
+from telegram.ext import Application
+from config import Config
+from catchup import BacklogCatchUp
+from dedup import UpdateDeduplicator
+from ingress import IngressQueue
+from prefilter import ALLOWED_UPDATES, is_relevant
+from metrics import HTTP_REQUEST_SECONDS, INGRESS_DROPPED, INGRESS_IN_MEMORY, INGRESS_SPILLED, REGISTRY
+from startup import startup_timer
+from storage import Storage
+from update_processor import wait_for_capacity
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a crashed ingress pump is started again
+PUMP_RESTART_DELAY = 1.0
+
+INDEX_HTML = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Telegram Join/Leave Hider Bot</title>
+        <style>
+            body { font-family: Arial, sans-serif; margin: 40px; }
+            .container { max-width: 600px; margin: 0 auto; }
+            .status { color: green; font-weight: bold; }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <h1>🤖 Telegram Join/Leave Hider Bot</h1>
+            <p class="status">✅ Bot is running and ready!</p>
+            <p>This bot automatically hides join/leave messages in Telegram groups.</p>
+            <h3>Features:</h3>
+            <ul>
+                <li>Automatically delete join/leave notifications</li>
+                <li>Works immediately once given admin permissions</li>
+                <li>No configuration required</li>
+                <li>Simple and reliable operation</li>
+            </ul>
+            <h3>Commands:</h3>
+            <ul>
+                <li><code>/start</code> - Welcome message and setup info</li>
+            </ul>
+        </div>
+    </body>
+    </html>
+    """
+
+class Request:
+    """Incoming HTTP request"""
+
+    __slots__ = ('method', 'path', 'headers', 'body', 'query')
+
+    def __init__(self, method: str, path: str, headers: Dict[bytes, bytes], body: bytes,
+                 query: Dict[str, str] = None):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.query = query or {}
+
+class Response:
+    """Outgoing HTTP response"""
+
+    __slots__ = ('status', 'body', 'content_type')
+
+    def __init__(self, body: bytes = b'', status: int = 200, content_type: str = 'text/plain; charset=utf-8'):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+    @classmethod
+    def json(cls, data, status: int = 200) -> 'Response':
+        """Build a JSON response"""
+        return cls(json.dumps(data).encode('utf-8'), status, 'application/json')
+
+    @classmethod
+    def html(cls, text: str, status: int = 200) -> 'Response':
+        """Build an HTML response"""
+        return cls(text.encode('utf-8'), status, 'text/html; charset=utf-8')
+
+RouteHandler = Callable[[Request], Awaitable[Response]]
+LifecycleHook = Callable[[], Awaitable[None]]
+
+class ASGIApp:
+    """Minimal ASGI application with exact-path routing and lifespan hooks"""
+
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteHandler] = {}
+        self.on_startup: List[LifecycleHook] = []
+        self.on_shutdown: List[LifecycleHook] = []
+
+        self.add_route('GET', '/', self.index)
+        self.add_route('GET', '/metrics', self.metrics)
+
+    def add_route(self, method: str, path: str, handler: RouteHandler):
+        """
+        Register a route handler
+
+        Args:
+            method: HTTP method
+            path: Exact request path
+            handler: Coroutine function receiving a Request and returning a Response
+        """
+        self.routes[(method, path)] = handler
+
+    async def __call__(self, scope: dict, receive, send):
+        if scope['type'] == 'http':
+            await self._handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._handle_lifespan(receive, send)
+
+    async def _handle_http(self, scope: dict, receive, send):
+        """Read the request body, dispatch to the route and send the response"""
+        handler = self.routes.get((scope['method'], scope['path']))
+
+        if handler is None:
+            if any(path == scope['path'] for _, path in self.routes):
+                response = Response(b'Method Not Allowed', 405)
+            else:
+                response = Response(b'Not Found', 404)
+        else:
+            chunks = []
+            more_body = True
+            while more_body:
+                message = await receive()
+                chunks.append(message.get('body', b''))
+                more_body = message.get('more_body', False)
+
+            query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+            request = Request(scope['method'], scope['path'], dict(scope['headers']), b''.join(chunks), query)
+            started = time.perf_counter()
+            try:
+                response = await handler(request)
+            except Exception as e:
+                logger.error(f"Error handling {scope['method']} {scope['path']}: {e}")
+                response = Response.json({"status": "error"}, 500)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope['path'])
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status,
+            'headers': [
+                (b'content-type', response.content_type.encode('latin-1')),
+                (b'content-length', str(len(response.body)).encode('latin-1')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': response.body})
+
+    async def _handle_lifespan(self, receive, send):
+        """Run startup and shutdown alongside the server"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.error(f"Startup failed: {e}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        """Run the startup hooks"""
+        for hook in self.on_startup:
+            await hook()
+
+    async def shutdown(self):
+        """Run the shutdown hooks"""
+        for hook in self.on_shutdown:
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Error during shutdown hook: {e}")
+
+    async def index(self, request: Request) -> Response:
+        """Basic health check endpoint"""
+        return Response.html(INDEX_HTML)
+
+    async def metrics(self, request: Request) -> Response:
+        """Metrics endpoint in the Prometheus text format"""
+        return Response(REGISTRY.render().encode('utf-8'), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class WebhookServer(ASGIApp):
+    """ASGI application serving the health routes and the Telegram webhook"""
+
+    def __init__(self, application: Application, storage: Storage = None, webhook_url: str = None,
+                 dedup: UpdateDeduplicator = None, ingress: IngressQueue = None, webhook_path: str = '/webhook'):
+        """
+        Initialize the server
+
+        Args:
+            application: Telegram Application to run inside the server's event loop
+            storage: Storage the bot waits for before processing updates (optional)
+            webhook_url: Public base URL; polling is used when empty (optional)
+            dedup: Filter for redelivered updates (optional)
+            ingress: Bounded queue webhook updates wait in (optional)
+            webhook_path: Path Telegram posts updates to (optional)
+        """
+        super().__init__()
+        self.application = application
+        self.storage = storage
+        self.webhook_url = Config.WEBHOOK_URL if webhook_url is None else webhook_url
+        self.dedup = dedup or UpdateDeduplicator()
+        self.ingress = ingress or IngressQueue()
+        self.webhook_path = webhook_path
+        INGRESS_IN_MEMORY.set_function(lambda: self.ingress.in_memory)
+        INGRESS_SPILLED.set_function(lambda: self.ingress.spilled)
+        self._boot_task: Optional[asyncio.Task] = None
+        self._pump_task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._boot_error: Optional[BaseException] = None
+
+        self.add_route('GET', '/health', self.health)
+        self.add_route('GET', '/stats', self.stats)
+        self.add_route('POST', webhook_path, self.webhook)
+
+    async def startup(self):
+        """
+        Start booting the bot without holding up the server
+
+        The routes are served immediately; webhook updates received before
+        the bot is ready wait in the ingress queue.
+        """
+        startup_timer.mark('server_started')
+        self._boot_task = asyncio.ensure_future(self._boot())
+
+    async def _boot(self):
+        """Wait for storage, then initialize and start the Telegram Application"""
+        try:
+            if self.storage is not None and not self.storage.ready:
+                await asyncio.to_thread(self.storage.wait_ready)
+            startup_timer.mark('storage_ready')
+            if self.storage is not None:
+                self.dedup.restore(self.storage)
+            await self._start_application()
+            startup_timer.mark('application_started')
+        except Exception as e:
+            self._boot_error = e
+            logger.error(f"Bot startup failed: {e}")
+
+    async def _start_application(self):
+        """Initialize and start the Telegram Application in the server's event loop"""
+        await self.application.initialize()
+        if self.application.post_init:
+            await self.application.post_init(self.application)
+
+        await super().startup()
+
+        if self.webhook_url:
+            url = f"{self.webhook_url}{self.webhook_path}"
+            await self.application.bot.set_webhook(url, allowed_updates=ALLOWED_UPDATES)
+            logger.info(f"Webhook set to: {url}")
+            await self.application.start()
+        elif Config.CATCHUP_ENABLED:
+            logger.info("No WEBHOOK_URL set, catching up on pending updates before polling...")
+            # Started first so the backlog is processed while it is fetched
+            await self.application.start()
+            await BacklogCatchUp(self.application).run()
+            await self.application.updater.start_polling(allowed_updates=ALLOWED_UPDATES)
+        else:
+            logger.info("No WEBHOOK_URL set, starting bot in polling mode...")
+            await self.application.updater.start_polling(drop_pending_updates=True, allowed_updates=ALLOWED_UPDATES)
+            await self.application.start()
+
+        self._start_pump()
+
+    def _start_pump(self):
+        if self._stopping:
+            return
+        self._pump_task = asyncio.ensure_future(self._pump())
+        self._pump_task.add_done_callback(self._on_pump_done)
+
+    def _on_pump_done(self, task: asyncio.Task):
+        """Restart the pump if it died; /health reports it as stalled meanwhile"""
+        if task.cancelled() or self._stopping:
+            return
+        logger.error(f"Ingress pump stopped: {task.exception()!r}, restarting in {PUMP_RESTART_DELAY:g}s")
+        asyncio.get_running_loop().call_later(PUMP_RESTART_DELAY, self._start_pump)
+
+    async def _pump(self):
+        """Feed updates from the ingress queue to the Application as it keeps up"""
+        while True:
+            body = await self.ingress.get()
+            await wait_for_capacity(self.application, Config.INGRESS_FEED_LIMIT)
+            self._enqueue(body)
+
+    def _enqueue(self, body: bytes):
+        # A malformed update must not take the pump and every later update with it
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+            self.application.update_queue.put_nowait(update)
+        except Exception as e:
+            logger.error(f"Dropping undecodable update: {e!r}")
+
+    async def shutdown(self):
+        """Stop the Telegram Application and release its resources"""
+        self._stopping = True
+        if self._boot_task is not None and not self._boot_task.done():
+            self._boot_task.cancel()
+            await asyncio.gather(self._boot_task, return_exceptions=True)
+
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            await asyncio.gather(self._pump_task, return_exceptions=True)
+            # Updates held in memory are processed before stopping; spilled ones
+            # stay on disk and are replayed on the next start
+            for body in self.ingress.drain_memory():
+                self._enqueue(body)
+        self.ingress.close()
+
+        if self.storage is not None and self.storage.ready:
+            self.dedup.persist(self.storage)
+
+        if self.application.updater and self.application.updater.running:
+            await self.application.updater.stop()
+        if self.application.running:
+            await self.application.stop()
+            if self.application.post_stop:
+                await self.application.post_stop(self.application)
+
+        await super().shutdown()
+
+        await self.application.shutdown()
+        if self.application.post_shutdown:
+            await self.application.post_shutdown(self.application)
+
+    @property
+    def state(self) -> str:
+        """'starting', 'running', 'stalled' (ingress pump down) or 'failed'"""
+        if self._boot_error is not None:
+            return 'failed'
+        if self._pump_task is not None and self._pump_task.done() and not self._stopping:
+            return 'stalled'
+        return 'running' if self.application.running else 'starting'
+
+    async def health(self, request: Request) -> Response:
+        """Health check endpoint"""
+        state = self.state
+        if state in ('failed', 'stalled'):
+            return Response.json({"status": "unhealthy", "bot": state}, 503)
+
+        return Response.json({
+            "status": "healthy",
+            "bot": state,
+            "startup": startup_timer.as_dict(),
+        })
+
+    async def stats(self, request: Request) -> Response:
+        """
+        Storage statistics and join/leave analytics
+
+        Query parameters: chat_id for the counts of one chat, series=minute|hour|day
+        for the buckets of one resolution.
+        """
+        if self.storage is None or not self.storage.ready:
+            return Response.json({"status": "starting"}, 503)
+
+        stats = self.storage.get_stats()
+        analytics = self.application.bot_data.get('analytics')
+        if analytics is None:
+            return Response.json(stats)
+
+        try:
+            chat_id = int(request.query['chat_id']) if 'chat_id' in request.query else None
+            stats['analytics'] = analytics.global_summary() if chat_id is None else analytics.chat_summary(chat_id)
+            if 'series' in request.query:
+                stats['series'] = analytics.series(chat_id, request.query['series'])
+        except ValueError as e:
+            return Response.json({"status": "error", "message": str(e)}, 400)
+        return Response.json(stats)
+
+    async def webhook(self, request: Request) -> Response:
+        """Handle incoming webhook updates from Telegram"""
+        if not request.body:
+            return Response.json({"status": "ok"})
+        if not request.body.lstrip().startswith(b'{'):
+            logger.error("Error decoding webhook body: not a JSON object")
+            return Response.json({"status": "error", "message": "invalid json"}, 400)
+
+        # Acknowledge irrelevant updates and replays without decoding them
+        if not is_relevant(request.body) or self.dedup.check_body(request.body):
+            return Response.json({"status": "ok"})
+
+        # Decoding happens when the update leaves the queue; a dropped update
+        # must not count as delivered, or a redelivery would be dropped too
+        if not self.ingress.put(request.body):
+            self.dedup.forget_body(request.body)
+            INGRESS_DROPPED.inc()
+        return Response.json({"status": "ok"})
+
+def serve(application: Application, storage: Storage = None, host: str = None, port: int = None):
+    """
+    Run the bot's ASGI server with uvicorn
+
+    Args:
+        application: Telegram Application to serve
+        storage: Storage the bot waits for before processing updates (optional)
+        host: Bind address (optional)
+        port: Bind port (optional)
+    """
+    run_asgi(WebhookServer(application, storage), host, port)
+
+def run_asgi(app: ASGIApp, host: str = None, port: int = None):
+    """
+    Run an ASGI application with uvicorn
+
+    Args:
+        app: ASGI application
+        host: Bind address (optional)
+        port: Bind port (optional)
+    """
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=host or Config.HOST,
+        port=port or Config.PORT,
+        lifespan='on',
+        # uvicorn's loggers (including the access log) propagate to the queued root handler
+        log_config=None,
+        log_level=Config.LOG_LEVEL.lower(),
+        backlog=Config.SERVER_BACKLOG,
+    )
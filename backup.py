@@ -0,0 +1,269 @@
+"""
+Compressed full and incremental backups of the settings store
+
+A backup is a gzip-compressed JSON Lines file: a header line, then one
+line per chat; incremental backups hold only the chats changed since the
+previous backup plus the IDs of removed chats. manifest.json in the
+backup directory lists the backups in order. Snapshots are point-in-time
+copies of the chat index, so writing happens off the event loop while
+updates keep being handled, and restores stream one line at a time.
+
+Usage:
+    python backup.py backup [--full]
+    python backup.py list
+    python backup.py restore [NAME]
+
+A restore replaces the store on disk, so it refuses to run while a bot
+has the store open: stop the bot first.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Iterator, List, Optional
+from config import Config
+from chat_index import ChatIndex
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+FULL = 'full'
+INCREMENTAL = 'incremental'
+
+class BackupManager:
+    """Writes and restores backup chains of one Storage"""
+
+    def __init__(self, storage: Storage, backup_dir: str = None, full_every: int = None):
+        """
+        Initialize the manager
+
+        Args:
+            storage: Storage to back up
+            backup_dir: Directory for backups and the manifest (optional, defaults to
+                a directory per store file under Config.BACKUP_DIR)
+            full_every: Write a full backup after this many incremental ones (optional)
+        """
+        self.storage = storage
+        if backup_dir is None:
+            # Shard workers and hosted bots each have their own store, so each gets its own chain
+            store_name = re.sub(r'[^\w.-]', '_', os.path.basename(storage.storage_file))
+            backup_dir = os.path.join(Config.BACKUP_DIR, store_name)
+        self.backup_dir = backup_dir
+        self.full_every = full_every or Config.BACKUP_FULL_EVERY
+        self.manifest_file = os.path.join(self.backup_dir, 'manifest.json')
+        self._lock = threading.Lock()
+        # State of the last backup written by this process, the base of the next incremental
+        self._last_ids: Optional[array] = None
+        self._last_epoch = 0
+        self._incrementals = 0
+
+    def _read_manifest(self) -> List[dict]:
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)['backups']
+        except FileNotFoundError:
+            return []
+
+    def _write_manifest(self, backups: List[dict]):
+        tmp_file = f"{self.manifest_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'backups': backups}, f, indent=2)
+        os.replace(tmp_file, self.manifest_file)
+
+    def list_backups(self) -> List[dict]:
+        """
+        Get the manifest entries
+
+        Returns:
+            list: Backups, oldest first
+        """
+        return self._read_manifest()
+
+    def backup(self, full: bool = None) -> dict:
+        """
+        Write a backup (blocking; use backup_async from the event loop)
+
+        Args:
+            full: Force a full (True) or incremental (False) backup; by default
+                incremental unless there is no base or full_every was reached
+
+        Returns:
+            dict: Manifest entry of the new backup
+        """
+        with self._lock:
+            started = time.perf_counter()
+            epoch = int(time.time())
+            chats, metadata = self.storage.snapshot_index()
+
+            if full is None:
+                full = self._last_ids is None or self._incrementals >= self.full_every
+            elif not full and self._last_ids is None:
+                logger.info("No base for an incremental backup in this process, writing a full one")
+                full = True
+
+            os.makedirs(self.backup_dir, exist_ok=True)
+            kind = FULL if full else INCREMENTAL
+            name = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{kind}.jsonl.gz"
+            path = os.path.join(self.backup_dir, name)
+
+            if full:
+                changed = chats.items()
+                removed: List[int] = []
+            else:
+                since = self._last_epoch
+                changed = ((chat_id, slot) for chat_id, slot in chats.items() if chats.updated_at(slot) >= since)
+                removed = sorted(set(self._last_ids).difference(chats.chat_ids()))
+
+            header = {'type': kind, 'created_at': datetime.now().isoformat(), 'metadata': metadata}
+            written = self._write(path, header, chats, changed, removed)
+
+            self._last_ids = array('q', chats.chat_ids())
+            self._last_epoch = epoch
+            self._incrementals = 0 if full else self._incrementals + 1
+
+            entry = {
+                'file': name,
+                'type': kind,
+                'created_at': header['created_at'],
+                'chats': written,
+                'removed': len(removed),
+                'bytes': os.path.getsize(path),
+                'seconds': round(time.perf_counter() - started, 3),
+            }
+            backups = self._read_manifest()
+            backups.append(entry)
+            self._write_manifest(backups)
+
+        logger.info(f"Wrote {kind} backup {name}: {written} chats, {entry['bytes']} bytes in {entry['seconds']}s")
+        return entry
+
+    def _write(self, path: str, header: dict, chats: ChatIndex, changed: Iterator, removed: List[int]) -> int:
+        """Stream the records into a compressed file, replacing it atomically"""
+        tmp_path = f"{path}.tmp"
+        written = 0
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=Config.BACKUP_COMPRESSION_LEVEL) as f:
+            f.write(json.dumps(header, ensure_ascii=False) + '\n')
+            for chat_id, slot in changed:
+                f.write(json.dumps({'id': chat_id, 'settings': chats.settings(slot)}, ensure_ascii=False) + '\n')
+                written += 1
+            if removed:
+                f.write(json.dumps({'removed': removed}) + '\n')
+        os.replace(tmp_path, path)
+        return written
+
+    async def backup_async(self, full: bool = None) -> dict:
+        """Write a backup in a worker thread"""
+        return await asyncio.to_thread(self.backup, full)
+
+    def _chain(self, name: str = None) -> List[dict]:
+        """Backups to apply for a restore: the last full one up to the target and the incrementals after it"""
+        backups = self._read_manifest()
+        if name is not None:
+            names = [entry['file'] for entry in backups]
+            if name not in names:
+                raise FileNotFoundError(f"Backup {name} is not in {self.manifest_file}")
+            backups = backups[:names.index(name) + 1]
+
+        for start in range(len(backups) - 1, -1, -1):
+            if backups[start]['type'] == FULL:
+                return backups[start:]
+        raise FileNotFoundError(f"No full backup in {self.manifest_file}")
+
+    def restore(self, name: str = None) -> int:
+        """
+        Restore the store from a backup chain (blocking; use restore_async from the event loop)
+
+        Args:
+            name: Backup file to restore up to (optional, defaults to the latest)
+
+        Returns:
+            int: Number of chats after the restore
+        """
+        with self._lock:
+            chats = ChatIndex()
+            metadata: dict = {}
+
+            for entry in self._chain(name):
+                with gzip.open(os.path.join(self.backup_dir, entry['file']), 'rt', encoding='utf-8') as f:
+                    metadata = json.loads(f.readline())['metadata']
+                    removed: List[int] = []
+                    chats.put_many(self._read_records(f, removed))
+                    chats.remove_many(removed)
+
+            self.storage.load_index(chats, metadata)
+            # The restored state differs from the last backup, so the next one is full
+            self._last_ids = None
+
+        logger.info(f"Restored {len(chats)} chats from {name or 'the latest backup'}")
+        return len(chats)
+
+    @staticmethod
+    def _read_records(f, removed: List[int]) -> Iterator:
+        """Stream the (chat_id, settings) records of a backup, collecting the removed IDs"""
+        for line in f:
+            record = json.loads(line)
+            if 'removed' in record:
+                removed.extend(record['removed'])
+            else:
+                yield record['id'], record['settings']
+
+    async def restore_async(self, name: str = None) -> int:
+        """Restore in a worker thread"""
+        return await asyncio.to_thread(self.restore, name)
+
+    async def run_periodically(self, interval: float = None):
+        """
+        Write a backup every interval until cancelled
+
+        Args:
+            interval: Seconds between backups (optional)
+        """
+        interval = interval or Config.BACKUP_INTERVAL_MINUTES * 60
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.backup_async()
+            except Exception as e:
+                logger.error(f"Periodic backup failed: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up or restore the bot settings")
+    commands = parser.add_subparsers(dest='command', required=True)
+    backup_parser = commands.add_parser('backup', help='write a backup')
+    backup_parser.add_argument('--full', action='store_true', help='write a full backup')
+    commands.add_parser('list', help='list the backups in the manifest')
+    restore_parser = commands.add_parser('restore', help='restore a backup chain')
+    restore_parser.add_argument('name', nargs='?', help='backup file to restore up to (default: latest)')
+    parser.add_argument('--dir', default=None, help='backup directory')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    try:
+        # A running bot would keep serving, and later persist, the data being replaced
+        storage = Storage(lazy=args.command == 'list', exclusive=args.command == 'restore')
+    except RuntimeError as e:
+        parser.exit(1, f"Cannot {args.command}: {e}\n")
+    manager = BackupManager(storage, args.dir)
+    try:
+        if args.command == 'list':
+            for entry in manager.list_backups():
+                print(f"{entry['file']}  {entry['type']:<11} {entry['chats']:>8} chats  {entry['bytes']:>10} bytes")
+        elif args.command == 'backup':
+            # A new process has no base for an incremental backup
+            manager.backup(full=True)
+        else:
+            manager.restore(args.name)
+    finally:
+        storage.close()
+
+if __name__ == '__main__':
+    main()
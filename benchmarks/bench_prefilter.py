@@ -0,0 +1,57 @@
+"""
+Micro-benchmark for the webhook pre-filter
+
+Compares decoding every update (json.loads and Update.de_json) with the
+raw-bytes check that lets irrelevant updates skip decoding.
+
+Usage:
+    python benchmarks/bench_prefilter.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot, Update
+from prefilter import is_relevant
+
+CHAT = {'id': -1001234567890, 'type': 'supergroup', 'title': 'Python Developers'}
+USER = {'id': 5000001, 'is_bot': False, 'first_name': 'Ada', 'username': 'ada'}
+
+SAMPLES = {
+    'text message': {'update_id': 1, 'message': {
+        'message_id': 10, 'date': 1700000000, 'chat': CHAT, 'from': USER,
+        'text': 'Has anyone tried the new asyncio TaskGroup API yet? ' * 3}},
+    'edited message': {'update_id': 2, 'edited_message': {
+        'message_id': 11, 'date': 1700000000, 'edit_date': 1700000100, 'chat': CHAT, 'from': USER,
+        'text': 'typo fixed'}},
+    'reply with entities': {'update_id': 3, 'message': {
+        'message_id': 12, 'date': 1700000000, 'chat': CHAT, 'from': USER, 'text': 'see https://example.org',
+        'entities': [{'type': 'url', 'offset': 4, 'length': 19}],
+        'reply_to_message': {'message_id': 10, 'date': 1700000000, 'chat': CHAT, 'from': USER, 'text': 'hi'}}},
+    'join': {'update_id': 4, 'message': {
+        'message_id': 13, 'date': 1700000000, 'chat': CHAT, 'from': USER,
+        'new_chat_members': [USER], 'new_chat_member': USER, 'new_chat_participant': USER}},
+    '/start': {'update_id': 5, 'message': {
+        'message_id': 14, 'date': 1700000000, 'chat': CHAT, 'from': USER, 'text': '/start@hider_bot',
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 16}]}},
+}
+
+def bench(label: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{label:<45} {seconds / number * 1e6:8.3f} us/op")
+
+def main():
+    bot = Bot('123456:BENCH')
+
+    for name, update in SAMPLES.items():
+        body = json.dumps(update).encode()
+        print(f"{name:<20} relevant={is_relevant(body)}")
+        bench("  decode (json.loads + Update.de_json)", lambda: Update.de_json(json.loads(body), bot), 5000)
+        bench("  pre-filter (raw bytes)", lambda: is_relevant(body), 50000)
+
+if __name__ == '__main__':
+    main()
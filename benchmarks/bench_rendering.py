@@ -0,0 +1,60 @@
+"""
+Micro-benchmark for the rendering layer
+
+Compares the previous per-call work on the /start and join paths with the
+prebuilt keyboards and the targeted Markdown escaping.
+
+Usage:
+    python benchmarks/bench_rendering.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, User
+from rendering import Renderer, escape_markdown
+
+SAMPLES = {
+    'plain': "Python Developers Community Chat",
+    'title': "Python Devs (EU) - Chat!",
+    'heavy': "Group [beta] (v1.2) - *fans* of _python_ #1! {test} | a=b > c ~ `code`",
+}
+
+def escape_markdown_replace(text: str) -> str:
+    """Previous implementation: one str.replace pass per special character"""
+    escape_chars = ['_', '*', '`', '[', ']', '(', ')', '~', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+    for char in escape_chars:
+        text = text.replace(char, f'\\{char}')
+    return text
+
+def build_keyboard_per_call(username: str) -> InlineKeyboardMarkup:
+    """Previous implementation: keyboard rebuilt on every /start"""
+    keyboard = [
+        [InlineKeyboardButton(
+            '➕ 𝗔𝗱𝗱 𝗠𝗲 𝗧𝗼 𝗬𝗼𝘂𝗿 𝗚𝗿𝗼𝘂𝗽𝘀 ➕',
+            url=f'https://t.me/{username}?startgroup=true'
+        )]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def bench(label: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{label:<40} {seconds / number * 1e6:8.3f} us/op")
+
+def main():
+    renderer = Renderer()
+    renderer.set_identity(User(123456, 'Hider', True, username='hider_bot'))
+
+    for name, sample in SAMPLES.items():
+        assert escape_markdown(sample) == escape_markdown_replace(sample)
+        bench(f"escape_markdown {name} (18x replace)", lambda: escape_markdown_replace(sample), 20000)
+        bench(f"escape_markdown {name} (targeted)", lambda: escape_markdown(sample), 20000)
+    bench("start keyboard (built per call)", lambda: build_keyboard_per_call('hider_bot'), 20000)
+    bench("start keyboard (prebuilt)", lambda: renderer.start_keyboard, 20000)
+    bench("bot id check (cached identity)", lambda: renderer.bot_id == 42, 200000)
+
+if __name__ == '__main__':
+    main()
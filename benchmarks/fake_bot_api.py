@@ -0,0 +1,207 @@
+"""
+Local stand-in for the Telegram Bot API
+
+Answers the methods the bot uses (getMe, getUpdates, setWebhook,
+deleteWebhook, getWebhookInfo, sendMessage, deleteMessage, deleteMessages)
+with configurable latency, injected 429s and permission errors, and records
+when every message was deleted so a load generator can measure end-to-end
+latency.
+
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:<port>/bot.
+
+Control routes used by the load generator:
+    POST /control/updates   JSON list of updates to hand out via getUpdates
+    GET  /control/stats     call counts and deletion timestamps
+    POST /control/reset     clear counters and deletions
+
+Usage:
+    python benchmarks/fake_bot_api.py --port 8081 --latency-ms 20 --rate-limit-every 500
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Set
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asgi import ASGIApp, Request, Response, run_asgi
+
+BOT_USER = {'id': 999000, 'is_bot': True, 'first_name': 'Hider', 'username': 'hider_bot'}
+
+class FakeBotAPI(ASGIApp):
+    """ASGI application imitating the Bot API for one token"""
+
+    def __init__(self, token: str, latency: float = 0.0, rate_limit_every: int = 0,
+                 retry_after: int = 1, forbidden_chats: Set[int] = frozenset()):
+        """
+        Initialize the fake API
+
+        Args:
+            token: Bot token the routes are served under
+            latency: Seconds to wait before answering each call
+            rate_limit_every: Answer every Nth call with 429 (0 disables)
+            retry_after: retry_after of the injected 429s, in seconds
+            forbidden_chats: Chats where deletes fail for lack of rights
+        """
+        super().__init__()
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.forbidden_chats = set(forbidden_chats)
+
+        self.calls: Counter = Counter()
+        self.rate_limited = 0
+        self.deleted: Dict[str, float] = {}
+        self._updates: List[dict] = []
+        self._updates_available = asyncio.Event()
+        self._next_message_id = 1
+
+        methods = {
+            'getMe': self.get_me,
+            'getUpdates': self.get_updates,
+            'setWebhook': self.ok,
+            'deleteWebhook': self.ok,
+            'getWebhookInfo': self.get_webhook_info,
+            'sendMessage': self.send_message,
+            'deleteMessage': self.delete_message,
+            'deleteMessages': self.delete_messages,
+        }
+        for name, handler in methods.items():
+            self.add_route('POST', f'/bot{token}/{name}', self._api_call(name, handler))
+
+        self.add_route('POST', '/control/updates', self.push_updates)
+        self.add_route('GET', '/control/stats', self.stats)
+        self.add_route('POST', '/control/reset', self.reset)
+
+    def _api_call(self, name: str, handler):
+        """Wrap a method handler with parameter decoding, latency and 429 injection"""
+        async def route(request: Request) -> Response:
+            self.calls[name] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+            if name != 'getUpdates' and self.rate_limit_every and self.calls.total() % self.rate_limit_every == 0:
+                self.rate_limited += 1
+                return self._error(429, f'Too Many Requests: retry after {self.retry_after}',
+                                   parameters={'retry_after': self.retry_after})
+
+            return await handler(self._params(request))
+        return route
+
+    @staticmethod
+    def _params(request: Request) -> dict:
+        """Decode form or JSON parameters; form values are JSON-encoded where not plain strings"""
+        if request.headers.get(b'content-type', b'').startswith(b'application/json'):
+            return json.loads(request.body or b'{}')
+
+        params = {}
+        for key, value in parse_qsl(request.body.decode('utf-8')):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    @staticmethod
+    def _result(result) -> Response:
+        return Response.json({'ok': True, 'result': result})
+
+    @staticmethod
+    def _error(code: int, description: str, **extra) -> Response:
+        return Response.json({'ok': False, 'error_code': code, 'description': description, **extra}, code)
+
+    async def ok(self, params: dict) -> Response:
+        return self._result(True)
+
+    async def get_me(self, params: dict) -> Response:
+        return self._result(BOT_USER)
+
+    async def get_webhook_info(self, params: dict) -> Response:
+        return self._result({'url': '', 'has_custom_certificate': False, 'pending_update_count': len(self._updates)})
+
+    async def get_updates(self, params: dict) -> Response:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+
+        if not self._updates and params.get('timeout'):
+            self._updates_available.clear()
+            try:
+                await asyncio.wait_for(self._updates_available.wait(), float(params['timeout']))
+            except asyncio.TimeoutError:
+                pass
+
+        return self._result(self._updates[:limit])
+
+    async def send_message(self, params: dict) -> Response:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return self._result({
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(params['chat_id']), 'type': 'supergroup', 'title': 'Load test'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        })
+
+    def _delete(self, chat_id: int, message_ids: List[int]) -> Response:
+        if chat_id in self.forbidden_chats:
+            return self._error(400, "Bad Request: not enough rights to delete a message")
+
+        now = time.time()
+        for message_id in message_ids:
+            self.deleted[f'{chat_id}:{message_id}'] = now
+        return self._result(True)
+
+    async def delete_message(self, params: dict) -> Response:
+        return self._delete(int(params['chat_id']), [int(params['message_id'])])
+
+    async def delete_messages(self, params: dict) -> Response:
+        return self._delete(int(params['chat_id']), [int(message_id) for message_id in params['message_ids']])
+
+    async def push_updates(self, request: Request) -> Response:
+        self._updates.extend(json.loads(request.body))
+        self._updates_available.set()
+        return Response.json({'queued': len(self._updates)})
+
+    async def stats(self, request: Request) -> Response:
+        return Response.json({
+            'calls': dict(self.calls),
+            'rate_limited': self.rate_limited,
+            'deleted': self.deleted,
+        })
+
+    async def reset(self, request: Request) -> Response:
+        self.calls.clear()
+        self.rate_limited = 0
+        self.deleted.clear()
+        self._updates.clear()
+        return Response.json({'status': 'ok'})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--token', default='123456:LOADTEST')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth call with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--forbidden-chats', type=int, nargs='*', default=[], help='chat IDs without delete rights')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(
+        args.token,
+        latency=args.latency_ms / 1000,
+        rate_limit_every=args.rate_limit_every,
+        retry_after=args.retry_after,
+        forbidden_chats=set(args.forbidden_chats),
+    )
+    run_asgi(api, '127.0.0.1', args.port)
+
+if __name__ == '__main__':
+    main()
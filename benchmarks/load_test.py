@@ -0,0 +1,201 @@
+"""
+Load test: join/leave floods against the bot, served by a fake Bot API
+
+Starts benchmarks/fake_bot_api.py and the bot (app.py) as subprocesses,
+replays synthetic join/leave service messages across many chats, either
+POSTed to /webhook or handed out through getUpdates, and waits until the
+fake API has seen every message deleted.
+
+Reports updates/sec, p50/p99 end-to-end latency (update sent until its
+message was deleted) and the bot's peak memory. Extra environment for the
+bot (e.g. SCHEDULER_GLOBAL_RATE=1000) is passed through unchanged.
+
+Usage:
+    python benchmarks/load_test.py --mode webhook --updates 20000 --chats 500
+    python benchmarks/load_test.py --mode polling --latency-ms 20 --rate-limit-every 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = '123456:LOADTEST'
+
+def make_update(update_id: int, chat_id: int, message_id: int, user_id: int) -> dict:
+    """Build a join (even message IDs) or leave (odd) service message update"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+    message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'supergroup', 'title': f'Chat {chat_id}'},
+        'from': user,
+    }
+    if message_id % 2 == 0:
+        message['new_chat_members'] = [user]
+        message['new_chat_member'] = user
+        message['new_chat_participant'] = user
+    else:
+        message['left_chat_member'] = user
+        message['left_chat_participant'] = user
+    return {'update_id': update_id, 'message': message}
+
+def make_flood(updates: int, chats: int) -> List[dict]:
+    """Round-robin the updates over the chats, as in a raid on many groups at once"""
+    return [
+        make_update(index + 1, -1001000000000 - index % chats, index // chats + 1, 5000000 + index)
+        for index in range(updates)
+    ]
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def peak_memory_mb(pid: int) -> Optional[float]:
+    """Peak resident set size of a process (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+async def wait_until(client: httpx.AsyncClient, url: str, check, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get(url)
+            if check(response):
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+async def send_webhook(client: httpx.AsyncClient, url: str, flood: List[dict],
+                       sent: Dict[str, float], concurrency: int):
+    """POST the updates to the webhook with a fixed number of concurrent requests"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for update in flood:
+        queue.put_nowait(update)
+
+    async def sender():
+        while not queue.empty():
+            update = queue.get_nowait()
+            message = update['message']
+            sent[f"{message['chat']['id']}:{message['message_id']}"] = time.time()
+            await client.post(url, content=json.dumps(update), headers={'content-type': 'application/json'})
+
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+
+async def send_polling(client: httpx.AsyncClient, api_url: str, flood: List[dict],
+                       sent: Dict[str, float], batch: int = 100):
+    """Queue the updates at the fake API for the bot's getUpdates calls"""
+    for start in range(0, len(flood), batch):
+        chunk = flood[start:start + batch]
+        now = time.time()
+        for update in chunk:
+            message = update['message']
+            sent[f"{message['chat']['id']}:{message['message_id']}"] = now
+        await client.post(f'{api_url}/control/updates', content=json.dumps(chunk))
+
+async def run(args):
+    api_url = f'http://127.0.0.1:{args.api_port}'
+    bot_url = f'http://127.0.0.1:{args.bot_port}'
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+
+    api = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_bot_api.py'),
+        '--token', TOKEN, '--port', str(args.api_port),
+        '--latency-ms', str(args.latency_ms),
+        '--rate-limit-every', str(args.rate_limit_every),
+        '--forbidden-chats', *map(str, args.forbidden_chats),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    bot_env = {
+        **os.environ,
+        'TELEGRAM_BOT_TOKEN': TOKEN,
+        'TELEGRAM_API_URL': f'{api_url}/bot',
+        'WEBHOOK_URL': bot_url if args.mode == 'webhook' else '',
+        'PORT': str(args.bot_port),
+        'STORAGE_FILE': os.path.join(workdir, 'bot_settings.json'),
+        'SQLITE_FILE': os.path.join(workdir, 'bot_settings.db'),
+        'LOG_LEVEL': 'WARNING',
+    }
+    bot = None
+
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            await wait_until(client, f'{api_url}/control/stats', lambda r: r.status_code == 200, 15)
+
+            bot = subprocess.Popen([sys.executable, os.path.join(ROOT, 'app.py')], env=bot_env,
+                                   cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            await wait_until(client, f'{bot_url}/health',
+                             lambda r: r.status_code == 200 and r.json().get('bot') == 'running', 30)
+
+            flood = make_flood(args.updates, args.chats)
+            forbidden = set(args.forbidden_chats)
+            expected = sum(1 for update in flood if update['message']['chat']['id'] not in forbidden)
+            sent: Dict[str, float] = {}
+
+            started = time.time()
+            if args.mode == 'webhook':
+                await send_webhook(client, f'{bot_url}/webhook', flood, sent, args.concurrency)
+            else:
+                await send_polling(client, api_url, flood, sent)
+            sending_done = time.time()
+
+            deadline = time.monotonic() + args.timeout
+            while True:
+                stats = (await client.get(f'{api_url}/control/stats')).json()
+                if len(stats['deleted']) >= expected or time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(0.2)
+
+            memory = peak_memory_mb(bot.pid)
+    finally:
+        for process in (bot, api):
+            if process is not None:
+                process.terminate()
+                process.wait(10)
+
+    deleted = stats['deleted']
+    latencies = [deleted[key] - sent_at for key, sent_at in sent.items() if key in deleted]
+    finished = max(deleted.values()) if deleted else time.time()
+
+    print(f"mode                 {args.mode}")
+    print(f"updates sent         {len(sent)} to {args.chats} chats in {sending_done - started:.2f}s")
+    print(f"messages deleted     {len(deleted)}/{expected}")
+    print(f"throughput           {len(deleted) / max(finished - started, 1e-9):.1f} updates/s")
+    if latencies:
+        print(f"latency p50          {percentile(latencies, 0.50) * 1000:.1f} ms")
+        print(f"latency p99          {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"api calls            {stats['calls']} ({stats['rate_limited']} answered with 429)")
+    print(f"bot peak memory      {f'{memory:.1f} MB' if memory else 'n/a'}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=('webhook', 'polling'), default='webhook')
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent webhook requests')
+    parser.add_argument('--latency-ms', type=float, default=0, help='fake API latency per call')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth API call with 429')
+    parser.add_argument('--forbidden-chats', type=int, nargs='*', default=[], help='chat IDs without delete rights')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for all deletions')
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--bot-port', type=int, default=8080)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -2,69 +2,108 @@
 Telegram bot handlers for commands, callbacks, and message processing
 """
 
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.constants import ChatType
+from telegram.ext import Application
 from storage import Storage
+from admin_cache import admin_cache
+from backup import BackupManager
+from analytics import DELETED, JOIN, LEAVE, ChatAnalytics
+from deletion import DeletionBatcher, is_rights_error
+from timing_wheel import SelfDestructScheduler
+from scheduler import Priority, RequestScheduler
+from rights import RightsTracker
+from raid import RaidDetector
+from logging_setup import SummaryLog
 from config import Config
+from metrics import DELETES, RAID_CHATS, SCHEDULER_QUEUE_DEPTH, timed_handler
+from rendering import (
+    GROUP_WELCOME_TEXT, INVITE_TEXT, PERMISSION_WARNING_TEXT, PRIVATE_WELCOME_TEXT,
+    SUPPORT_KEYBOARD, Renderer
+)
 
 logger = logging.getLogger(__name__)
 
+# One line per chat and interval instead of one per deleted message
+deleted_summary = SummaryLog(
+    logger, "Deleted {count} join/leave messages in chat {key} ({label}) in the last {interval:g}s"
+)
+
 class BotHandlers:
-    def __init__(self, storage: Storage):
+    def __init__(self, storage: Storage, deleter: DeletionBatcher = None, scheduler: RequestScheduler = None):
         self.storage = storage
+        # All outbound API calls go through the scheduler
+        self.scheduler = scheduler or RequestScheduler()
+        self.deleter = deleter or DeletionBatcher(scheduler=self.scheduler)
+        self.self_destruct = SelfDestructScheduler(storage, self.deleter)
+        self.rights = RightsTracker(storage)
+        self.renderer = Renderer()
+        self.raids = RaidDetector()
+        self.analytics = ChatAnalytics(storage)
+        SCHEDULER_QUEUE_DEPTH.set_function(lambda: self.scheduler.queue_depth)
+        RAID_CHATS.set_function(lambda: self.raids.active_count)
+        self.backups = BackupManager(storage)
+        self._backup_task = None
+    
+    async def shutdown(self, application: Application):
+        """Flush outstanding work when the application stops"""
+        if self._backup_task is not None:
+            self._backup_task.cancel()
+        await self.self_destruct.stop()
+        await self.deleter.flush_all()
+        await self.scheduler.stop()
+        self.analytics.stop()
+        await asyncio.to_thread(self.storage.close)
     
+    async def post_init(self, application: Application):
+        """Cache the bot identity and start background jobs once the application is initialized"""
+        self.renderer.set_identity(application.bot.bot)
+        await self.self_destruct.start(application.bot)
+        self.analytics.start()
+        if Config.BACKUP_INTERVAL_MINUTES > 0:
+            self._backup_task = asyncio.ensure_future(self.backups.run_periodically())
+    
+    @timed_handler
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         chat = update.effective_chat
-        user = update.effective_user
         
         if chat.type == ChatType.PRIVATE:
-            welcome_text = (
-                "Join/Leave Message Hider Bot\n\n"
-                "Hello! I Help Keep Your Group Chats Clean By Automatically Hiding "
-                "Join And Leave Messages.\n\n"
-                "**How To Use:**\n"
-                "1. Add Me To Your Group Chat\n"
-                "2. Make Me An Admin With 'Delete Messages' Permission\n"
-                "3. I'll Automatically Start Hiding Join/leave Messages\n\n"
-                "𝘛𝘩𝘢𝘵'𝘴 𝘐𝘵! 𝘕𝘰 𝘊𝘰𝘯𝘧𝘪𝘨𝘶𝘳𝘢𝘵𝘪𝘰𝘯 𝘕𝘦𝘦𝘥𝘦𝘥 - 𝘐 𝘞𝘰𝘳𝘬 𝘈𝘶𝘵𝘰𝘮𝘢𝘵𝘪𝘤𝘢𝘭𝘭𝘺 𝘖𝘯𝘤𝘦 𝘠𝘰𝘶 𝘎𝘪𝘷𝘦 𝘔𝘦 𝘈𝘥𝘮𝘪𝘯 𝘗𝘦𝘳𝘮𝘪𝘴𝘴𝘪𝘰𝘯𝘴.  "
-            )
+            # Keyboard with the "Add to Group" button is prebuilt from the cached identity
+            self.renderer.ensure_identity(context.bot)
             
-            # Get bot username for the inline button
-            bot_info = await context.bot.get_me()
-            bot_username = bot_info.username
-            
-            # Create inline keyboard with "Add to Group" button
-            keyboard = [
-                [InlineKeyboardButton(
-                    '➕ 𝗔𝗱𝗱 𝗠𝗲 𝗧𝗼 𝗬𝗼𝘂𝗿 𝗚𝗿𝗼𝘂𝗽𝘀 ➕', 
-                    url=f'https://t.me/{bot_username}?startgroup=true'
-                )]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                welcome_text,
+            await self.scheduler.submit(
+                chat.id, Priority.NOTICE,
+                update.message.reply_text,
+                PRIVATE_WELCOME_TEXT,
                 parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-        else:
-            # In group chat
-            welcome_text = (
-                "**Join/Leave Message Hider Bot is now active!**\n\n"
-                "I will automatically hide join/leave messages to keep your chat clean.\n\n"
-                "Make sure I have admin permissions with 'Delete Messages' enabled."
+                reply_markup=self.renderer.start_keyboard
             )
-            
-            await update.message.reply_text(
-                welcome_text,
+        elif not self.raids.in_raid(chat.id):
+            # In group chat; non-essential replies are dropped during a raid
+            await self.scheduler.submit(
+                chat.id, Priority.NOTICE,
+                update.message.reply_text,
+                GROUP_WELCOME_TEXT,
                 parse_mode='Markdown'
             )
     
-
+    async def handle_my_chat_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Track changes of the bot's own membership and rights"""
+        member_update = update.my_chat_member
+        if member_update.chat.type == ChatType.PRIVATE:
+            return
+        
+        self.rights.on_member_update(member_update)
     
+    async def handle_chat_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Drop the cached admin roster when someone is promoted or demoted"""
+        admin_cache.on_member_update(update.chat_member)
+    
+    @timed_handler
     async def handle_join_leave(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle join/leave messages"""
         message = update.message
@@ -76,39 +115,25 @@ class BotHandlers:
         
         # Check if the bot itself was added to the group
         if message.new_chat_members:
-            bot_info = await context.bot.get_me()
+            self.renderer.ensure_identity(context.bot)
             for new_member in message.new_chat_members:
-                if new_member.id == bot_info.id:
+                if new_member.id == self.renderer.bot_id:
+                    if self.raids.in_raid(chat.id):
+                        return
                     # Bot was added to the group, send welcome message
-                    invite_message = (
-                        "**🎊 Thank You** For **Adding** Me To **Your Group!**\n\n "
-                        "Join/Leave Message Hider Bot is now active!**\n\n"
-                        "I Will Automatically Hide Join And Leave Messages To Keep Your Chat Clean.\n\n"
-                        "**To Get Started:**\n"
-                        "1. Make Me An Admin With 'Delete Messages' Permission\n"
-                        "2. That's it! I'll Automatically Start Hiding Join/Leave Notifications\n\n"
-                    )
-                    
-                    # Create inline keyboard with support group button (if configured)
-                    keyboard = []
-                    if Config.SUPPORT_GROUP_URL:
-                        keyboard.append([InlineKeyboardButton(
-                            '💬 Support Group', 
-                            url=Config.SUPPORT_GROUP_URL
-                        )])
-                    
-                    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
-                    
                     try:
-                        await context.bot.send_message(
+                        sent = await self.scheduler.submit(
+                            chat.id, Priority.NOTICE,
+                            context.bot.send_message,
                             chat.id,
-                            invite_message,
+                            INVITE_TEXT,
                             parse_mode='Markdown',
-                            reply_markup=reply_markup
+                            reply_markup=SUPPORT_KEYBOARD
                         )
-                        logger.info(f"Sent welcome message to new group {chat.id} ({chat.title})")
+                        self._schedule_delete(sent, Config.WELCOME_DELETE_AFTER_SECONDS)
+                        logger.info("Sent welcome message to new group %s (%s)", chat.id, chat.title)
                     except Exception as e:
-                        logger.error(f"Failed to send welcome message to chat {chat.id}: {e}")
+                        logger.error("Failed to send welcome message to chat %s: %s", chat.id, e)
                     
                     # Don't delete the bot's own join message yet, let it be visible briefly
                     return
@@ -116,24 +141,73 @@ class BotHandlers:
         # Always try to delete join/leave messages (bot is always enabled now)
         # Check if this is a join/leave message
         if message.new_chat_members or message.left_chat_member:
-            try:
-                # Delete the join/leave message
-                await message.delete()
-                logger.info(f"Deleted join/leave message in chat {chat.id} ({chat.title})")
-            except Exception as e:
-                logger.error(f"Failed to delete message in chat {chat.id}: {e}")
-                # If we can't delete messages, we might not have the right permissions
-                if "not enough rights" in str(e).lower() or "insufficient rights" in str(e).lower():
-                    # Try to send a warning to admins
-                    try:
-                        await context.bot.send_message(
-                            chat.id,
-                            "⚠️ **Permission Error**\n\n"
-                            "I need admin privileges with 'Delete Messages' permission "
-                            "to hide join/leave messages.\n\n"
-                            "Please make me an admin with the required permissions.",
-                            parse_mode='Markdown'
-                        )
-                    except:
-                        pass  # If we can't even send messages, just log it
-                        
\ No newline at end of file
+            raid = self.raids.record(chat.id)
+            if message.new_chat_members:
+                self.analytics.record(chat.id, JOIN, len(message.new_chat_members))
+            else:
+                self.analytics.record(chat.id, LEAVE)
+            
+            # Skip the API call where we know we cannot delete
+            if not self.rights.can_delete(chat.id):
+                logger.debug("Skipping delete in chat %s, bot lacks delete rights", chat.id)
+                DELETES.inc('skipped')
+                # A warning held back during a raid goes out once the raid is over
+                if not raid and self.rights.needs_warning(chat.id):
+                    self.rights.mark_warned(chat.id)
+                    context.application.create_task(self._send_permission_warning(context, chat), update=update)
+                return
+            
+            # Deletions are coalesced per chat, so don't hold up the next update
+            # while this message waits for its batch to be flushed
+            context.application.create_task(
+                self._delete_service_message(context, chat, message.message_id, raid),
+                update=update
+            )
+    
+    def _schedule_delete(self, message, delay: int):
+        """Have one of the bot's own messages deleted after a delay (0 = keep it)"""
+        if delay > 0 and message is not None:
+            self.self_destruct.schedule(message.chat_id, message.message_id, delay)
+    
+    async def _delete_service_message(self, context: ContextTypes.DEFAULT_TYPE, chat, message_id: int,
+                                      raid: bool = False):
+        """
+        Delete a join/leave message and warn the chat if rights are missing
+        
+        During a raid the deletes are collected for longer and failures are
+        left to the raid summaries; the warning waits until the raid is over.
+        """
+        try:
+            # Delete the join/leave message (coalesced with others from this chat)
+            window = Config.RAID_DELETE_WINDOW_MS / 1000 if raid else None
+            await self.deleter.delete(context.bot, chat.id, message_id, window)
+            DELETES.inc('succeeded')
+            self.analytics.record(chat.id, DELETED)
+            self.rights.on_delete_succeeded(chat.id)
+            deleted_summary.add(chat.id, chat.title)
+        except Exception as e:
+            DELETES.inc('failed')
+            if raid:
+                logger.debug("Failed to delete message in chat %s during raid: %s", chat.id, e)
+            else:
+                logger.error("Failed to delete message in chat %s: %s", chat.id, e)
+            # If we can't delete messages, we might not have the right permissions;
+            # the state changes during a raid too, but the warning is left to the
+            # first join/leave after it (see handle_join_leave)
+            if is_rights_error(e) and self.rights.on_delete_failed(chat.id) and not raid:
+                self.rights.mark_warned(chat.id)
+                await self._send_permission_warning(context, chat)
+    
+    async def _send_permission_warning(self, context: ContextTypes.DEFAULT_TYPE, chat):
+        """Tell the chat's admins that the bot lacks delete rights"""
+        try:
+            sent = await self.scheduler.submit(
+                chat.id, Priority.NOTICE,
+                context.bot.send_message,
+                chat.id,
+                PERMISSION_WARNING_TEXT,
+                parse_mode='Markdown'
+            )
+            self._schedule_delete(sent, Config.PERMISSION_WARNING_DELETE_AFTER_SECONDS)
+        except:
+            pass  # If we can't even send messages, just log it
@@ -0,0 +1,87 @@
+"""
+Construction of the Telegram Application and handler registration
+"""
+
+import logging
+from telegram import Update
+from telegram.ext import Application, ChatMemberHandler, CommandHandler, MessageHandler, TypeHandler, filters
+from config import Config
+from bot_handlers import BotHandlers
+from api_client import BotAPIRequest, build_get_updates_request, build_request
+from metrics import UPDATE_LANES, UPDATE_QUEUE_DEPTH, UPDATES_PENDING
+from startup import startup_timer
+from storage import Storage
+from update_processor import ChatOrderedUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+def build_application(bot_token: str, storage: Storage, updater: bool = True,
+                      request: BotAPIRequest = None) -> Application:
+    """
+    Build a Telegram Application with all bot handlers registered
+
+    Args:
+        bot_token: Telegram bot token
+        storage: Storage instance shared by the handlers
+        updater: Whether the application fetches updates itself (optional)
+        request: Request for outbound calls, e.g. one shared by several bots (optional)
+
+    Returns:
+        Application: Configured (but not yet initialized) application
+    """
+    bot_handlers = BotHandlers(storage)
+    request = request or build_request()
+
+    async def post_init(application: Application):
+        await bot_handlers.post_init(application)
+        await startup_timer.on_post_init(application)
+
+    builder = (
+        Application.builder()
+        .token(bot_token)
+        .base_url(Config.TELEGRAM_API_URL)
+        .request(request)
+        .post_init(post_init)
+        .post_stop(bot_handlers.shutdown)
+    )
+    if Config.UPDATE_CONCURRENCY > 1:
+        processor = ChatOrderedUpdateProcessor()
+        builder.concurrent_updates(processor)
+        UPDATE_LANES.set_function(lambda: processor.lane_count)
+        UPDATES_PENDING.set_function(lambda: processor.pending)
+    if updater:
+        builder.get_updates_request(build_get_updates_request())
+    else:
+        builder.updater(None)
+
+    application = builder.build()
+    UPDATE_QUEUE_DEPTH.set_function(application.update_queue.qsize)
+    register_handlers(application, bot_handlers)
+    # Read by the web server's /stats route
+    application.bot_data['analytics'] = bot_handlers.analytics
+    return application
+
+def register_handlers(application: Application, bot_handlers: BotHandlers):
+    """
+    Register the bot handlers on an application
+
+    Args:
+        application: Telegram Application
+        bot_handlers: Handler container
+    """
+    application.add_handler(CommandHandler("start", bot_handlers.start_command))
+    application.add_handler(MessageHandler(
+        filters.StatusUpdate.NEW_CHAT_MEMBERS | filters.StatusUpdate.LEFT_CHAT_MEMBER,
+        bot_handlers.handle_join_leave
+    ))
+    application.add_handler(ChatMemberHandler(
+        bot_handlers.handle_my_chat_member,
+        ChatMemberHandler.MY_CHAT_MEMBER
+    ))
+    if Config.ADMIN_CACHE_ENABLED:
+        application.add_handler(ChatMemberHandler(
+            bot_handlers.handle_chat_member,
+            ChatMemberHandler.CHAT_MEMBER
+        ))
+    # Runs after the groups above, records time-to-first-processed-update
+    application.add_handler(TypeHandler(Update, startup_timer.on_update), group=99)
@@ -0,0 +1,159 @@
+"""
+Catch-up on updates that arrived while the bot was down
+
+Before long polling starts, the backlog is fetched in full getUpdates
+batches and handed to the Application as fast as it processes them
+(concurrently across chats with UPDATE_CONCURRENCY > 1). Join/leave
+messages too old to be deleted are skipped. Each getUpdates call confirms
+everything before its offset and the loop ends with a call that returns
+nothing, or, if fetching fails, with one that only confirms the last
+batch, so the Updater continues exactly after what was queued.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Optional
+from telegram import Update
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import Application
+from config import Config
+from metrics import CATCHUP_LAG_SECONDS, CATCHUP_REMAINING, CATCHUP_UPDATES
+from prefilter import ALLOWED_UPDATES
+from update_processor import wait_for_capacity
+
+logger = logging.getLogger(__name__)
+
+# Bot API maximum for the limit parameter of getUpdates
+BATCH_SIZE = 100
+# Attempts per getUpdates call before leaving the rest to the Updater
+ATTEMPTS = 3
+
+def is_stale_service_message(update: Update, now: float, max_age: float) -> bool:
+    """
+    Check whether an update is a join/leave message too old to delete
+
+    Args:
+        update: Decoded update
+        now: Current time in seconds since the epoch
+        max_age: Age in seconds beyond which deletes fail
+
+    Returns:
+        bool: True if handling the update would only produce a failing delete
+    """
+    message = update.message
+    if message is None or not (message.new_chat_members or message.left_chat_member):
+        return False
+    return now - message.date.timestamp() > max_age
+
+class BacklogCatchUp:
+    """Drains the pending updates of a bot into its Application"""
+
+    def __init__(self, application: Application, max_age: float = None, feed_limit: int = None):
+        """
+        Initialize the catch-up
+
+        Args:
+            application: Started Telegram Application the updates are queued on
+            max_age: Skip join/leave messages older than this many seconds (optional)
+            feed_limit: Queued updates at which fetching pauses (optional)
+        """
+        self.application = application
+        self.max_age = max_age or Config.CATCHUP_MAX_AGE_SECONDS
+        self.feed_limit = feed_limit or Config.INGRESS_FEED_LIMIT
+        self.expected = 0
+        self.fetched = 0
+        self.skipped = 0
+        self.running = False
+        self._newest_date: Optional[float] = None
+        CATCHUP_REMAINING.set_function(self._remaining)
+        CATCHUP_LAG_SECONDS.set_function(self._lag)
+
+    def _remaining(self) -> int:
+        return max(self.expected - self.fetched, 0) if self.running else 0
+
+    def _lag(self) -> float:
+        if not self.running or self._newest_date is None:
+            return 0
+        return max(time.time() - self._newest_date, 0)
+
+    async def _fetch(self, offset: int, limit: int = BATCH_SIZE) -> Optional[tuple]:
+        """One getUpdates call, retried; None if it keeps failing"""
+        for attempt in range(ATTEMPTS):
+            try:
+                return await self.application.bot.get_updates(
+                    offset=offset, limit=limit, timeout=0, allowed_updates=ALLOWED_UPDATES
+                )
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramError as e:
+                logger.warning(f"getUpdates failed during catch-up (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+        return None
+
+    async def _confirm(self, offset: int):
+        """
+        Confirm the updates already queued, so the Updater does not get them again
+
+        Args:
+            offset: One past the last queued update ID (0 = nothing queued)
+        """
+        if not offset:
+            return
+        # Updates from the offset on stay pending, whatever this returns
+        if await self._fetch(offset, limit=1) is None:
+            logger.error(f"Could not confirm the backlog before update {offset}, it will be processed again")
+
+    async def run(self) -> int:
+        """
+        Fetch and queue the whole backlog
+
+        Returns:
+            int: Number of updates fetched
+        """
+        bot = self.application.bot
+        # getUpdates is refused while a webhook is set; keep its pending updates
+        await bot.delete_webhook(drop_pending_updates=False)
+        try:
+            self.expected = (await bot.get_webhook_info()).pending_update_count
+        except TelegramError as e:
+            logger.debug(f"Could not read the pending update count: {e}")
+
+        if self.expected:
+            logger.info(f"Catching up on about {self.expected} pending updates")
+        started = time.monotonic()
+        self.running = True
+        offset = 0
+        try:
+            while True:
+                updates = await self._fetch(offset)
+                if updates is None:
+                    logger.error(f"Catch-up stopped after {self.fetched} updates")
+                    await self._confirm(offset)
+                    break
+                if not updates:
+                    break
+
+                now = time.time()
+                for update in updates:
+                    if is_stale_service_message(update, now, self.max_age):
+                        self.skipped += 1
+                        CATCHUP_UPDATES.inc('too_old')
+                    else:
+                        self.application.update_queue.put_nowait(update)
+                        CATCHUP_UPDATES.inc('queued')
+                    if update.effective_message is not None:
+                        self._newest_date = update.effective_message.date.timestamp()
+                self.fetched += len(updates)
+                offset = updates[-1].update_id + 1
+
+                await wait_for_capacity(self.application, self.feed_limit)
+        finally:
+            self.running = False
+
+        if self.fetched:
+            logger.info(
+                f"Caught up on {self.fetched} updates in {time.monotonic() - started:.1f}s, "
+                f"{self.skipped} join/leave messages were too old to delete"
+            )
+        return self.fetched
@@ -0,0 +1,372 @@
+"""
+Compact in-memory table of chat settings
+"""
+
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from collections.abc import Mapping
+
+# Settings keys kept in dedicated arrays; anything else goes to the sparse extras
+CORE_KEYS = ('enabled', 'created_at', 'updated_at')
+
+def to_epoch(value) -> float:
+    """Convert an ISO timestamp (or epoch number) to epoch seconds, 0 meaning unset"""
+    if not value:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+def to_iso(epoch: float) -> Optional[str]:
+    """Convert epoch seconds back to the ISO format used in the settings file, keeping microseconds"""
+    return datetime.fromtimestamp(epoch).isoformat() if epoch else None
+
+class ChatIndex:
+    """
+    Array-backed chat settings
+
+    Chat IDs are kept sorted in an array and map to a slot; per-slot data
+    lives in parallel arrays (timestamps as float epoch seconds, precise to
+    the microsecond) and the enabled flags in a bitset. Slots of removed
+    chats are reused, so each slot also records the chat owning it. Counters are maintained on every change, so stats
+    never need a scan.
+    """
+
+    def __init__(self):
+        self._ids = array('q')
+        self._slots = array('q')
+        # Chat ID per slot, 0 for free slots
+        self._owners = array('q')
+        self._created = array('d')
+        self._updated = array('d')
+        self._enabled = bytearray()
+        self._extra: Dict[int, dict] = {}
+        self._free = array('q')
+        self._enabled_count = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return self.find(chat_id) >= 0
+
+    @property
+    def enabled_count(self) -> int:
+        """Number of chats with the hider enabled"""
+        return self._enabled_count
+
+    def find(self, chat_id: int) -> int:
+        """
+        Look up the slot of a chat
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            int: Slot number, or -1 if the chat is unknown
+        """
+        pos = bisect_left(self._ids, chat_id)
+        if pos < len(self._ids) and self._ids[pos] == chat_id:
+            return self._slots[pos]
+        return -1
+
+    def is_enabled(self, slot: int) -> bool:
+        return bool(self._enabled[slot >> 3] & (1 << (slot & 7)))
+
+    def owner(self, slot: int) -> int:
+        """Chat ID holding a slot, 0 if the slot is free"""
+        return self._owners[slot]
+
+    def created_at(self, slot: int) -> float:
+        """Creation time of a slot in epoch seconds"""
+        return self._created[slot]
+
+    def updated_at(self, slot: int) -> float:
+        """Last update time of a slot in epoch seconds"""
+        return self._updated[slot]
+
+    def _set_enabled(self, slot: int, enabled: bool):
+        was_enabled = self.is_enabled(slot)
+        if enabled and not was_enabled:
+            self._enabled[slot >> 3] |= 1 << (slot & 7)
+            self._enabled_count += 1
+        elif was_enabled and not enabled:
+            self._enabled[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+            self._enabled_count -= 1
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+
+        slot = len(self._created)
+        self._owners.append(0)
+        self._created.append(0.0)
+        self._updated.append(0.0)
+        if slot >> 3 >= len(self._enabled):
+            self._enabled.append(0)
+        return slot
+
+    def put(self, chat_id: int, enabled: bool, created_at: float, updated_at: float,
+            extra: Optional[dict] = None) -> int:
+        """
+        Insert or replace the settings of a chat
+
+        Args:
+            chat_id: Telegram chat ID
+            enabled: Whether the hider is enabled
+            created_at: Creation time in epoch seconds
+            updated_at: Last update time in epoch seconds
+            extra: Settings beyond the core keys (optional)
+
+        Returns:
+            int: Slot of the chat
+        """
+        pos = bisect_left(self._ids, chat_id)
+        if pos < len(self._ids) and self._ids[pos] == chat_id:
+            slot = self._slots[pos]
+        else:
+            slot = self._allocate()
+            self._ids.insert(pos, chat_id)
+            self._slots.insert(pos, slot)
+            self._owners[slot] = chat_id
+
+        self._fill(slot, enabled, created_at, updated_at, extra)
+        return slot
+
+    def _fill(self, slot: int, enabled: bool, created_at: float, updated_at: float, extra: Optional[dict]):
+        self._set_enabled(slot, enabled)
+        self._created[slot] = created_at
+        self._updated[slot] = updated_at
+        if extra:
+            self._extra[slot] = dict(extra)
+        else:
+            self._extra.pop(slot, None)
+
+    def put_settings(self, chat_id: int, settings: dict) -> int:
+        """
+        Insert or replace a chat from a settings dictionary
+
+        Args:
+            chat_id: Telegram chat ID
+            settings: Settings in the storage file format
+
+        Returns:
+            int: Slot of the chat
+        """
+        extra = {key: value for key, value in settings.items() if key not in CORE_KEYS}
+        return self.put(
+            chat_id,
+            bool(settings.get('enabled', False)),
+            to_epoch(settings.get('created_at')),
+            to_epoch(settings.get('updated_at')),
+            extra
+        )
+
+    def put_many(self, chats: Iterable[Tuple[int, dict]]) -> int:
+        """
+        Insert or replace many chats from (chat_id, settings) pairs in any order
+
+        New chats get their slots in input order and are merged into the
+        sorted arrays once at the end, where put_settings would shift the
+        arrays for every new chat. A chat given twice keeps its last settings.
+
+        Args:
+            chats: Chat IDs with settings in the storage file format
+
+        Returns:
+            int: Number of chats added
+        """
+        added: Dict[int, int] = {}
+        for chat_id, settings in chats:
+            slot = added.get(chat_id)
+            if slot is None:
+                slot = self.find(chat_id)
+                if slot < 0:
+                    slot = added[chat_id] = self._allocate()
+                    self._owners[slot] = chat_id
+            self._fill(
+                slot,
+                bool(settings.get('enabled', False)),
+                to_epoch(settings.get('created_at')),
+                to_epoch(settings.get('updated_at')),
+                {key: value for key, value in settings.items() if key not in CORE_KEYS}
+            )
+
+        if added:
+            # Two sorted runs, which sorted() merges in linear time
+            merged = sorted(chain(zip(self._ids, self._slots), sorted(added.items())))
+            self._ids = array('q', [chat_id for chat_id, _ in merged])
+            self._slots = array('q', [slot for _, slot in merged])
+        return len(added)
+
+    def remove_many(self, chat_ids: Iterable[int]) -> int:
+        """
+        Remove many chats with one pass over the sorted arrays
+
+        Args:
+            chat_ids: Telegram chat IDs; unknown ones are skipped
+
+        Returns:
+            int: Number of chats removed
+        """
+        removed = set()
+        for chat_id in chat_ids:
+            slot = self.find(chat_id)
+            if slot >= 0 and chat_id not in removed:
+                removed.add(chat_id)
+                self._release(slot)
+        if removed:
+            kept = [(chat_id, slot) for chat_id, slot in zip(self._ids, self._slots) if chat_id not in removed]
+            self._ids = array('q', [chat_id for chat_id, _ in kept])
+            self._slots = array('q', [slot for _, slot in kept])
+        return len(removed)
+
+    def remove(self, chat_id: int) -> bool:
+        """
+        Remove a chat
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            bool: True if the chat existed
+        """
+        pos = bisect_left(self._ids, chat_id)
+        if pos >= len(self._ids) or self._ids[pos] != chat_id:
+            return False
+
+        self._release(self._slots[pos])
+        del self._ids[pos]
+        del self._slots[pos]
+        return True
+
+    def _release(self, slot: int):
+        self._set_enabled(slot, False)
+        self._owners[slot] = 0
+        self._created[slot] = 0.0
+        self._updated[slot] = 0.0
+        self._extra.pop(slot, None)
+        self._free.append(slot)
+
+    def view(self, chat_id: int) -> Optional['ChatView']:
+        """Read-only view of a chat's settings, or None if unknown"""
+        slot = self.find(chat_id)
+        return ChatView(self, chat_id, slot) if slot >= 0 else None
+
+    def settings(self, slot: int) -> dict:
+        """Settings of a slot in the storage file format"""
+        settings = {
+            'enabled': self.is_enabled(slot),
+            'created_at': to_iso(self._created[slot]),
+            'updated_at': to_iso(self._updated[slot]),
+        }
+        extra = self._extra.get(slot)
+        if extra:
+            settings.update(extra)
+        return settings
+
+    def chat_ids(self) -> array:
+        """Sorted chat IDs; the live array, so copy it before changing the index"""
+        return self._ids
+
+    def items(self) -> Iterator:
+        """Iterate over (chat_id, slot) pairs in chat ID order"""
+        return zip(self._ids, self._slots)
+
+    def copy(self) -> 'ChatIndex':
+        """Point-in-time copy; the arrays are copied in bulk"""
+        clone = ChatIndex.__new__(ChatIndex)
+        clone._ids = array('q', self._ids)
+        clone._slots = array('q', self._slots)
+        clone._owners = array('q', self._owners)
+        clone._created = array('d', self._created)
+        clone._updated = array('d', self._updated)
+        clone._enabled = bytearray(self._enabled)
+        clone._extra = {slot: dict(extra) for slot, extra in self._extra.items()}
+        clone._free = array('q', self._free)
+        clone._enabled_count = self._enabled_count
+        return clone
+
+    def to_dict(self) -> Dict[str, dict]:
+        """All chats in the storage file format, keyed by chat ID string"""
+        return {str(chat_id): self.settings(slot) for chat_id, slot in self.items()}
+
+class ChatView(Mapping):
+    """
+    Read-only mapping over one chat's settings in a ChatIndex
+
+    The view follows its chat: if the slot was freed and reused meanwhile,
+    the chat is looked up again, and a removed chat reads as empty.
+    """
+
+    __slots__ = ('_index', '_chat_id', '_slot')
+
+    def __init__(self, index: ChatIndex, chat_id: int, slot: int):
+        self._index = index
+        self._chat_id = chat_id
+        self._slot = slot
+
+    def _current_slot(self) -> int:
+        if self._slot < 0 or self._index.owner(self._slot) != self._chat_id:
+            self._slot = self._index.find(self._chat_id)
+        return self._slot
+
+    def __getitem__(self, key: str) -> Any:
+        slot = self._current_slot()
+        if slot < 0:
+            raise KeyError(key)
+        if key == 'enabled':
+            return self._index.is_enabled(slot)
+        if key == 'created_at':
+            return to_iso(self._index.created_at(slot))
+        if key == 'updated_at':
+            return to_iso(self._index.updated_at(slot))
+        extra = self._index._extra.get(slot)
+        if extra is None:
+            raise KeyError(key)
+        return extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        slot = self._current_slot()
+        if slot < 0:
+            return
+        yield from CORE_KEYS
+        yield from self._index._extra.get(slot, ())
+
+    def __len__(self) -> int:
+        slot = self._current_slot()
+        if slot < 0:
+            return 0
+        return len(CORE_KEYS) + len(self._index._extra.get(slot, ()))
+
+    def __repr__(self) -> str:
+        return f"ChatView({dict(self)!r})"
+
+class ChatsView(Mapping):
+    """Read-only mapping of chat ID strings to ChatView, optionally enabled chats only"""
+
+    __slots__ = ('_index', '_enabled_only')
+
+    def __init__(self, index: ChatIndex, enabled_only: bool = False):
+        self._index = index
+        self._enabled_only = enabled_only
+
+    def __getitem__(self, chat_key: str) -> ChatView:
+        try:
+            slot = self._index.find(int(chat_key))
+        except ValueError:
+            raise KeyError(chat_key)
+        if slot < 0 or (self._enabled_only and not self._index.is_enabled(slot)):
+            raise KeyError(chat_key)
+        return ChatView(self._index, int(chat_key), slot)
+
+    def __iter__(self) -> Iterator[str]:
+        for chat_id, slot in self._index.items():
+            if not self._enabled_only or self._index.is_enabled(slot):
+                yield str(chat_id)
+
+    def __len__(self) -> int:
+        return self._index.enabled_count if self._enabled_only else len(self._index)
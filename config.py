@@ -10,6 +10,27 @@ class Config:
     # Telegram Bot Token (required)
     BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
     
+    # Host several bots in one process instead: comma separated name=token pairs,
+    # e.g. "main=123:AAA,acme=456:BBB"; each bot gets /webhook/<name> and its own
+    # storage namespace
+    BOT_TOKENS = os.getenv('BOT_TOKENS', '')
+    
+    # Bot API endpoint, e.g. a self-hosted Bot API server or a local test double
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+    
+    # Bot API HTTP clients: outbound calls and getUpdates use separate pools;
+    # BOT_API_METHOD_TIMEOUTS overrides the read timeout per method, e.g.
+    # "deleteMessages=10,sendMessage=8"; HTTP/2 needs the h2 package
+    BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', 256))
+    BOT_API_UPDATES_POOL_SIZE = int(os.getenv('BOT_API_UPDATES_POOL_SIZE', 1))
+    BOT_API_KEEPALIVE_SECONDS = float(os.getenv('BOT_API_KEEPALIVE_SECONDS', 60))
+    BOT_API_HTTP_VERSION = os.getenv('BOT_API_HTTP_VERSION', '1.1')
+    BOT_API_CONNECT_TIMEOUT = float(os.getenv('BOT_API_CONNECT_TIMEOUT', 5))
+    BOT_API_READ_TIMEOUT = float(os.getenv('BOT_API_READ_TIMEOUT', 5))
+    BOT_API_WRITE_TIMEOUT = float(os.getenv('BOT_API_WRITE_TIMEOUT', 5))
+    BOT_API_POOL_TIMEOUT = float(os.getenv('BOT_API_POOL_TIMEOUT', 1))
+    BOT_API_METHOD_TIMEOUTS = os.getenv('BOT_API_METHOD_TIMEOUTS', '')
+    
     # Webhook configuration (optional)
     WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
     
@@ -17,8 +38,44 @@ class Config:
     PORT = int(os.getenv('PORT', 5000))
     HOST = '0.0.0.0'
     
-    # Storage configuration
+    # 'asgi' runs the web server and the bot on one event loop, 'flask' is the legacy mode
+    SERVER_MODE = os.getenv('SERVER_MODE', 'asgi')
+    SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', 2048))
+    
+    # Polling mode: process the updates that arrived while the bot was down instead
+    # of dropping them, skipping join/leave messages older than CATCHUP_MAX_AGE_SECONDS
+    # (Telegram refuses to delete messages older than 48 hours)
+    CATCHUP_ENABLED = os.getenv('CATCHUP_ENABLED', 'true').lower() == 'true'
+    CATCHUP_MAX_AGE_SECONDS = int(os.getenv('CATCHUP_MAX_AGE_SECONDS', 47 * 3600))
+    
+    # Worker processes with updates sharded by chat (0 = single process, webhook only)
+    WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 0))
+    
+    # Storage configuration ('json' or 'sqlite')
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
     STORAGE_FILE = os.getenv('STORAGE_FILE', 'bot_settings.json')
+    SQLITE_FILE = os.getenv('SQLITE_FILE', 'bot_settings.db')
+    
+    # Load settings in a background thread so the server can start immediately
+    STORAGE_LAZY_LOAD = os.getenv('STORAGE_LAZY_LOAD', 'true').lower() == 'true'
+    
+    # Write-behind: JSON groups changes into one atomic file write at most every
+    # STORAGE_FLUSH_INTERVAL_MS, or sooner after STORAGE_FLUSH_MAX_CHANGES changes;
+    # SQLite commits queued writes in a background thread
+    STORAGE_WRITE_BEHIND = os.getenv('STORAGE_WRITE_BEHIND', 'true').lower() == 'true'
+    STORAGE_FLUSH_INTERVAL_MS = int(os.getenv('STORAGE_FLUSH_INTERVAL_MS', 1000))
+    STORAGE_FLUSH_MAX_CHANGES = int(os.getenv('STORAGE_FLUSH_MAX_CHANGES', 500))
+    
+    # Compressed backups: incremental every BACKUP_INTERVAL_MINUTES (0 = off), with a
+    # full backup after every BACKUP_FULL_EVERY incremental ones
+    BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+    BACKUP_INTERVAL_MINUTES = float(os.getenv('BACKUP_INTERVAL_MINUTES', 0))
+    BACKUP_FULL_EVERY = int(os.getenv('BACKUP_FULL_EVERY', 24))
+    BACKUP_COMPRESSION_LEVEL = int(os.getenv('BACKUP_COMPRESSION_LEVEL', 6))
+    
+    # Join/leave analytics are counted in memory and added to the per-chat
+    # 'stats' setting every ANALYTICS_ROLLUP_SECONDS
+    ANALYTICS_ROLLUP_SECONDS = float(os.getenv('ANALYTICS_ROLLUP_SECONDS', 60))
     
     # Bot settings
     DEFAULT_CHAT_SETTINGS = {
@@ -27,16 +84,85 @@ class Config:
         'updated_at': None
     }
     
+    # Deletion batching: collect service messages per chat for this long (or up to
+    # this many) before removing them with one deleteMessages call
+    DELETE_BATCH_WINDOW_MS = int(os.getenv('DELETE_BATCH_WINDOW_MS', 250))
+    DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', 100))
+    
+    # Self-destructing bot messages: delete the welcome message and the permission
+    # warning after this many seconds (0 = keep), checked every TIMING_WHEEL_TICK_MS
+    WELCOME_DELETE_AFTER_SECONDS = int(os.getenv('WELCOME_DELETE_AFTER_SECONDS', 600))
+    PERMISSION_WARNING_DELETE_AFTER_SECONDS = int(os.getenv('PERMISSION_WARNING_DELETE_AFTER_SECONDS', 3600))
+    TIMING_WHEEL_TICK_MS = int(os.getenv('TIMING_WHEEL_TICK_MS', 1000))
+    SELF_DESTRUCT_PERSIST_SECONDS = float(os.getenv('SELF_DESTRUCT_PERSIST_SECONDS', 5))
+    
+    # Outbound request scheduling (Telegram allows ~30 requests/s overall and
+    # ~20 messages/min per group); deletes are paced per chat separately
+    SCHEDULER_GLOBAL_RATE = float(os.getenv('SCHEDULER_GLOBAL_RATE', 30))
+    SCHEDULER_GLOBAL_BURST = float(os.getenv('SCHEDULER_GLOBAL_BURST', 30))
+    SCHEDULER_CHAT_RATE = float(os.getenv('SCHEDULER_CHAT_RATE', 1))
+    SCHEDULER_CHAT_BURST = float(os.getenv('SCHEDULER_CHAT_BURST', 20))
+    SCHEDULER_CHAT_DELETE_RATE = float(os.getenv('SCHEDULER_CHAT_DELETE_RATE', 10))
+    SCHEDULER_CHAT_DELETE_BURST = float(os.getenv('SCHEDULER_CHAT_DELETE_BURST', 30))
+    SCHEDULER_MAX_IN_FLIGHT = int(os.getenv('SCHEDULER_MAX_IN_FLIGHT', 64))
+    SCHEDULER_MAX_RETRIES = int(os.getenv('SCHEDULER_MAX_RETRIES', 5))
+    
+    # Webhook ingress: up to INGRESS_HIGH_WATERMARK updates are kept in memory,
+    # beyond that they spill to files in INGRESS_SPILL_DIR until memory is below
+    # INGRESS_LOW_WATERMARK; at most INGRESS_FEED_LIMIT are inside the Application.
+    # Spilled updates are synced to disk at most once per INGRESS_SPILL_FSYNC_MS (0 = each)
+    INGRESS_HIGH_WATERMARK = int(os.getenv('INGRESS_HIGH_WATERMARK', 10000))
+    INGRESS_LOW_WATERMARK = int(os.getenv('INGRESS_LOW_WATERMARK', 5000))
+    INGRESS_FEED_LIMIT = int(os.getenv('INGRESS_FEED_LIMIT', 256))
+    INGRESS_SPILL_DIR = os.getenv('INGRESS_SPILL_DIR', 'ingress_spill')
+    INGRESS_SPILL_MAX_BYTES = int(os.getenv('INGRESS_SPILL_MAX_BYTES', 256 * 1024 * 1024))
+    INGRESS_SPILL_FSYNC_MS = int(os.getenv('INGRESS_SPILL_FSYNC_MS', 1000))
+    
+    # Updates of different chats are processed concurrently by up to
+    # UPDATE_CONCURRENCY workers, updates of one chat in order (1 = sequential)
+    UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 8))
+    UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', 10000))
+    
+    # Raid mode: a chat with RAID_JOIN_THRESHOLD join/leave messages within
+    # RAID_WINDOW_SECONDS gets longer delete batches, aggregated logging and no
+    # welcome/warning sends until it stayed below the rate for RAID_COOLDOWN_SECONDS
+    RAID_JOIN_THRESHOLD = int(os.getenv('RAID_JOIN_THRESHOLD', 30))
+    RAID_WINDOW_SECONDS = float(os.getenv('RAID_WINDOW_SECONDS', 10))
+    RAID_COOLDOWN_SECONDS = float(os.getenv('RAID_COOLDOWN_SECONDS', 60))
+    RAID_LOG_INTERVAL_SECONDS = float(os.getenv('RAID_LOG_INTERVAL_SECONDS', 30))
+    RAID_DELETE_WINDOW_MS = int(os.getenv('RAID_DELETE_WINDOW_MS', 2000))
+    
+    # Acknowledge webhook updates no handler listens to without decoding them
+    PREFILTER_ENABLED = os.getenv('PREFILTER_ENABLED', 'true').lower() == 'true'
+    
+    # Redelivered webhook updates are dropped if their update_id is among the
+    # last DEDUP_WINDOW accepted ones or older than the last one of their chat
+    DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', 10000))
+    DEDUP_MAX_CHATS = int(os.getenv('DEDUP_MAX_CHATS', 100000))
+    
+    # Admin checks use each chat's administrator list, refetched after this many
+    # seconds or when a chat_member update promotes or demotes someone; enabling
+    # it subscribes to chat_member updates, which Telegram sends for every join
+    # and leave as well, so off by default (one getChatMember call per check)
+    ADMIN_CACHE_ENABLED = os.getenv('ADMIN_CACHE_ENABLED', 'false').lower() == 'true'
+    ADMIN_CACHE_TTL_SECONDS = float(os.getenv('ADMIN_CACHE_TTL_SECONDS', 300))
+    ADMIN_CACHE_MAX_CHATS = int(os.getenv('ADMIN_CACHE_MAX_CHATS', 10000))
+    
     # Support group URL (optional)
     SUPPORT_GROUP_URL = os.getenv('SUPPORT_GROUP_URL', 'https://t.me/GodAcess')
     
-    # Logging configuration
+    # Logging configuration; each log call site may emit LOG_RATE_LIMIT records
+    # per LOG_RATE_WINDOW_SECONDS, per-message events are summarised every
+    # LOG_SUMMARY_INTERVAL_SECONDS
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', 30))
+    LOG_RATE_WINDOW_SECONDS = float(os.getenv('LOG_RATE_WINDOW_SECONDS', 60))
+    LOG_SUMMARY_INTERVAL_SECONDS = float(os.getenv('LOG_SUMMARY_INTERVAL_SECONDS', 60))
     
     @classmethod
     def validate(cls):
         """Validate required configuration"""
-        if not cls.BOT_TOKEN:
-            raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required")
+        if not cls.BOT_TOKEN and not cls.BOT_TOKENS:
+            raise ValueError("TELEGRAM_BOT_TOKEN or BOT_TOKENS environment variable is required")
         
         return True
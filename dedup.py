@@ -0,0 +1,208 @@
+"""
+Deduplication of redelivered webhook updates
+
+Telegram redelivers an update when the webhook is slow or fails. Replays
+are recognised from the raw request body, before any JSON decoding, by a
+bounded window of recent update IDs and a high-water mark per chat.
+"""
+
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Optional, Tuple
+from config import Config
+from metrics import UPDATES_DEDUPLICATED
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Telegram sends update_id as the first key, so the first match is the top-level one
+_UPDATE_ID_RE = re.compile(rb'"update_id"\s*:\s*(\d+)')
+_CHAT_ID_RE = re.compile(rb'"chat"\s*:\s*\{\s*"id"\s*:\s*(-?\d+)')
+_FROM_ID_RE = re.compile(rb'"from"\s*:\s*\{\s*"id"\s*:\s*(-?\d+)')
+
+# Storage metadata key holding the window across restarts
+METADATA_KEY = 'recent_update_ids'
+
+def extract_chat_id(body: bytes) -> Optional[int]:
+    """
+    Find the chat ID of a raw webhook update without parsing the JSON
+
+    Falls back to the sender's ID for updates without a chat.
+
+    Args:
+        body: Raw request body
+
+    Returns:
+        int: Chat ID, or None if the update has neither chat nor sender
+    """
+    match = _CHAT_ID_RE.search(body) or _FROM_ID_RE.search(body)
+    return int(match.group(1)) if match else None
+
+def peek_update(body: bytes) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Find the update ID and chat ID of a raw webhook update
+
+    Args:
+        body: Raw request body
+
+    Returns:
+        tuple: (update_id, chat_id), either None if not found
+    """
+    match = _UPDATE_ID_RE.search(body)
+    update_id = int(match.group(1)) if match else None
+    return update_id, extract_chat_id(body)
+
+class UpdateDeduplicator:
+    """
+    Remembers recently accepted update IDs
+
+    An update is a replay if its ID is in the window of the last `window`
+    accepted IDs, or if it is older than the whole window and not newer
+    than the last update accepted for its chat. Updates arriving slightly
+    out of order stay inside the window and are accepted.
+    """
+
+    def __init__(self, window: int = None, max_chats: int = None):
+        """
+        Initialize the deduplicator
+
+        Args:
+            window: Number of recent update IDs to remember (optional)
+            max_chats: Number of chats to keep high-water marks for (optional)
+        """
+        self.window = window or Config.DEDUP_WINDOW
+        self.max_chats = max_chats or Config.DEDUP_MAX_CHATS
+        self._recent: deque = deque()
+        self._seen: set = set()
+        self._chat_marks: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _floor(self) -> int:
+        """Oldest update ID still inside the window, once the window is full"""
+        return self._recent[0] if len(self._recent) >= self.window else -1
+
+    def _record(self, update_id: int, chat_id: Optional[int]):
+        self._recent.append(update_id)
+        self._seen.add(update_id)
+        if len(self._recent) > self.window:
+            self._seen.discard(self._recent.popleft())
+
+        if chat_id is not None:
+            if update_id > self._chat_marks.get(chat_id, -1):
+                self._chat_marks[chat_id] = update_id
+            self._chat_marks.move_to_end(chat_id)
+            if len(self._chat_marks) > self.max_chats:
+                self._chat_marks.popitem(last=False)
+
+    def is_replay(self, update_id: int, chat_id: Optional[int] = None) -> bool:
+        """
+        Check an update and remember it if it is new
+
+        Args:
+            update_id: Telegram update ID
+            chat_id: Chat the update belongs to (optional)
+
+        Returns:
+            bool: True if the update was already accepted and must be dropped
+        """
+        with self._lock:
+            replay = update_id in self._seen or (
+                chat_id is not None
+                and update_id < self._floor()
+                and update_id <= self._chat_marks.get(chat_id, -1)
+            )
+            if replay:
+                self.dropped += 1
+                UPDATES_DEDUPLICATED.inc()
+            else:
+                self._record(update_id, chat_id)
+        return replay
+
+    def check_body(self, body: bytes) -> bool:
+        """
+        Check a raw webhook body
+
+        Args:
+            body: Raw request body
+
+        Returns:
+            bool: True if the update is a replay; bodies without an update ID pass
+        """
+        update_id, chat_id = peek_update(body)
+        if update_id is None:
+            return False
+
+        replay = self.is_replay(update_id, chat_id)
+        if replay:
+            logger.debug("Dropped redelivered update %d", update_id)
+        return replay
+
+    def forget(self, update_id: int):
+        """
+        Take back an accepted update ID, so its redelivery is accepted again
+
+        For updates that were checked but then could not be queued. The
+        chat's high-water mark is left as it is; a redelivery arrives while
+        the ID would still be inside the window.
+
+        Args:
+            update_id: Telegram update ID
+        """
+        with self._lock:
+            if update_id not in self._seen:
+                return
+            self._seen.discard(update_id)
+            # Usually the ID just recorded, so this rarely scans the window
+            if self._recent[-1] == update_id:
+                self._recent.pop()
+            else:
+                self._recent.remove(update_id)
+
+    def forget_body(self, body: bytes):
+        """
+        Take back the update ID of a raw webhook body
+
+        Args:
+            body: Raw request body
+        """
+        update_id, _ = peek_update(body)
+        if update_id is not None:
+            self.forget(update_id)
+
+    def restore(self, storage: Storage):
+        """
+        Load the window saved by a previous run
+
+        Args:
+            storage: Storage holding the window in its metadata
+        """
+        saved = storage.get_metadata(METADATA_KEY)
+        if not saved:
+            return
+
+        try:
+            update_ids = json.loads(saved)
+        except ValueError as e:
+            logger.error("Ignoring unreadable update window: %s", e)
+            return
+
+        with self._lock:
+            for update_id in update_ids[-self.window:]:
+                if update_id not in self._seen:
+                    self._record(update_id, None)
+        logger.info("Restored %d recent update IDs", len(update_ids))
+
+    def persist(self, storage: Storage):
+        """
+        Save the window so replays right after a restart are dropped too
+
+        Args:
+            storage: Storage to keep the window in
+        """
+        with self._lock:
+            update_ids = list(self._recent)
+        storage.set_metadata(METADATA_KEY, json.dumps(update_ids))
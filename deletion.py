@@ -0,0 +1,172 @@
+"""
+Batched deletion of service messages
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from telegram import Bot
+from telegram.error import Forbidden, TelegramError
+from config import Config
+from scheduler import Priority, RequestScheduler
+
+logger = logging.getLogger(__name__)
+
+# Bot API limit for message_ids in a single deleteMessages call
+MAX_BULK_DELETE = 100
+
+def is_rights_error(error: Exception) -> bool:
+    """
+    Check whether an API error means the bot lacks the rights to delete
+
+    Args:
+        error: Exception raised by a Bot API call
+
+    Returns:
+        bool: True if the error is a missing-permission error
+    """
+    text = str(error).lower()
+    return "not enough rights" in text or "insufficient rights" in text
+
+def _fails_whole_chat(error: Exception) -> bool:
+    """Whether every other delete in the chat would fail the same way"""
+    return isinstance(error, Forbidden) or is_rights_error(error)
+
+def _fail(entries: List[Tuple[int, asyncio.Future]], error: Exception):
+    for _, future in entries:
+        if not future.done():
+            future.set_exception(error)
+
+class _PendingBatch:
+    """Message IDs of one chat waiting to be flushed"""
+
+    __slots__ = ('bot', 'entries', 'timer')
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.entries: List[Tuple[int, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class DeletionBatcher:
+    """Coalesces per-chat message deletions into bulk deleteMessages calls"""
+
+    def __init__(self, window: float = None, max_batch: int = None, scheduler: RequestScheduler = None):
+        """
+        Initialize the batcher
+
+        Args:
+            window: Seconds to collect message IDs before flushing a chat (optional)
+            max_batch: Flush as soon as a chat has this many pending IDs (optional)
+            scheduler: Request scheduler the deletes are sent through (optional)
+        """
+        self.scheduler = scheduler
+        self.window = Config.DELETE_BATCH_WINDOW_MS / 1000 if window is None else window
+        self.max_batch = min(max_batch or Config.DELETE_BATCH_SIZE, MAX_BULK_DELETE)
+        self._pending: Dict[int, _PendingBatch] = {}
+        self._flushing: set = set()
+
+    async def delete(self, bot: Bot, chat_id: int, message_id: int, window: float = None) -> bool:
+        """
+        Queue a message for deletion and wait until its batch was flushed
+
+        Args:
+            bot: Telegram Bot instance
+            chat_id: Chat the message belongs to
+            message_id: Message to delete
+            window: Collection time of a new batch, overriding the default (optional)
+
+        Returns:
+            bool: True on success
+
+        Raises:
+            TelegramError: If the message could not be deleted
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        batch = self._pending.get(chat_id)
+        if batch is None:
+            batch = self._pending[chat_id] = _PendingBatch(bot)
+            batch.timer = loop.call_later(self.window if window is None else window, self._schedule_flush, chat_id)
+        batch.entries.append((message_id, future))
+
+        if len(batch.entries) >= self.max_batch:
+            self._schedule_flush(chat_id)
+
+        return await future
+
+    def _schedule_flush(self, chat_id: int):
+        """Detach the pending batch of a chat and flush it in a task"""
+        batch = self._pending.pop(chat_id, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+
+        task = asyncio.ensure_future(self._flush(chat_id, batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, chat_id: int, batch: _PendingBatch):
+        """Delete a batch, resolving every waiter however the deletion ends"""
+        try:
+            await self._delete_batch(chat_id, batch)
+        except asyncio.CancelledError:
+            for _, future in batch.entries:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error("Deleting %d messages in chat %s failed: %r", len(batch.entries), chat_id, e)
+            _fail(batch.entries, e)
+
+    async def _delete_batch(self, chat_id: int, batch: _PendingBatch):
+        """
+        Delete a batch in bulk, falling back to single deletes if that fails
+
+        Missing rights or a bot removed from the chat fail the whole batch
+        with that error, which callers report to the rights tracker, instead
+        of retrying every message on its own.
+        """
+        message_ids = [message_id for message_id, _ in batch.entries]
+
+        if len(message_ids) > 1:
+            try:
+                await self._call(chat_id, batch.bot.delete_messages, chat_id, message_ids)
+                for _, future in batch.entries:
+                    if not future.done():
+                        future.set_result(True)
+                logger.debug("Bulk deleted %d messages in chat %s", len(message_ids), chat_id)
+                return
+            except TelegramError as e:
+                if _fails_whole_chat(e):
+                    logger.warning("Dropping %d deletes in chat %s: %s", len(message_ids), chat_id, e)
+                    _fail(batch.entries, e)
+                    return
+                logger.warning("Bulk delete of %d messages in chat %s failed: %s", len(message_ids), chat_id, e)
+
+        for index, (message_id, future) in enumerate(batch.entries):
+            try:
+                result = await self._call(chat_id, batch.bot.delete_message, chat_id, message_id)
+            except Exception as e:
+                if _fails_whole_chat(e):
+                    _fail(batch.entries[index:], e)
+                    return
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def _call(self, chat_id: int, func, *args):
+        """Send a delete request, through the scheduler if one is set"""
+        if self.scheduler is None:
+            return await func(*args)
+        return await self.scheduler.submit(chat_id, Priority.DELETE, func, *args)
+
+    async def flush_all(self):
+        """Flush every pending batch immediately and wait for all flushes to finish"""
+        for chat_id in list(self._pending):
+            self._schedule_flush(chat_id)
+
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
@@ -0,0 +1,254 @@
+"""
+Bounded ingress queue for raw webhook updates
+
+Updates are kept as raw bytes in memory up to a high watermark. Beyond
+it, new updates are appended to on-disk segment files until memory has
+drained below the low watermark and the segments have been replayed, so
+the order within each priority class is kept. Service messages
+(joins/leaves, the bot's own membership) are handed out before anything
+else and are never dropped; other updates are dropped only once the
+spill files reach their size limit.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import time
+from collections import deque
+from typing import List
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, in the order they are handed out
+SERVICE = 0
+OTHER = 1
+
+_SERVICE_MARKERS = (b'"new_chat_members"', b'"left_chat_member"', b'"my_chat_member"')
+_LENGTH = struct.Struct('>I')
+
+def classify(body: bytes) -> int:
+    """
+    Get the priority class of a raw update
+
+    Args:
+        body: Raw request body
+
+    Returns:
+        int: SERVICE or OTHER
+    """
+    return SERVICE if any(marker in body for marker in _SERVICE_MARKERS) else OTHER
+
+class SpillSegment:
+    """
+    Append-only file of length-prefixed records, read back in order
+
+    Appends are flushed to the OS right away and synced to disk at most
+    every `fsync_interval` seconds. How far the file has been read is kept
+    in a small offset file next to it, so closing leaves the unread
+    records where they are.
+    """
+
+    def __init__(self, path: str, fsync_interval: float = None):
+        """
+        Open the segment, picking up records left by a previous run
+
+        Args:
+            path: Segment file path
+            fsync_interval: Seconds between syncs of appended records to disk (optional)
+        """
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self.fsync_interval = Config.INGRESS_SPILL_FSYNC_MS / 1000 if fsync_interval is None else fsync_interval
+        self._writer = open(path, 'ab')
+        self._reader = open(path, 'rb')
+        self._synced = time.monotonic()
+        self.count = 0
+        self.size = os.path.getsize(path)
+
+        offset = self._read_offset()
+        self._reader.seek(offset)
+        while True:
+            header = self._reader.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                break
+            self._reader.seek(_LENGTH.unpack(header)[0], os.SEEK_CUR)
+            self.count += 1
+        self._reader.seek(offset)
+
+        if self.count:
+            logger.warning("Replaying %d spilled updates from %s", self.count, path)
+
+    def _read_offset(self) -> int:
+        """Position of the first unread record saved by close()"""
+        try:
+            with open(self.offset_path) as f:
+                offset = int(f.read())
+        except FileNotFoundError:
+            return 0
+        except ValueError as e:
+            logger.error("Ignoring unreadable spill offset %s: %s", self.offset_path, e)
+            return 0
+        return offset if 0 <= offset <= self.size else 0
+
+    def append(self, body: bytes):
+        """Add a record at the end"""
+        self._writer.write(_LENGTH.pack(len(body)) + body)
+        self._writer.flush()
+        self.count += 1
+        self.size += _LENGTH.size + len(body)
+
+        now = time.monotonic()
+        if now - self._synced >= self.fsync_interval:
+            os.fsync(self._writer.fileno())
+            self._synced = now
+
+    def read(self, limit: int) -> List[bytes]:
+        """
+        Take up to `limit` records from the front
+
+        Args:
+            limit: Maximum number of records
+
+        Returns:
+            list: Records in the order they were appended
+        """
+        records = []
+        while self.count and len(records) < limit:
+            length = _LENGTH.unpack(self._reader.read(_LENGTH.size))[0]
+            records.append(self._reader.read(length))
+            self.count -= 1
+
+        if not self.count:
+            # Everything was replayed; start the file over to give the disk space back
+            self._writer.truncate(0)
+            self._reader.seek(0)
+            self.size = 0
+        return records
+
+    def close(self):
+        """Sync and close the file, saving how far it was read"""
+        offset = self._reader.tell() if self.count else 0
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._reader.close()
+
+        if offset:
+            tmp_path = f"{self.offset_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(str(offset))
+            os.replace(tmp_path, self.offset_path)
+        elif os.path.exists(self.offset_path):
+            os.remove(self.offset_path)
+
+class IngressQueue:
+    """Bounded two-class queue of raw updates spilling to disk under load"""
+
+    def __init__(self, spill_dir: str = None, high_watermark: int = None, low_watermark: int = None,
+                 max_spill_bytes: int = None):
+        """
+        Initialize the queue
+
+        Args:
+            spill_dir: Directory of the spill segment files (optional)
+            high_watermark: Updates in memory at which spilling starts (optional)
+            low_watermark: Updates in memory below which spilled updates are read back (optional)
+            max_spill_bytes: Spill size beyond which non-service updates are dropped (optional)
+        """
+        self.high_watermark = high_watermark or Config.INGRESS_HIGH_WATERMARK
+        self.low_watermark = min(low_watermark or Config.INGRESS_LOW_WATERMARK, self.high_watermark)
+        self.max_spill_bytes = max_spill_bytes or Config.INGRESS_SPILL_MAX_BYTES
+
+        spill_dir = spill_dir or Config.INGRESS_SPILL_DIR
+        os.makedirs(spill_dir, exist_ok=True)
+        self._memory = (deque(), deque())
+        self._segments = (
+            SpillSegment(os.path.join(spill_dir, 'ingress-service.seg')),
+            SpillSegment(os.path.join(spill_dir, 'ingress-other.seg')),
+        )
+        self._spilling = any(segment.count for segment in self._segments)
+        self._available = asyncio.Event()
+        self.dropped = 0
+
+    @property
+    def in_memory(self) -> int:
+        """Updates held in memory"""
+        return len(self._memory[SERVICE]) + len(self._memory[OTHER])
+
+    @property
+    def spilled(self) -> int:
+        """Updates waiting in the spill files"""
+        return self._segments[SERVICE].count + self._segments[OTHER].count
+
+    def put(self, body: bytes) -> bool:
+        """
+        Queue a raw update
+
+        Args:
+            body: Raw request body
+
+        Returns:
+            bool: False if the update was dropped
+        """
+        priority = classify(body)
+
+        if not self._spilling and self.in_memory >= self.high_watermark:
+            self._spilling = True
+            logger.warning("Ingress queue above %d updates, spilling to disk", self.high_watermark)
+
+        if self._spilling:
+            spill_size = self._segments[SERVICE].size + self._segments[OTHER].size
+            if priority != SERVICE and spill_size >= self.max_spill_bytes:
+                self.dropped += 1
+                return False
+            self._segments[priority].append(body)
+        else:
+            self._memory[priority].append(body)
+
+        self._available.set()
+        return True
+
+    async def get(self) -> bytes:
+        """
+        Take the next update, service messages first
+
+        Returns:
+            bytes: Raw update
+        """
+        while True:
+            for priority in (SERVICE, OTHER):
+                memory = self._memory[priority]
+                if not memory and self._segments[priority].count:
+                    memory.extend(self._segments[priority].read(max(self.low_watermark, 1)))
+                if memory:
+                    body = memory.popleft()
+                    self._check_recovered()
+                    return body
+
+            self._available.clear()
+            await self._available.wait()
+
+    def _check_recovered(self):
+        if self._spilling and not self.spilled and self.in_memory <= self.low_watermark:
+            self._spilling = False
+            logger.warning("Ingress queue below %d updates, spill replayed", self.low_watermark)
+
+    def drain_memory(self) -> List[bytes]:
+        """
+        Take every update held in memory, service messages first
+
+        Spilled updates stay on disk and are replayed after a restart.
+
+        Returns:
+            list: Raw updates
+        """
+        bodies = list(self._memory[SERVICE]) + list(self._memory[OTHER])
+        self._memory[SERVICE].clear()
+        self._memory[OTHER].clear()
+        return bodies
+
+    def close(self):
+        """Sync and close the spill files"""
+        for segment in self._segments:
+            segment.close()
@@ -0,0 +1,173 @@
+"""
+Logging pipeline: records are queued by the emitting thread and formatted
+and written by a listener thread, high-frequency call sites are rate
+limited, and per-event lines can be replaced by periodic summaries.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Tuple
+from config import Config
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler leaving all formatting to the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock implementation formats the message here, on the event loop;
+        # the record stays in-process, so args and exc_info can travel as they are
+        return record
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `limit` records per call site every `window` seconds
+
+    The first record let through after a suppression says how many were
+    dropped. Warnings and errors are limited too, as a flood of identical
+    errors is just as costly. Records logged with extra={'rate_limited': False}
+    always pass.
+    """
+
+    def __init__(self, limit: int = None, window: float = None):
+        super().__init__()
+        self.limit = limit or Config.LOG_RATE_LIMIT
+        self.window = window or Config.LOG_RATE_WINDOW_SECONDS
+        # (pathname, lineno) -> [window start, records in window, suppressed]
+        self._sites: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'rate_limited', True):
+            return True
+
+        now = time.monotonic()
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None:
+            site = self._sites[(record.pathname, record.lineno)] = [now, 0, 0]
+
+        if now - site[0] >= self.window:
+            site[0] = now
+            site[1] = 0
+
+        if site[1] >= self.limit:
+            site[2] += 1
+            return False
+
+        site[1] += 1
+        if site[2]:
+            note = f" [{site[2]} similar messages suppressed]"
+            record.msg = f"{record.msg}{note.replace('%', '%%') if record.args else note}"
+            site[2] = 0
+        return True
+
+class SummaryLog:
+    """
+    Counts per-event occurrences and logs one line per key every interval
+
+    Used instead of one log line per event on hot paths, e.g. one line per
+    chat and minute instead of one line per deleted message.
+    """
+
+    def __init__(self, logger: logging.Logger, template: str, level: int = logging.INFO):
+        """
+        Initialize the summary
+
+        Args:
+            logger: Logger the summaries are written to
+            template: Format string with {count}, {key}, {label} and {interval} fields
+            level: Level of the summary records (optional)
+        """
+        self.logger = logger
+        self.template = template
+        self.level = level
+        self._counts: Dict[object, int] = defaultdict(int)
+        self._labels: Dict[object, str] = {}
+        self._lock = threading.Lock()
+        _summaries.append(self)
+        _start_summary_thread()
+
+    def add(self, key, label: str = '', count: int = 1):
+        """
+        Count occurrences of an event
+
+        Args:
+            key: What the event is grouped by, e.g. a chat ID
+            label: Human readable name shown with the key (optional)
+            count: Number of occurrences (optional)
+        """
+        with self._lock:
+            self._counts[key] += count
+            if label:
+                self._labels[key] = label
+
+    def flush(self):
+        """Log and reset the counts collected so far"""
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+            labels, self._labels = self._labels, {}
+
+        if not self.logger.isEnabledFor(self.level):
+            return
+        for key, count in counts.items():
+            self.logger.log(self.level, self.template.format(
+                count=count, key=key, label=labels.get(key, ''),
+                interval=Config.LOG_SUMMARY_INTERVAL_SECONDS
+            ), extra={'rate_limited': False})
+
+_summaries: List[SummaryLog] = []
+_summary_thread: threading.Thread = None
+
+def _start_summary_thread():
+    global _summary_thread
+    if _summary_thread is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(Config.LOG_SUMMARY_INTERVAL_SECONDS)
+            flush_summaries()
+
+    _summary_thread = threading.Thread(target=run, name='log-summaries', daemon=True)
+    _summary_thread.start()
+
+def flush_summaries():
+    """Write out every summary's pending counts"""
+    for summary in list(_summaries):
+        summary.flush()
+
+def configure_logging(level: str = None, fmt: str = DEFAULT_FORMAT) -> QueueListener:
+    """
+    Route all logging through a queue to a stream handler on a listener thread
+
+    Args:
+        level: Root log level name (optional, defaults to Config.LOG_LEVEL)
+        fmt: Record format (optional)
+
+    Returns:
+        QueueListener: The started listener, stopped automatically at exit
+    """
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(fmt))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(records)
+    handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level or Config.LOG_LEVEL)
+
+    listener = QueueListener(records, stream, respect_handler_level=True)
+    listener.start()
+
+    def stop():
+        flush_summaries()
+        listener.stop()
+
+    atexit.register(stop)
+    return listener
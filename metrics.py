@@ -0,0 +1,221 @@
+"""
+In-process metrics exposed in the Prometheus text format
+
+Counters and histograms are plain integer/float slots updated without
+locks: increments come from the event loop thread (and, for storage
+flushes, one flusher thread), and a scrape that reads a value mid-update
+is off by at most one observation, which is fine for monitoring.
+"""
+
+import functools
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+from telegram.request import HTTPXRequest
+
+# Latency buckets in seconds, from a fast local handler to a slow API call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        """
+        Increase the counter
+
+        Args:
+            *label_values: One value per label, in declaration order
+            amount: Increment (optional)
+        """
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f'{self.name}{_format_labels(self.labels, values)} {value}'
+            for values, value in list(self._values.items())
+        ]
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._sources: List[Callable[[], float]] = []
+
+    def set_function(self, source: Callable[[], float]):
+        """
+        Report the sum of the callbacks' values (one per Application in the process)
+
+        Args:
+            source: Callable returning the current value
+        """
+        self._sources.append(source)
+
+    def samples(self) -> List[str]:
+        return [f'{self.name} {sum(source() for source in self._sources)}']
+
+class Histogram:
+    """Cumulative histogram with fixed buckets and optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # Per label set: [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        """
+        Record one observation
+
+        Args:
+            value: Observed value in seconds
+            *label_values: One value per label, in declaration order
+        """
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                labels = _format_labels(self.labels, values, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, values)} {series[-1]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, values)} {cumulative}')
+        return lines
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        """Add a metric and return it"""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render all metrics
+
+        Returns:
+            str: Prometheus text exposition format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'bot_http_request_seconds', 'Time to handle an incoming HTTP request', ('path',)))
+UPDATE_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'bot_update_queue_depth', 'Updates waiting to be processed'))
+SCHEDULER_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'bot_scheduler_queue_depth', 'Outbound API calls waiting for a rate limit slot'))
+INGRESS_IN_MEMORY = REGISTRY.register(Gauge(
+    'bot_ingress_in_memory', 'Webhook updates waiting in memory'))
+INGRESS_SPILLED = REGISTRY.register(Gauge(
+    'bot_ingress_spilled', 'Webhook updates waiting in the spill files'))
+INGRESS_DROPPED = REGISTRY.register(Counter(
+    'bot_ingress_dropped_total', 'Non-service webhook updates dropped with the spill files full'))
+UPDATE_LANES = REGISTRY.register(Gauge(
+    'bot_update_lanes', 'Chats with updates pending or in progress'))
+UPDATES_PENDING = REGISTRY.register(Gauge(
+    'bot_updates_pending', 'Updates handed to the update processor and not yet finished'))
+UPDATES_PREFILTERED = REGISTRY.register(Counter(
+    'bot_updates_prefiltered_total', 'Webhook updates acknowledged without decoding as no handler matches'))
+UPDATES_DEDUPLICATED = REGISTRY.register(Counter(
+    'bot_updates_deduplicated_total', 'Redelivered webhook updates dropped'))
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    'bot_handler_seconds', 'Time spent in an update handler', ('handler',)))
+API_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'bot_api_request_seconds', 'Latency of Telegram Bot API calls', ('method',)))
+API_ERRORS = REGISTRY.register(Counter(
+    'bot_api_errors_total', 'Failed Telegram Bot API calls', ('method',)))
+DELETES = REGISTRY.register(Counter(
+    'bot_deletes_total', 'Service message deletions by outcome', ('outcome',)))
+RAID_CHATS = REGISTRY.register(Gauge(
+    'bot_raid_chats', 'Chats currently in raid mode'))
+ADMIN_LOOKUPS = REGISTRY.register(Counter(
+    'bot_admin_lookups_total', 'Admin checks by roster cache outcome', ('result',)))
+CATCHUP_UPDATES = REGISTRY.register(Counter(
+    'bot_catchup_updates_total', 'Backlog updates fetched on start by outcome', ('outcome',)))
+CATCHUP_REMAINING = REGISTRY.register(Gauge(
+    'bot_catchup_remaining', 'Backlog updates still to fetch (estimated) while catching up'))
+CATCHUP_LAG_SECONDS = REGISTRY.register(Gauge(
+    'bot_catchup_lag_seconds', 'Age of the newest backlog update fetched while catching up'))
+SELF_DESTRUCT_PENDING = REGISTRY.register(Gauge(
+    'bot_self_destruct_pending', 'Bot messages scheduled for deletion'))
+SELF_DESTRUCT_DELETES = REGISTRY.register(Counter(
+    'bot_self_destruct_deletes_total', 'Scheduled bot message deletions by outcome', ('outcome',)))
+STORAGE_FLUSH_SECONDS = REGISTRY.register(Histogram(
+    'bot_storage_flush_seconds', 'Time to persist changes to storage', ('backend',)))
+
+def timed_handler(handler: Callable) -> Callable:
+    """
+    Decorate an async handler method to record its latency under its name
+
+    Args:
+        handler: Coroutine function to time
+
+    Returns:
+        Callable: Wrapped coroutine function
+    """
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest recording latency and errors per Bot API method"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status: Optional[int] = None
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+            return status, payload
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, api_method)
+            if status is None or status >= 400:
+                API_ERRORS.inc(api_method)
@@ -0,0 +1,122 @@
+"""
+Hosting several bots in one process
+
+Every bot keeps its own Application, handlers, rate limits, update
+deduplication, ingress queue and storage namespace. They share the event
+loop, the outbound Bot API connection pool and the storage engine (one
+SQLite connection, or one JSON file per bot next to the main one), so an
+extra bot costs its handler state instead of a whole process.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict
+from config import Config
+from api_client import build_request
+from asgi import ASGIApp, Request, Response, WebhookServer, run_asgi
+from bot_setup import build_application
+from ingress import IngressQueue
+from startup import startup_timer
+from storage import Storage
+from storage_backends import StorageBackend, check_namespace, create_backend
+
+logger = logging.getLogger(__name__)
+
+def parse_bot_tokens(spec: str) -> Dict[str, str]:
+    """
+    Parse the hosted bots
+
+    Args:
+        spec: Comma separated name=token pairs, e.g. "main=123:AAA,acme=456:BBB"
+
+    Returns:
+        dict: Token by bot name, in the given order
+
+    Raises:
+        ValueError: If an entry is malformed or a name is used twice
+    """
+    tokens: Dict[str, str] = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, separator, token = item.partition('=')
+        name = name.strip()
+        if not separator or not token.strip():
+            raise ValueError(f"Invalid BOT_TOKENS entry for {name!r}: expected name=token")
+        if name in tokens:
+            raise ValueError(f"Bot name {name!r} is used twice in BOT_TOKENS")
+        tokens[check_namespace(name)] = token.strip()
+    return tokens
+
+class MultiBotServer(ASGIApp):
+    """ASGI application running several bots, each with its own webhook route"""
+
+    def __init__(self, tokens: Dict[str, str], backend: StorageBackend = None, webhook_url: str = None):
+        """
+        Initialize the server
+
+        Args:
+            tokens: Token by bot name
+            backend: Storage engine the bots' namespaces live in (optional)
+            webhook_url: Public base URL; polling is used when empty (optional)
+        """
+        super().__init__()
+        self.backend = backend or create_backend()
+        self.request = build_request(shared=True)
+        webhook_url = Config.WEBHOOK_URL if webhook_url is None else webhook_url
+
+        self.bots: Dict[str, WebhookServer] = {}
+        for name, token in tokens.items():
+            storage = Storage(backend=self.backend.namespace(name))
+            application = build_application(token, storage, updater=not webhook_url, request=self.request)
+            server = WebhookServer(
+                application, storage, webhook_url,
+                ingress=IngressQueue(spill_dir=os.path.join(Config.INGRESS_SPILL_DIR, name)),
+                webhook_path=f'/webhook/{name}'
+            )
+            self.bots[name] = server
+            self.add_route('POST', server.webhook_path, server.webhook)
+            self.add_route('GET', f'/stats/{name}', server.stats)
+
+        self.add_route('GET', '/health', self.health)
+        startup_timer.mark('application_built')
+        logger.info(f"Hosting {len(self.bots)} bots: {', '.join(self.bots)}")
+
+    async def startup(self):
+        """Start booting every bot; each becomes ready on its own"""
+        for server in self.bots.values():
+            await server.startup()
+        await super().startup()
+
+    async def shutdown(self):
+        """Stop every bot, then release the shared storage engine"""
+        results = await asyncio.gather(
+            *(server.shutdown() for server in self.bots.values()), return_exceptions=True
+        )
+        for name, result in zip(self.bots, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error shutting down bot {name}: {result}")
+
+        await super().shutdown()
+        await asyncio.to_thread(self.backend.close)
+
+    async def health(self, request: Request) -> Response:
+        """Health check endpoint; unhealthy only if no bot could start"""
+        states = {name: server.state for name, server in self.bots.items()}
+        failed = sum(1 for state in states.values() if state in ('failed', 'stalled'))
+
+        if failed == len(states):
+            status, code = "unhealthy", 503
+        else:
+            status, code = ("degraded" if failed else "healthy"), 200
+        return Response.json({"status": status, "bots": states, "startup": startup_timer.as_dict()}, code)
+
+def serve_multi_bot(spec: str, host: str = None, port: int = None):
+    """
+    Run the configured bots in one ASGI server
+
+    Args:
+        spec: Comma separated name=token pairs
+        host: Bind address (optional)
+        port: Bind port (optional)
+    """
+    run_asgi(MultiBotServer(parse_bot_tokens(spec)), host, port)
@@ -0,0 +1,52 @@
+"""
+Raw-bytes pre-filter for webhook updates
+
+Decides from the undecoded body whether an update can match any
+registered handler, so ordinary messages, edits and reactions are
+acknowledged without building an Update object. Keep in sync with
+bot_setup.register_handlers: a false positive only costs a full decode,
+a false negative loses an update.
+"""
+
+import re
+from config import Config
+from metrics import UPDATES_PREFILTERED
+
+# Update types the handlers listen to, also passed to Telegram as allowed_updates;
+# chat_member only feeds the admin cache and roughly doubles join/leave traffic
+ALLOWED_UPDATES = ['message', 'edited_message', 'my_chat_member'] + (
+    ['chat_member'] if Config.ADMIN_CACHE_ENABLED else []
+)
+
+# Join/leave service messages and the bot's own membership changes
+_KEY_MARKERS = (b'"new_chat_members"', b'"left_chat_member"', b'"my_chat_member"')
+# Other members' changes only matter when they gain or lose admin status
+_CHAT_MEMBER_MARKER = b'"chat_member"'
+_ADMIN_MARKERS = (b'"administrator"', b'"creator"')
+# /start, also as /start@botname and in any case, like CommandHandler matches it;
+# Telegram does not escape slashes, but allow it
+_START_RE = re.compile(rb'"text"\s*:\s*"(?:\\)?/start(?![A-Za-z0-9_])', re.IGNORECASE)
+
+def is_relevant(body: bytes) -> bool:
+    """
+    Check whether a raw update may match a registered handler
+
+    Args:
+        body: Raw request body
+
+    Returns:
+        bool: False if no handler can match and the update can be skipped
+    """
+    if not Config.PREFILTER_ENABLED:
+        return True
+
+    for marker in _KEY_MARKERS:
+        if marker in body:
+            return True
+    if _START_RE.search(body):
+        return True
+    if Config.ADMIN_CACHE_ENABLED and _CHAT_MEMBER_MARKER in body and any(marker in body for marker in _ADMIN_MARKERS):
+        return True
+
+    UPDATES_PREFILTERED.inc()
+    return False
@@ -0,0 +1,143 @@
+"""
+Per-chat join-flood (raid) detection
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Dict, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class _ChatActivity:
+    """Recent join/leave timestamps of one chat and its raid state"""
+
+    __slots__ = ('events', 'raid_since', 'last_high', 'raid_events', 'logged_events', 'last_log')
+
+    def __init__(self, threshold: int):
+        # Only the last `threshold` timestamps matter for the rate check
+        self.events: deque = deque(maxlen=threshold)
+        self.raid_since: Optional[float] = None
+        self.last_high = 0.0
+        self.raid_events = 0
+        self.logged_events = 0
+        self.last_log = 0.0
+
+class RaidDetector:
+    """
+    Sliding-window join/leave rate per chat
+
+    A chat enters raid mode once `threshold` join/leave messages arrive
+    within `window` seconds, and leaves it after the rate stayed below the
+    threshold for `cooldown` seconds. While in raid mode, per-event logging
+    is replaced by a summary every `log_interval` seconds.
+    """
+
+    def __init__(self, threshold: int = None, window: float = None, cooldown: float = None,
+                 log_interval: float = None):
+        """
+        Initialize the detector
+
+        Args:
+            threshold: Join/leave messages within the window that start a raid (optional)
+            window: Length of the sliding window in seconds (optional)
+            cooldown: Seconds below the threshold before a raid ends (optional)
+            log_interval: Seconds between raid summaries in the log (optional)
+        """
+        self.threshold = threshold or Config.RAID_JOIN_THRESHOLD
+        self.window = window or Config.RAID_WINDOW_SECONDS
+        self.cooldown = cooldown or Config.RAID_COOLDOWN_SECONDS
+        self.log_interval = log_interval or Config.RAID_LOG_INTERVAL_SECONDS
+        self._chats: Dict[int, _ChatActivity] = {}
+        self._records = 0
+
+    @property
+    def active_count(self) -> int:
+        """Number of chats currently in raid mode"""
+        return sum(1 for activity in self._chats.values() if activity.raid_since is not None)
+
+    def record(self, chat_id: int, now: float = None) -> bool:
+        """
+        Count a join/leave message and update the chat's raid state
+
+        Args:
+            chat_id: Telegram chat ID
+            now: Monotonic timestamp (optional)
+
+        Returns:
+            bool: True if the chat is in raid mode
+        """
+        now = time.monotonic() if now is None else now
+        activity = self._chats.get(chat_id)
+        if activity is None:
+            activity = self._chats[chat_id] = _ChatActivity(self.threshold)
+
+        activity.events.append(now)
+        high = len(activity.events) == self.threshold and now - activity.events[0] <= self.window
+        if high:
+            activity.last_high = now
+
+        if activity.raid_since is None:
+            if high:
+                activity.raid_since = now
+                activity.raid_events = activity.logged_events = 0
+                activity.last_log = now
+                logger.warning(
+                    f"Raid detected in chat {chat_id}: {self.threshold} join/leave messages "
+                    f"within {self.window:g}s"
+                )
+        elif now - activity.last_high >= self.cooldown:
+            self._end_raid(chat_id, activity, now)
+
+        if activity.raid_since is not None:
+            activity.raid_events += 1
+            if now - activity.last_log >= self.log_interval:
+                logger.warning(
+                    f"Raid in chat {chat_id}: {activity.raid_events - activity.logged_events} "
+                    f"join/leave messages in the last {now - activity.last_log:.0f}s"
+                )
+                activity.logged_events = activity.raid_events
+                activity.last_log = now
+
+        self._records += 1
+        if self._records % 1000 == 0:
+            self._prune(now)
+
+        return activity.raid_since is not None
+
+    def in_raid(self, chat_id: int, now: float = None) -> bool:
+        """
+        Check whether a chat is in raid mode, ending the raid if it cooled down
+
+        Args:
+            chat_id: Telegram chat ID
+            now: Monotonic timestamp (optional)
+
+        Returns:
+            bool: True if the chat is in raid mode
+        """
+        activity = self._chats.get(chat_id)
+        if activity is None or activity.raid_since is None:
+            return False
+
+        now = time.monotonic() if now is None else now
+        if now - activity.last_high >= self.cooldown:
+            self._end_raid(chat_id, activity, now)
+            return False
+        return True
+
+    def _end_raid(self, chat_id: int, activity: _ChatActivity, now: float):
+        logger.warning(
+            f"Raid in chat {chat_id} ended after {now - activity.raid_since:.0f}s "
+            f"and {activity.raid_events} join/leave messages"
+        )
+        activity.raid_since = None
+
+    def _prune(self, now: float):
+        """Forget chats without join/leave messages for longer than window and cooldown"""
+        idle = self.window + self.cooldown
+        for chat_id in [chat_id for chat_id, activity in self._chats.items() if now - activity.events[-1] > idle]:
+            activity = self._chats.pop(chat_id)
+            if activity.raid_since is not None:
+                self._end_raid(chat_id, activity, now)
@@ -0,0 +1,103 @@
+"""
+Prebuilt message texts, keyboards and cached bot identity
+"""
+
+from typing import Optional
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, User
+from config import Config
+
+PRIVATE_WELCOME_TEXT = (
+    "Join/Leave Message Hider Bot\n\n"
+    "Hello! I Help Keep Your Group Chats Clean By Automatically Hiding "
+    "Join And Leave Messages.\n\n"
+    "**How To Use:**\n"
+    "1. Add Me To Your Group Chat\n"
+    "2. Make Me An Admin With 'Delete Messages' Permission\n"
+    "3. I'll Automatically Start Hiding Join/leave Messages\n\n"
+    "𝘛𝘩𝘢𝘵'𝘴 𝘐𝘵! 𝘕𝘰 𝘊𝘰𝘯𝘧𝘪𝘨𝘶𝘳𝘢𝘵𝘪𝘰𝘯 𝘕𝘦𝘦𝘥𝘦𝘥 - 𝘐 𝘞𝘰𝘳𝘬 𝘈𝘶𝘵𝘰𝘮𝘢𝘵𝘪𝘤𝘢𝘭𝘭𝘺 𝘖𝘯𝘤𝘦 𝘠𝘰𝘶 𝘎𝘪𝘷𝘦 𝘔𝘦 𝘈𝘥𝘮𝘪𝘯 𝘗𝘦𝘳𝘮𝘪𝘴𝘴𝘪𝘰𝘯𝘴.  "
+)
+
+GROUP_WELCOME_TEXT = (
+    "**Join/Leave Message Hider Bot is now active!**\n\n"
+    "I will automatically hide join/leave messages to keep your chat clean.\n\n"
+    "Make sure I have admin permissions with 'Delete Messages' enabled."
+)
+
+INVITE_TEXT = (
+    "**🎊 Thank You** For **Adding** Me To **Your Group!**\n\n "
+    "Join/Leave Message Hider Bot is now active!**\n\n"
+    "I Will Automatically Hide Join And Leave Messages To Keep Your Chat Clean.\n\n"
+    "**To Get Started:**\n"
+    "1. Make Me An Admin With 'Delete Messages' Permission\n"
+    "2. That's it! I'll Automatically Start Hiding Join/Leave Notifications\n\n"
+)
+
+PERMISSION_WARNING_TEXT = (
+    "⚠️ **Permission Error**\n\n"
+    "I need admin privileges with 'Delete Messages' permission "
+    "to hide join/leave messages.\n\n"
+    "Please make me an admin with the required permissions."
+)
+
+# Support group button (if configured); keyboards are immutable and shared
+SUPPORT_KEYBOARD: Optional[InlineKeyboardMarkup] = (
+    InlineKeyboardMarkup([[InlineKeyboardButton('💬 Support Group', url=Config.SUPPORT_GROUP_URL)]])
+    if Config.SUPPORT_GROUP_URL else None
+)
+
+# Characters that need escaping in Telegram Markdown
+MARKDOWN_SPECIAL_CHARS = frozenset('_*`[]()~>#+-=|{}.!')
+_MARKDOWN_ESCAPES = {char: f'\\{char}' for char in MARKDOWN_SPECIAL_CHARS}
+
+def escape_markdown(text: str) -> str:
+    """
+    Escape markdown special characters in text
+
+    One scan finds which special characters occur; only those are replaced,
+    and text without any is returned as is.
+
+    Args:
+        text: Text to escape
+
+    Returns:
+        str: Escaped text
+    """
+    present = MARKDOWN_SPECIAL_CHARS.intersection(text)
+    for char in present:
+        text = text.replace(char, _MARKDOWN_ESCAPES[char])
+    return text
+
+class Renderer:
+    """Holds the bot identity and everything prebuilt from it"""
+
+    def __init__(self):
+        self.bot_id: Optional[int] = None
+        self.bot_username: Optional[str] = None
+        self.start_keyboard: Optional[InlineKeyboardMarkup] = None
+
+    def set_identity(self, bot_user: User):
+        """
+        Cache the bot identity and build the keyboards that depend on it
+
+        Args:
+            bot_user: The bot's own user, as returned by getMe
+        """
+        self.bot_id = bot_user.id
+        self.bot_username = bot_user.username
+        self.start_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(
+            '➕ 𝗔𝗱𝗱 𝗠𝗲 𝗧𝗼 𝗬𝗼𝘂𝗿 𝗚𝗿𝗼𝘂𝗽𝘀 ➕',
+            url=f'https://t.me/{bot_user.username}?startgroup=true'
+        )]])
+
+    def ensure_identity(self, bot: Bot):
+        """
+        Cache the identity from an initialized bot if not done yet
+
+        The bot already holds its getMe result after initialize(), so this
+        makes no network call.
+
+        Args:
+            bot: Initialized Telegram Bot instance
+        """
+        if self.bot_id is None:
+            self.set_identity(bot.bot)
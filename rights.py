@@ -0,0 +1,110 @@
+"""
+Tracking of the bot's own rights per chat
+"""
+
+import logging
+from telegram import ChatMemberUpdated
+from telegram.constants import ChatMemberStatus
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# States of the per-chat state machine, stored as 'bot_rights' in the chat settings
+UNKNOWN = 'unknown'
+CAN_DELETE = 'can_delete'
+CANNOT_DELETE = 'cannot_delete'
+NOT_MEMBER = 'not_member'
+
+class RightsTracker:
+    """
+    Per-chat state machine for the bot's ability to delete messages
+
+    Transitions come from my_chat_member updates and from the outcome of
+    delete calls. A permission warning is allowed once per transition
+    into CANNOT_DELETE, tracked by the 'rights_warned' setting.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+
+    def state(self, chat_id: int) -> str:
+        """
+        Get the known rights state of a chat
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            str: One of UNKNOWN, CAN_DELETE, CANNOT_DELETE, NOT_MEMBER
+        """
+        # Not get_chat_settings: reading must not create a row for every chat seen
+        settings = self.storage.peek_chat_settings(chat_id)
+        return settings.get('bot_rights', UNKNOWN) if settings is not None else UNKNOWN
+
+    def can_delete(self, chat_id: int) -> bool:
+        """Whether a delete call in this chat may succeed (unknown counts as yes)"""
+        return self.state(chat_id) in (UNKNOWN, CAN_DELETE)
+
+    def _transition(self, chat_id: int, new_state: str) -> bool:
+        """Move a chat to a new state, resetting the warning flag on change"""
+        if self.state(chat_id) == new_state:
+            return False
+
+        self.storage.update_chat_settings(chat_id, bot_rights=new_state, rights_warned=None)
+        logger.info(f"Bot rights in chat {chat_id} changed to {new_state}")
+        return True
+
+    def on_member_update(self, member_update: ChatMemberUpdated) -> str:
+        """
+        Apply a my_chat_member update
+
+        Args:
+            member_update: The bot's own membership change
+
+        Returns:
+            str: The new state
+        """
+        member = member_update.new_chat_member
+
+        if member.status == ChatMemberStatus.OWNER:
+            new_state = CAN_DELETE
+        elif member.status == ChatMemberStatus.ADMINISTRATOR:
+            new_state = CAN_DELETE if member.can_delete_messages else CANNOT_DELETE
+        elif member.status in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED):
+            new_state = NOT_MEMBER
+        else:
+            new_state = CANNOT_DELETE
+
+        self._transition(member_update.chat.id, new_state)
+        return new_state
+
+    def on_delete_succeeded(self, chat_id: int):
+        """Record that a delete worked; only a chat previously known to lack rights is written"""
+        if self.state(chat_id) not in (UNKNOWN, CAN_DELETE):
+            self._transition(chat_id, CAN_DELETE)
+
+    def on_delete_failed(self, chat_id: int) -> bool:
+        """
+        Record that a delete failed for lack of rights
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            bool: True if the chat has not been warned since its rights changed
+        """
+        self._transition(chat_id, CANNOT_DELETE)
+        return not self.storage.peek_chat_settings(chat_id).get('rights_warned', False)
+
+    def needs_warning(self, chat_id: int) -> bool:
+        """Whether the chat lacks delete rights and was not warned since that changed"""
+        settings = self.storage.peek_chat_settings(chat_id)
+        return (
+            settings is not None
+            and settings.get('bot_rights') == CANNOT_DELETE
+            and not settings.get('rights_warned', False)
+        )
+
+    def mark_warned(self, chat_id: int):
+        """Record that the permission warning was sent"""
+        self.storage.update_chat_settings(chat_id, rights_warned=True)
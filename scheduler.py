@@ -0,0 +1,316 @@
+"""
+Rate-limit-aware scheduler for outbound Bot API requests
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from telegram.error import RetryAfter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class Priority(IntEnum):
+    """Priority classes, lower values are sent first"""
+    DELETE = 0
+    NOTICE = 1
+
+class TokenBucket:
+    """Token bucket rate limiter"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Consume one token; call only after delay() returned 0"""
+        self.tokens -= 1
+
+    def time_to_full(self, now: float) -> float:
+        """Seconds until the bucket is full again"""
+        self._refill(now)
+        return (self.capacity - self.tokens) / self.rate
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'func', 'args', 'kwargs', 'future', 'attempts')
+
+    def __init__(self, priority: int, seq: int, func, args, kwargs, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+    def __lt__(self, other: '_Job') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class _ChatLane:
+    __slots__ = ('jobs', 'bucket', 'delete_bucket', 'parked_until', 'busy', 'queued')
+
+    def __init__(self, bucket: TokenBucket, delete_bucket: TokenBucket):
+        self.jobs: List[_Job] = []
+        self.bucket = bucket
+        self.delete_bucket = delete_bucket
+        self.parked_until = 0.0
+        self.busy = False
+        self.queued = False
+
+class RequestScheduler:
+    """
+    Paces outbound requests with a global and a per-chat token bucket
+
+    Deletes have a per-chat bucket of their own: the per-chat message limit
+    does not apply to them, and bulk deletes keep their number low. Requests
+    of one chat run one at a time in priority order. A RetryAfter
+    parks the chat's queue for the requested time, requeues the request and
+    halves the global rate, which then recovers gradually on success.
+    """
+
+    def __init__(self, global_rate: float = None, global_burst: float = None,
+                 chat_rate: float = None, chat_burst: float = None,
+                 max_in_flight: int = None, max_retries: int = None,
+                 delete_rate: float = None, delete_burst: float = None):
+        """
+        Initialize the scheduler
+
+        Args:
+            global_rate: Requests per second across all chats (optional)
+            global_burst: Global bucket capacity (optional)
+            chat_rate: Requests per second per chat (optional)
+            chat_burst: Per-chat bucket capacity (optional)
+            max_in_flight: Maximum concurrent requests (optional)
+            max_retries: Flood-wait retries before a request fails (optional)
+            delete_rate: Delete requests per second per chat (optional)
+            delete_burst: Per-chat delete bucket capacity (optional)
+        """
+        self.global_rate = global_rate or Config.SCHEDULER_GLOBAL_RATE
+        self.chat_rate = chat_rate or Config.SCHEDULER_CHAT_RATE
+        self.chat_burst = chat_burst or Config.SCHEDULER_CHAT_BURST
+        self.delete_rate = delete_rate or Config.SCHEDULER_CHAT_DELETE_RATE
+        self.delete_burst = delete_burst or Config.SCHEDULER_CHAT_DELETE_BURST
+        self.max_retries = Config.SCHEDULER_MAX_RETRIES if max_retries is None else max_retries
+        self.global_bucket = TokenBucket(self.global_rate, global_burst or Config.SCHEDULER_GLOBAL_BURST)
+
+        self._lanes: Dict[int, _ChatLane] = {}
+        self._ready: List[Tuple[int, int, int]] = []
+        self._seq = itertools.count()
+        self._in_flight = asyncio.Semaphore(max_in_flight or Config.SCHEDULER_MAX_IN_FLIGHT)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests waiting to be sent"""
+        return sum(len(lane.jobs) for lane in self._lanes.values())
+
+    async def submit(self, chat_id: int, priority: Priority,
+                     func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Schedule an API call and wait for its result
+
+        Args:
+            chat_id: Chat the request targets
+            priority: Priority class of the request
+            func: Coroutine function performing the API call
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            Any: Result of the API call
+
+        Raises:
+            Exception: Whatever the API call raised
+        """
+        self._ensure_started()
+
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _ChatLane(
+                TokenBucket(self.chat_rate, self.chat_burst),
+                TokenBucket(self.delete_rate, self.delete_burst)
+            )
+
+        heapq.heappush(lane.jobs, _Job(priority, next(self._seq), func, args, kwargs, future))
+        self._mark_ready(chat_id, lane)
+        return await future
+
+    def _ensure_started(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    def _mark_ready(self, chat_id: int, lane: _ChatLane):
+        """Put a lane on the ready heap if it can send its next request"""
+        if lane.queued or lane.busy or not lane.jobs:
+            return
+
+        now = time.monotonic()
+        if lane.parked_until > now:
+            asyncio.get_running_loop().call_later(lane.parked_until - now, self._unpark, chat_id)
+            lane.queued = True
+            return
+
+        head = lane.jobs[0]
+        lane.queued = True
+        heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._wakeup.set()
+
+    def _unpark(self, chat_id: int):
+        lane = self._lanes.get(chat_id)
+        if lane is not None:
+            lane.queued = False
+            lane.parked_until = 0.0
+            self._mark_ready(chat_id, lane)
+
+    async def _dispatch(self):
+        """Hand ready requests to workers as the token buckets allow"""
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            if self._in_flight.locked():
+                # Wait for a free slot, then re-check which lane is at the top
+                await self._in_flight.acquire()
+                self._in_flight.release()
+                continue
+
+            priority, seq, chat_id = self._ready[0]
+            lane = self._lanes[chat_id]
+            now = time.monotonic()
+
+            bucket = lane.delete_bucket if lane.jobs[0].priority == Priority.DELETE else lane.bucket
+            chat_wait = bucket.delay(now)
+            if chat_wait > 0:
+                heapq.heappop(self._ready)
+                lane.parked_until = now + chat_wait
+                lane.queued = False
+                self._mark_ready(chat_id, lane)
+                continue
+
+            global_wait = self.global_bucket.delay(now)
+            if global_wait > 0:
+                # Re-check the heap afterwards, a higher priority request may arrive meanwhile
+                await asyncio.sleep(global_wait)
+                continue
+
+            await self._in_flight.acquire()  # Free slot, returns without suspending
+            heapq.heappop(self._ready)
+            bucket.take()
+            self.global_bucket.take()
+            lane.queued = False
+            lane.busy = True
+
+            task = asyncio.ensure_future(self._run(chat_id, lane, heapq.heappop(lane.jobs)))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, chat_id: int, lane: _ChatLane, job: _Job):
+        """Execute one request and handle flood-wait"""
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            job.attempts += 1
+            self._throttle()
+            if job.attempts > self.max_retries or self._dispatcher is None:
+                # Out of retries, or stopped meanwhile and nothing would resend it
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                logger.warning("Flood wait of %ss in chat %s, parking its queue", e.retry_after, chat_id)
+                lane.parked_until = time.monotonic() + float(e.retry_after)
+                heapq.heappush(lane.jobs, job)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self._recover()
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            lane.busy = False
+            self._in_flight.release()
+            if lane.jobs:
+                self._mark_ready(chat_id, lane)
+            else:
+                self._drop_when_idle(chat_id, lane)
+
+    def _throttle(self):
+        """Halve the global rate after a flood-wait"""
+        self.global_bucket.rate = max(self.global_rate / 16, self.global_bucket.rate / 2)
+
+    def _recover(self):
+        """Grow the global rate back towards its configured value"""
+        if self.global_bucket.rate < self.global_rate:
+            self.global_bucket.rate = min(self.global_rate, self.global_bucket.rate + self.global_rate / 100)
+
+    def _drop_when_idle(self, chat_id: int, lane: _ChatLane):
+        """Forget an idle lane once its bucket is full, so it cannot gain extra burst"""
+        now = time.monotonic()
+        delay = max(lane.bucket.time_to_full(now), lane.delete_bucket.time_to_full(now))
+        if delay <= 0:
+            del self._lanes[chat_id]
+        else:
+            asyncio.get_running_loop().call_later(delay, self._drop_idle_lane, chat_id, lane)
+
+    def _drop_idle_lane(self, chat_id: int, lane: _ChatLane):
+        if self._lanes.get(chat_id) is lane and not lane.jobs and not lane.busy:
+            del self._lanes[chat_id]
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Wait for queued requests to be sent, then stop the dispatcher
+
+        Requests still queued after the timeout fail with a RuntimeError.
+
+        Args:
+            timeout: Maximum seconds to wait for the queue to drain
+        """
+        deadline = time.monotonic() + timeout
+        while (self.queue_depth or self._tasks) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+        error = RuntimeError("Request scheduler stopped before the request was sent")
+        unsent = 0
+        for lane in self._lanes.values():
+            for job in lane.jobs:
+                if not job.future.done():
+                    job.future.set_exception(error)
+                    unsent += 1
+            lane.jobs.clear()
+            lane.queued = False
+        self._ready.clear()
+        if unsent:
+            logger.warning("Request scheduler stopped with %d requests unsent", unsent)
@@ -0,0 +1,494 @@
+"""
+Multi-process mode: chat-affinity sharding of updates across workers
+
+A front process receives webhook requests, reads only the chat ID from the
+raw body and forwards the body to the worker owning that chat. Each worker
+runs its own Application and owns one storage shard, and processes its
+updates in arrival order, so updates of a chat stay ordered.
+
+Before the workers start, the store is split by ring owner: on the first
+sharded start from the unsharded store, and again whenever the number of
+workers changed, by merging the previous shards and splitting them anew.
+
+Each worker reads its bodies from a pipe of its own. A worker that died
+may have held a half-read message or a queue lock, so a restarted worker
+gets a fresh pipe, and the bodies its predecessor left unread move over.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+from bisect import bisect
+from collections import deque
+from datetime import datetime
+from multiprocessing.connection import Connection
+from typing import List, Optional
+from config import Config
+from asgi import ASGIApp, Request, Response, run_asgi
+from dedup import UpdateDeduplicator, peek_update
+from prefilter import ALLOWED_UPDATES, is_relevant
+from storage_backends import create_backend
+
+logger = logging.getLogger(__name__)
+
+# Worker supervision: check interval, and restart delay doubling per crash up
+# to the maximum, reset once a worker stayed up for WORKER_STABLE_SECONDS
+SUPERVISE_INTERVAL = 1.0
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+WORKER_STABLE_SECONDS = 60.0
+
+def _hash(key: bytes) -> int:
+    return struct.unpack('>Q', hashlib.blake2b(key, digest_size=8).digest())[0]
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes: int, replicas: int = 128):
+        """
+        Initialize the ring
+
+        Args:
+            nodes: Number of workers
+            replicas: Virtual nodes per worker
+        """
+        points = sorted(
+            (_hash(f'worker-{node}-{replica}'.encode()), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, chat_id: int) -> int:
+        """
+        Get the worker owning a chat
+
+        Args:
+            chat_id: Telegram chat ID
+
+        Returns:
+            int: Worker index
+        """
+        index = bisect(self._points, _hash(struct.pack('>q', chat_id)))
+        return self._nodes[index % len(self._nodes)]
+
+def shard_path(path: str, index: int) -> str:
+    """Storage file of a shard, e.g. bot_settings.json -> bot_settings.shard0.json"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}{ext}"
+
+def _base_file(kind: str) -> str:
+    return Config.SQLITE_FILE if kind == 'sqlite' else Config.STORAGE_FILE
+
+def _layout_file(kind: str) -> str:
+    """Records the number of shards the store is currently split into"""
+    return f"{_base_file(kind)}.shards.json"
+
+def _read_layout(kind: str) -> Optional[int]:
+    try:
+        with open(_layout_file(kind), 'r', encoding='utf-8') as f:
+            return json.load(f)['workers']
+    except FileNotFoundError:
+        return None
+
+def _write_layout(kind: str, workers: int):
+    path = _layout_file(kind)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({'workers': workers}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+def _load_store(kind: str, path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    backend = create_backend(kind, storage_file=path)
+    try:
+        return backend.load()
+    finally:
+        backend.close()
+
+def _remove_store(path: str):
+    # SQLite would otherwise replay a stale journal into the replaced file
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def _install_shards(kind: str, workers: int):
+    """Move fully written shards from their temporary files into place"""
+    for index in range(workers):
+        path = shard_path(_base_file(kind), index)
+        if os.path.exists(f"{path}.rebalance"):
+            _remove_store(path)
+            os.replace(f"{path}.rebalance", path)
+
+def partition_storage(workers: int, ring: HashRing, kind: str = None) -> int:
+    """
+    Split the store into one shard per worker, each holding the chats it owns
+
+    The first sharded start splits the unsharded store (for SQLite, the JSON
+    file if no database exists yet); the unsharded store itself is kept as is
+    and no longer updated. When the number of workers changed, the previous
+    shards are merged and split by the new ring. New shards are written to
+    temporary files and only moved into place once all of them are complete,
+    so an interrupted rebalance is redone from the previous shards.
+
+    Must run before the workers open their shards.
+
+    Args:
+        workers: Number of workers
+        ring: Ring assigning chats to workers
+        kind: 'json' or 'sqlite' (optional, defaults to Config.STORAGE_BACKEND)
+
+    Returns:
+        int: Number of chats written, 0 if the shards were already in place
+    """
+    kind = (kind or Config.STORAGE_BACKEND).lower()
+    base_file = _base_file(kind)
+    previous = _read_layout(kind)
+    if previous == workers:
+        # Finish a rebalance interrupted after all shards were written
+        _install_shards(kind, workers)
+        return 0
+
+    if previous is not None:
+        sources = [(kind, shard_path(base_file, index)) for index in range(previous)]
+    elif kind == 'sqlite' and not os.path.exists(base_file):
+        sources = [('json', Config.STORAGE_FILE)]
+    else:
+        sources = [(kind, base_file)]
+
+    chats: dict = {}
+    metadata: dict = {}
+    # Shard 0 handles updates without a chat, so its metadata wins
+    for source_kind, path in reversed(sources):
+        data = _load_store(source_kind, path) or {}
+        chats.update(data.get('chats', {}))
+        metadata.update(data.get('metadata', {}))
+
+    # Backends treat a store without metadata as never written
+    created_at = metadata.get('created_at') or datetime.now().isoformat()
+    shards = [{'chats': {}, 'metadata': {'created_at': created_at}} for _ in range(workers)]
+    shards[0]['metadata'] = {**metadata, 'created_at': created_at}
+    for chat_key, settings in chats.items():
+        shards[ring.node_for(int(chat_key))]['chats'][chat_key] = settings
+
+    for index, shard in enumerate(shards):
+        temporary = f"{shard_path(base_file, index)}.rebalance"
+        _remove_store(temporary)
+        backend = create_backend(kind, storage_file=temporary)
+        backend.save_all(lambda shard=shard: shard)
+        backend.close()
+
+    _write_layout(kind, workers)
+    _install_shards(kind, workers)
+    for index in range(workers, previous or 0):
+        _remove_store(shard_path(base_file, index))
+
+    logger.info(
+        f"Split {len(chats)} chats into {workers} storage shards "
+        f"(from {'the unsharded store' if previous is None else f'{previous} shards'})"
+    )
+    return len(chats)
+
+class WorkerInbox:
+    """
+    Raw update bodies for one worker process
+
+    Bodies wait in memory and a feeder thread writes them to a pipe only
+    the worker reads, so the event loop never blocks on a full pipe. An
+    empty body tells the worker to stop.
+    """
+
+    def __init__(self, context=multiprocessing):
+        """
+        Initialize the inbox; feeding starts with start()
+
+        Args:
+            context: multiprocessing context creating the pipe (optional)
+        """
+        self.reader, self._writer = context.Pipe(duplex=False)
+        self._pending: deque = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._feeder = threading.Thread(target=self._feed, name='worker-inbox-feeder', daemon=True)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        """Start writing bodies to the pipe"""
+        self._feeder.start()
+
+    def put(self, body: bytes):
+        """Queue a body for the worker, or None to stop it"""
+        with self._cond:
+            self._pending.append(body or b'')
+            self._cond.notify()
+
+    def requeue(self, bodies: List[bytes]):
+        """Queue bodies ahead of everything put so far"""
+        with self._cond:
+            self._pending.extendleft(reversed(bodies))
+            self._cond.notify()
+
+    def _feed(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                body = self._pending.popleft()
+            try:
+                self._writer.send_bytes(body)
+            except OSError as e:
+                logger.error(f"Worker inbox closed while sending: {e}")
+                return
+
+    def retire(self) -> List[bytes]:
+        """
+        Stop feeding and take back every body the worker did not read (blocking)
+
+        Returns:
+            list: Unread bodies in the order they were put
+        """
+        with self._cond:
+            self._closed = True
+            pending = list(self._pending)
+            self._pending.clear()
+            self._cond.notify()
+
+        # The feeder may be blocked on the full pipe; reading unblocks it
+        unread = []
+        try:
+            while self._feeder.is_alive() or self.reader.poll():
+                if self.reader.poll(0.05):
+                    unread.append(self.reader.recv_bytes())
+        except (OSError, EOFError) as e:
+            # A worker killed mid-read leaves the stream out of step
+            logger.error(f"Lost the rest of a dead worker's pipe: {e}")
+        self.close()
+        return [body for body in unread + pending if body]
+
+    def close(self):
+        """Stop feeding and close both ends of the pipe"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.reader.close()
+        self._writer.close()
+
+def run_worker(index: int, bot_token: str, inbox: Connection, workers: int = 1):
+    """
+    Entry point of a worker process
+
+    Args:
+        index: Worker index, selecting the storage shard
+        bot_token: Telegram bot token
+        inbox: Read end of the worker's pipe of raw update bodies
+        workers: Number of workers sharing the bot token (optional)
+    """
+    from logging_setup import configure_logging
+    configure_logging(fmt=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_worker_main(index, bot_token, inbox, workers))
+
+async def _worker_main(index: int, bot_token: str, inbox: Connection, workers: int = 1):
+    """Run an Application fed from the inbox until an empty body or the front closing it"""
+    from telegram import Update
+    from bot_setup import build_application
+    from storage import Storage
+
+    # The global limit applies to the token, so each worker gets its share;
+    # per-chat limits stay as they are since every chat has one worker
+    Config.SCHEDULER_GLOBAL_RATE /= workers
+    Config.SCHEDULER_GLOBAL_BURST = max(Config.SCHEDULER_GLOBAL_BURST / workers, 1)
+
+    storage = Storage(storage_file=shard_path(_base_file(Config.STORAGE_BACKEND.lower()), index))
+    application = build_application(bot_token, storage, updater=False)
+
+    await asyncio.to_thread(storage.wait_ready)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    logger.info(f"Worker {index} ready")
+
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+
+    def read_inbox():
+        """Blocking reader thread handing bodies to the event loop"""
+        while True:
+            try:
+                body = inbox.recv_bytes()
+            except EOFError:
+                body = b''
+            if not body:
+                loop.call_soon_threadsafe(stopped.set)
+                return
+            loop.call_soon_threadsafe(enqueue, body)
+
+    def enqueue(body: bytes):
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+            application.update_queue.put_nowait(update)
+        except Exception as e:
+            logger.error(f"Dropping undecodable update: {e!r}")
+
+    threading.Thread(target=read_inbox, name='worker-inbox', daemon=True).start()
+    await stopped.wait()
+
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+
+class ShardDispatcher(ASGIApp):
+    """Front ASGI application routing webhook bodies to worker processes"""
+
+    def __init__(self, bot_token: str, workers: int = None, webhook_url: str = None):
+        """
+        Initialize the dispatcher
+
+        Args:
+            bot_token: Telegram bot token
+            workers: Number of worker processes (optional)
+            webhook_url: Public base URL the webhook is registered at (optional)
+        """
+        super().__init__()
+        self.bot_token = bot_token
+        self.workers = workers or Config.WORKER_PROCESSES
+        self.webhook_url = Config.WEBHOOK_URL if webhook_url is None else webhook_url
+        self.ring = HashRing(self.workers)
+        # Kept in memory only; the front process has no storage of its own
+        self.dedup = UpdateDeduplicator()
+        self._context = multiprocessing.get_context('spawn')
+        self._inboxes: List[WorkerInbox] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._supervisor: Optional[asyncio.Task] = None
+
+        self.add_route('GET', '/health', self.health)
+        self.add_route('POST', '/webhook', self.webhook)
+
+    def _spawn(self, index: int):
+        inbox = self._inboxes[index]
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self.bot_token, inbox.reader, self.workers),
+            name=f'worker{index}',
+            daemon=True
+        )
+        process.start()
+        inbox.start()
+        self._processes[index] = process
+
+    async def _respawn(self, index: int):
+        """Restart a dead worker on a fresh inbox holding the bodies it left unread"""
+        old = self._inboxes[index]
+        # Bodies arriving meanwhile wait in the new inbox, behind the unread ones
+        self._inboxes[index] = inbox = WorkerInbox(self._context)
+        unread = await asyncio.to_thread(old.retire)
+        inbox.requeue(unread)
+        if unread:
+            logger.warning(f"Moved {len(unread)} unread updates to the restarted worker {index}")
+        self._spawn(index)
+
+    async def _supervise(self):
+        """Restart dead workers with backoff, keeping the updates queued for them"""
+        loop = asyncio.get_running_loop()
+        delays = [RESTART_DELAY] * self.workers
+        started = [loop.time()] * self.workers
+        restart_at = [None] * self.workers
+
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            now = loop.time()
+            for index, process in enumerate(self._processes):
+                if process.is_alive():
+                    if now - started[index] >= WORKER_STABLE_SECONDS:
+                        delays[index] = RESTART_DELAY
+                    continue
+
+                if restart_at[index] is None:
+                    restart_at[index] = now + delays[index]
+                    logger.error(
+                        f"Worker {index} died with exit code {process.exitcode}, "
+                        f"restarting in {delays[index]:g}s"
+                    )
+                elif now >= restart_at[index]:
+                    await self._respawn(index)
+                    started[index] = now
+                    restart_at[index] = None
+                    delays[index] = min(delays[index] * 2, MAX_RESTART_DELAY)
+
+    async def startup(self):
+        """Split the store, start the workers and register the webhook"""
+        await asyncio.to_thread(partition_storage, self.workers, self.ring)
+        self._inboxes = [WorkerInbox(self._context) for _ in range(self.workers)]
+        self._processes = [None] * self.workers
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info(f"Started {self.workers} worker processes")
+        self._supervisor = asyncio.ensure_future(self._supervise())
+
+        if self.webhook_url:
+            from telegram import Bot
+            async with Bot(self.bot_token, base_url=Config.TELEGRAM_API_URL) as bot:
+                await bot.set_webhook(f"{self.webhook_url}/webhook", allowed_updates=ALLOWED_UPDATES)
+            logger.info(f"Webhook set to: {self.webhook_url}/webhook")
+        else:
+            logger.error("Multi-process mode needs WEBHOOK_URL; no updates will be received")
+
+        await super().startup()
+
+    async def shutdown(self):
+        """Stop the workers after they processed their queued updates"""
+        await super().shutdown()
+
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            await asyncio.to_thread(process.join, 30)
+        for inbox in self._inboxes:
+            inbox.close()
+
+    async def health(self, request: Request) -> Response:
+        """Health check endpoint; dead workers are restarted by the supervisor"""
+        alive = sum(1 for process in self._processes if process.is_alive())
+        if alive == 0:
+            status, code = "unhealthy", 503
+        else:
+            status, code = ("degraded" if alive < self.workers else "healthy"), 200
+        queued = [len(inbox) for inbox in self._inboxes]
+        return Response.json({"status": status, "workers": self.workers, "alive": alive, "queued": queued}, code)
+
+    async def webhook(self, request: Request) -> Response:
+        """Forward the raw update to the worker owning its chat"""
+        if request.body and is_relevant(request.body):
+            update_id, chat_id = peek_update(request.body)
+            if update_id is not None and self.dedup.is_replay(update_id, chat_id):
+                return Response.json({"status": "ok"})
+
+            worker = self.ring.node_for(chat_id) if chat_id is not None else 0
+            self._inboxes[worker].put(request.body)
+        return Response.json({"status": "ok"})
+
+def serve_sharded(bot_token: str, workers: int = None):
+    """
+    Run the front dispatcher with worker processes
+
+    Args:
+        bot_token: Telegram bot token
+        workers: Number of worker processes (optional)
+    """
+    run_asgi(ShardDispatcher(bot_token, workers))
@@ -0,0 +1,69 @@
+"""
+Startup timing and readiness signal
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+class StartupTimer:
+    """Records how long the process takes to reach each startup stage"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._ready = threading.Event()
+
+    def mark(self, stage: str) -> float:
+        """
+        Record that a startup stage was reached (only the first time counts)
+
+        Args:
+            stage: Name of the stage
+
+        Returns:
+            float: Seconds since process start
+        """
+        if stage not in self.stages:
+            self.stages[stage] = time.perf_counter() - self.started
+            logger.info(f"Startup: {stage} after {self.stages[stage]:.3f}s")
+        return self.stages[stage]
+
+    @property
+    def ready(self) -> bool:
+        """Whether the bot is initialized and can process updates"""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        """
+        Block until the bot is ready
+
+        Args:
+            timeout: Maximum seconds to wait (optional)
+
+        Returns:
+            bool: True if the bot is ready
+        """
+        return self._ready.wait(timeout)
+
+    async def on_post_init(self, application: Application):
+        """Application post_init callback signalling readiness"""
+        self.mark('bot_initialized')
+        self._ready.set()
+
+    async def on_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Catch-all handler recording the time to the first processed update"""
+        if 'first_update_processed' not in self.stages:
+            self.mark('first_update_processed')
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        """Stage timings in seconds, rounded for display"""
+        return {stage: round(elapsed, 3) for stage, elapsed in self.stages.items()}
+
+# Created on first import, which app.py does before anything else
+startup_timer = StartupTimer()
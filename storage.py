@@ -2,59 +2,240 @@
 Storage management for bot settings and data
 """
 
+import asyncio
 import json
-import os
 import logging
-from typing import Dict, Any
+import threading
+import time
+from collections.abc import Mapping
+from typing import Dict, Optional, Tuple
 from datetime import datetime
 from config import Config
+from chat_index import ChatIndex, ChatView, ChatsView
+from storage_backends import StorageBackend, create_backend
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows; the store is then not guarded against restores
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+def lock_store(location: str, exclusive: bool = False):
+    """
+    Take the advisory lock of a store
+    
+    Every open Storage holds it shared; a restore takes it exclusively, so
+    it cannot replace the data of a store a running bot has open.
+    
+    Args:
+        location: Storage location; namespaces of one database share its lock
+        exclusive: Take the lock exclusively (optional)
+        
+    Returns:
+        File holding the lock until it is closed, or None without advisory locks
+        
+    Raises:
+        RuntimeError: If another process holds a conflicting lock
+    """
+    if fcntl is None or not location:
+        return None
+    
+    lock_path = f"{location.split('#')[0]}.lock"
+    lock_file = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock_file, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        if exclusive:
+            raise RuntimeError(f"{location} is in use by a running bot ({lock_path}); stop it first")
+        raise RuntimeError(f"{location} is being restored ({lock_path}); wait for the restore to finish")
+    return lock_file
+
 class Storage:
-    """Simple JSON file storage for bot settings"""
+    """Bot settings storage, persisted through a pluggable backend"""
     
-    def __init__(self, storage_file: str = None):
+    def __init__(self, storage_file: str = None, backend: StorageBackend = None, lazy: bool = None,
+                 exclusive: bool = False):
         """
         Initialize storage
         
         Args:
             storage_file: Path to storage file (optional)
+            backend: Persistence backend (optional, defaults to Config.STORAGE_BACKEND)
+            lazy: Load the data in a background thread instead of blocking (optional)
+            exclusive: Refuse to open a store another process has open, e.g. to restore it (optional)
+            
+        Raises:
+            RuntimeError: If the store is locked by another process
         """
-        self.storage_file = storage_file or Config.STORAGE_FILE
-        self.data = self._load_data()
-    
-    def _load_data(self) -> dict:
-        """Load data from storage file"""
-        if not os.path.exists(self.storage_file):
-            logger.info(f"Storage file {self.storage_file} doesn't exist, creating new one")
-            return {'chats': {}, 'metadata': {'created_at': datetime.now().isoformat()}}
+        self.backend = backend or create_backend(storage_file=storage_file)
+        self.storage_file = self.backend.location
+        try:
+            self._store_lock = lock_store(self.storage_file, exclusive)
+        except RuntimeError:
+            self.backend.close()
+            raise
+        # Guards the index against snapshots taken by background flushers
+        self._lock = threading.RLock()
+        self.chats = ChatIndex()
+        self.metadata: dict = {}
+        self._ready = threading.Event()
         
+        if Config.STORAGE_LAZY_LOAD if lazy is None else lazy:
+            threading.Thread(target=self._load_in_background, name='storage-loader', daemon=True).start()
+        else:
+            self._load_data()
+            self._ready.set()
+    
+    def _load_in_background(self):
+        """Load the data and signal readiness, even if loading failed"""
+        started = time.perf_counter()
         try:
-            with open(self.storage_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                logger.info(f"Loaded data from {self.storage_file}")
-                return data
-        except (json.JSONDecodeError, IOError) as e:
-            logger.error(f"Error loading storage file {self.storage_file}: {e}")
-            logger.info("Creating new storage data")
-            return {'chats': {}, 'metadata': {'created_at': datetime.now().isoformat()}}
+            self._load_data()
+            logger.info(f"Loaded {len(self.chats)} chats in {time.perf_counter() - started:.3f}s")
+        except Exception as e:
+            logger.error(f"Error loading storage in background: {e}")
+        finally:
+            self._ready.set()
+    
+    @property
+    def ready(self) -> bool:
+        """Whether the data has been loaded"""
+        return self._ready.is_set()
+    
+    def wait_ready(self, timeout: float = None) -> bool:
+        """
+        Block until the data has been loaded
+        
+        Args:
+            timeout: Maximum seconds to wait (optional)
+            
+        Returns:
+            bool: True if the data is loaded
+        """
+        return self._ready.wait(timeout)
     
-    def _save_data(self):
-        """Save data to storage file"""
+    def _wait_ready(self):
+        """Return at once when loaded; blocking before that stalls an event loop caller"""
+        if self._ready.is_set():
+            return
         try:
-            # Update metadata
-            self.data['metadata']['updated_at'] = datetime.now().isoformat()
+            asyncio.get_running_loop()
+            logger.warning("Storage used on the event loop before it finished loading; blocking until it has")
+        except RuntimeError:
+            pass
+        self._ready.wait()
+    
+    def _load_data(self):
+        """Load data from the backend into the chat index"""
+        data = self.backend.load()
+        if data is None:
+            self.metadata = {'created_at': datetime.now().isoformat()}
+            return
+        
+        self._replace(data)
+    
+    def _replace(self, data: dict):
+        """Replace the in-memory store with data in the storage file format"""
+        chats = ChatIndex()
+        chats.put_many((int(chat_key), settings) for chat_key, settings in data.get('chats', {}).items())
+        
+        with self._lock:
+            self.chats = chats
+            self.metadata = dict(data.get('metadata', {}))
+    
+    def _snapshot(self) -> dict:
+        """Consistent copy of the full store as handed to the backend"""
+        with self._lock:
+            chats = self.chats.copy()
+            metadata = dict(self.metadata)
+        
+        # Expanding to the file format happens outside the lock
+        return {'chats': chats.to_dict(), 'metadata': metadata}
+    
+    def snapshot_index(self) -> Tuple[ChatIndex, dict]:
+        """
+        Point-in-time copy of the chat index and metadata
+        
+        Only the bulk array copy happens under the lock, so this is cheap
+        enough to call while updates are being handled.
+        
+        Returns:
+            tuple: (ChatIndex, metadata)
+        """
+        self._wait_ready()
+        with self._lock:
+            return self.chats.copy(), dict(self.metadata)
+    
+    def load_index(self, chats: ChatIndex, metadata: dict):
+        """
+        Replace the whole store with a prebuilt index and persist it
+        
+        Args:
+            chats: New chat index
+            metadata: New metadata
+        """
+        self._wait_ready()
+        with self._lock:
+            self.chats = chats
+            self.metadata = dict(metadata)
+            self._touch()
+        self.backend.save_all(self._snapshot)
+    
+    def _touch(self):
+        """Update the metadata timestamp"""
+        self.metadata['updated_at'] = datetime.now().isoformat()
+    
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until all changes are persisted
+        
+        Args:
+            timeout: Maximum seconds to wait (optional)
             
-            # Write to file
-            with open(self.storage_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, ensure_ascii=False)
+        Returns:
+            bool: True if everything pending was written
+        """
+        return self.backend.flush(timeout)
+    
+    def close(self):
+        """Flush pending changes and release the backend"""
+        self.backend.close()
+        if self._store_lock is not None:
+            self._store_lock.close()
+            self._store_lock = None
+    
+    def get_metadata(self, key: str, default: str = None) -> str:
+        """
+        Get a metadata value
+        
+        Args:
+            key: Metadata key
+            default: Value if the key is not set (optional)
             
-            logger.debug(f"Data saved to {self.storage_file}")
-        except IOError as e:
-            logger.error(f"Error saving to storage file {self.storage_file}: {e}")
+        Returns:
+            str: Stored value
+        """
+        self._wait_ready()
+        return self.metadata.get(key, default)
+    
+    def set_metadata(self, key: str, value: str):
+        """
+        Store a metadata value
+        
+        Args:
+            key: Metadata key
+            value: Value to store
+        """
+        self._wait_ready()
+        with self._lock:
+            self.metadata[key] = value
+            self._touch()
+        self.backend.save_metadata(key, value, self._snapshot)
     
-    def get_chat_settings(self, chat_id: int) -> dict:
+    def get_chat_settings(self, chat_id: int) -> Mapping:
         """
         Get settings for a specific chat
         
@@ -62,44 +243,113 @@ class Storage:
             chat_id: Telegram chat ID
             
         Returns:
-            dict: Chat settings
+            Mapping: Read-only view of the chat settings
         """
-        chat_key = str(chat_id)
+        self._wait_ready()
+        slot = self.chats.find(chat_id)
         
-        if chat_key not in self.data['chats']:
+        if slot < 0:
             # Create default settings for new chat
-            settings = Config.DEFAULT_CHAT_SETTINGS.copy()
-            settings['created_at'] = datetime.now().isoformat()
-            settings['updated_at'] = settings['created_at']
+            now = int(time.time())
+            defaults = Config.DEFAULT_CHAT_SETTINGS
             
-            self.data['chats'][chat_key] = settings
-            self._save_data()
+            with self._lock:
+                slot = self.chats.put_settings(chat_id, {**defaults, 'created_at': now, 'updated_at': now})
+                self._touch()
+            self.backend.save_chat(str(chat_id), self.chats.settings(slot), self._snapshot)
             
             logger.info(f"Created default settings for chat {chat_id}")
         
-        return self.data['chats'][chat_key].copy()
+        return ChatView(self.chats, chat_id, slot)
+    
+    def peek_chat_settings(self, chat_id: int) -> Optional[Mapping]:
+        """
+        Get settings for a specific chat without creating them
+        
+        Args:
+            chat_id: Telegram chat ID
+            
+        Returns:
+            Mapping: Read-only view of the chat settings, or None for unknown chats
+        """
+        self._wait_ready()
+        return self.chats.view(chat_id)
     
-    def save_chat_settings(self, chat_id: int, settings: dict):
+    def save_chat_settings(self, chat_id: int, settings: Mapping):
         """
         Save settings for a specific chat
         
         Args:
             chat_id: Telegram chat ID
-            settings: Settings dictionary to save
+            settings: Settings to save
+        """
+        self._wait_ready()
+        now = int(time.time())
+        
+        with self._lock:
+            slot = self.chats.find(chat_id)
+            # Keep created_at of existing chats, new chats are created now
+            created_at = self.chats.created_at(slot) if slot >= 0 else now
+            slot = self.chats.put_settings(chat_id, {**settings, 'created_at': created_at, 'updated_at': now})
+            self._touch()
+        self.backend.save_chat(str(chat_id), self.chats.settings(slot), self._snapshot)
+        
+        logger.debug(f"Saved settings for chat {chat_id}")
+    
+    def update_chat_settings(self, chat_id: int, **changes):
         """
-        chat_key = str(chat_id)
+        Change individual settings of a chat, keeping the others
         
-        # Update timestamp
-        settings['updated_at'] = datetime.now().isoformat()
+        Args:
+            chat_id: Telegram chat ID
+            **changes: Settings to set; a value of None removes the key
+        """
+        # Unknown chats are created with the changes in one write
+        current = self.peek_chat_settings(chat_id)
+        settings = dict(Config.DEFAULT_CHAT_SETTINGS if current is None else current)
+        for key, value in changes.items():
+            if value is None:
+                settings.pop(key, None)
+            else:
+                settings[key] = value
+        
+        self.save_chat_settings(chat_id, settings)
+    
+    def add_chat_counters(self, key: str, deltas: Dict[int, Dict[str, int]]):
+        """
+        Add to counters kept under a settings key of several chats, with one backend write
         
-        # If this is a new chat, add created_at
-        if chat_key not in self.data['chats']:
-            settings['created_at'] = settings['updated_at']
+        Args:
+            key: Settings key holding a {name: count} dictionary
+            deltas: Amounts to add by counter name, per chat ID
+        """
+        self._wait_ready()
+        now = int(time.time())
+        saved = []
         
-        self.data['chats'][chat_key] = settings
-        self._save_data()
+        with self._lock:
+            for chat_id, delta in deltas.items():
+                slot = self.chats.find(chat_id)
+                if slot >= 0:
+                    settings = self.chats.settings(slot)
+                    created_at = self.chats.created_at(slot)
+                else:
+                    settings = dict(Config.DEFAULT_CHAT_SETTINGS)
+                    created_at = now
+                
+                # A new dictionary, as snapshots share the old one
+                counters = dict(settings.get(key) or {})
+                for name, amount in delta.items():
+                    counters[name] = counters.get(name, 0) + amount
+                settings[key] = counters
+                
+                slot = self.chats.put_settings(chat_id, {**settings, 'created_at': created_at, 'updated_at': now})
+                saved.append((str(chat_id), self.chats.settings(slot)))
+            if saved:
+                self._touch()
         
-        logger.info(f"Saved settings for chat {chat_id}: {settings}")
+        if saved:
+            self.backend.save_chats(saved, self._snapshot)
     
     def delete_chat_settings(self, chat_id: int):
         """
@@ -108,36 +358,49 @@ class Storage:
         Args:
             chat_id: Telegram chat ID
         """
-        chat_key = str(chat_id)
+        self._wait_ready()
+        with self._lock:
+            removed = self.chats.remove(chat_id)
+            if removed:
+                self._touch()
         
-        if chat_key in self.data['chats']:
-            del self.data['chats'][chat_key]
-            self._save_data()
+        if removed:
+            self.backend.delete_chat(str(chat_id), self._snapshot)
             logger.info(f"Deleted settings for chat {chat_id}")
     
-    def get_all_chats(self) -> Dict[str, Any]:
+    def get_all_chats(self) -> Mapping:
         """
         Get settings for all chats
         
         Returns:
-            dict: All chat settings
+            Mapping: Read-only view of all chat settings, keyed by chat ID string
         """
-        return self.data['chats'].copy()
+        self._wait_ready()
+        return ChatsView(self.chats)
     
-    def get_enabled_chats(self) -> Dict[str, Any]:
+    def get_enabled_chats(self) -> Mapping:
         """
         Get all chats where the bot is enabled
         
         Returns:
-            dict: Enabled chat settings
+            Mapping: Read-only view of enabled chat settings
         """
-        enabled_chats = {}
-        
-        for chat_id, settings in self.data['chats'].items():
-            if settings.get('enabled', False):
-                enabled_chats[chat_id] = settings
+        self._wait_ready()
+        return ChatsView(self.chats, enabled_only=True)
+    
+    def is_enabled(self, chat_id: int) -> bool:
+        """
+        Check whether the hider is enabled for a chat (unknown chats count as enabled)
         
-        return enabled_chats
+        Args:
+            chat_id: Telegram chat ID
+            
+        Returns:
+            bool: True if enabled
+        """
+        self._wait_ready()
+        slot = self.chats.find(chat_id)
+        return slot < 0 or self.chats.is_enabled(slot)
     
     def get_stats(self) -> dict:
         """
@@ -146,8 +409,9 @@ class Storage:
         Returns:
             dict: Storage statistics
         """
-        total_chats = len(self.data['chats'])
-        enabled_chats = len(self.get_enabled_chats())
+        self._wait_ready()
+        total_chats = len(self.chats)
+        enabled_chats = self.chats.enabled_count
         disabled_chats = total_chats - enabled_chats
         
         return {
@@ -155,8 +419,8 @@ class Storage:
             'enabled_chats': enabled_chats,
             'disabled_chats': disabled_chats,
             'storage_file': self.storage_file,
-            'created_at': self.data['metadata'].get('created_at'),
-            'updated_at': self.data['metadata'].get('updated_at')
+            'created_at': self.metadata.get('created_at'),
+            'updated_at': self.metadata.get('updated_at')
         }
     
     def backup_data(self, backup_file: str = None) -> str:
@@ -169,13 +433,14 @@ class Storage:
         Returns:
             str: Path to backup file
         """
+        self._wait_ready()
         if not backup_file:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             backup_file = f"{self.storage_file}.backup_{timestamp}"
         
         try:
             with open(backup_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, ensure_ascii=False)
+                json.dump(self._snapshot(), f, indent=2, ensure_ascii=False)
             
             logger.info(f"Data backed up to {backup_file}")
             return backup_file
@@ -190,11 +455,15 @@ class Storage:
         Args:
             backup_file: Path to backup file
         """
+        self._wait_ready()
         try:
             with open(backup_file, 'r', encoding='utf-8') as f:
-                self.data = json.load(f)
+                data = json.load(f)
             
-            self._save_data()
+            self._replace(data)
+            with self._lock:
+                self._touch()
+            self.backend.save_all(self._snapshot)
             logger.info(f"Data restored from {backup_file}")
         except (json.JSONDecodeError, IOError) as e:
             logger.error(f"Error restoring from backup {backup_file}: {e}")
@@ -0,0 +1,603 @@
+"""
+Persistence backends for Storage
+"""
+
+import json
+import os
+import re
+import sqlite3
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+from config import Config
+from metrics import STORAGE_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Returns the full store as {'chats': {...}, 'metadata': {...}}
+Snapshot = Callable[[], dict]
+
+_NAMESPACE_RE = re.compile(r'^[A-Za-z0-9_]+$')
+
+def check_namespace(name: str) -> str:
+    """
+    Validate a storage namespace name
+
+    Args:
+        name: Namespace, letters, digits and underscores only
+
+    Returns:
+        str: The name
+
+    Raises:
+        ValueError: If the name contains other characters
+    """
+    if not _NAMESPACE_RE.match(name):
+        raise ValueError(f"Invalid storage namespace {name!r}: use letters, digits and underscores")
+    return name
+
+class StorageBackend(ABC):
+    """Interface between Storage and the medium its data is persisted in"""
+
+    #: Human readable location of the data, reported in Storage.get_stats
+    location: str = ''
+
+    @abstractmethod
+    def load(self) -> Optional[dict]:
+        """
+        Load the persisted data
+
+        Returns:
+            dict: {'chats': {...}, 'metadata': {...}}, or None if nothing is stored yet
+        """
+
+    @abstractmethod
+    def save_chat(self, chat_key: str, settings: dict, snapshot: Snapshot):
+        """
+        Persist the settings of one chat
+
+        Args:
+            chat_key: Chat ID as string
+            settings: Settings of that chat
+            snapshot: Provides the full store for backends that can only rewrite everything
+        """
+
+    def save_chats(self, items: List[Tuple[str, dict]], snapshot: Snapshot):
+        """
+        Persist the settings of several chats
+
+        Args:
+            items: (chat_key, settings) pairs
+            snapshot: Provides the full store for backends that can only rewrite everything
+        """
+        for chat_key, settings in items:
+            self.save_chat(chat_key, settings, snapshot)
+
+    @abstractmethod
+    def delete_chat(self, chat_key: str, snapshot: Snapshot):
+        """
+        Remove one chat from the persisted data
+
+        Args:
+            chat_key: Chat ID as string
+            snapshot: Provides the full store for backends that can only rewrite everything
+        """
+
+    @abstractmethod
+    def save_all(self, snapshot: Snapshot):
+        """
+        Replace the persisted data with the full store
+
+        Args:
+            snapshot: Provides the full store
+        """
+
+    def save_metadata(self, key: str, value: str, snapshot: Snapshot):
+        """
+        Persist one metadata value
+
+        Args:
+            key: Metadata key
+            value: Value to store
+            snapshot: Provides the full store for backends that can only rewrite everything
+        """
+        self.save_all(snapshot)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until all changes handed to the backend are persisted
+
+        Args:
+            timeout: Maximum seconds to wait (optional)
+
+        Returns:
+            bool: True if everything pending was written
+        """
+        return True
+
+    def close(self):
+        """Release resources held by the backend"""
+
+    def namespace(self, name: str) -> 'StorageBackend':
+        """
+        Get a backend for a separate store kept alongside this one
+
+        Args:
+            name: Namespace name, letters, digits and underscores only
+
+        Returns:
+            StorageBackend: Backend of the namespace
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support namespaces")
+
+class JSONFileBackend(StorageBackend):
+    """
+    Keeps everything in one JSON file
+
+    In write-behind mode changes only mark the store dirty; a background
+    thread writes one snapshot at most every flush_interval seconds, or
+    sooner once flush_max_changes changes have accumulated.
+    """
+
+    def __init__(self, storage_file: str, write_behind: bool = None,
+                 flush_interval: float = None, flush_max_changes: int = None):
+        """
+        Initialize the backend
+
+        Args:
+            storage_file: Path to the JSON file
+            write_behind: Defer writes to a background flusher (optional)
+            flush_interval: Seconds a change may wait before it is written (optional)
+            flush_max_changes: Changes that trigger an immediate flush (optional)
+        """
+        self.storage_file = storage_file
+        self.location = storage_file
+        self.write_behind = Config.STORAGE_WRITE_BEHIND if write_behind is None else write_behind
+        self.flush_interval = (
+            Config.STORAGE_FLUSH_INTERVAL_MS / 1000 if flush_interval is None else flush_interval
+        )
+        self.flush_max_changes = flush_max_changes or Config.STORAGE_FLUSH_MAX_CHANGES
+
+        self._cond = threading.Condition()
+        self._snapshot: Optional[Snapshot] = None
+        self._changes = 0
+        self._dirty_since = 0.0
+        self._generation = 0
+        self._flushed_generation = 0
+        # Error of the last write, reported by flush()
+        self._write_error: Optional[Exception] = None
+        self._force = False
+        self._closing = False
+        self._flusher: Optional[threading.Thread] = None
+
+    def load(self) -> Optional[dict]:
+        if not os.path.exists(self.storage_file):
+            logger.info(f"Storage file {self.storage_file} doesn't exist, creating new one")
+            return None
+
+        try:
+            with open(self.storage_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                logger.info(f"Loaded data from {self.storage_file}")
+                return data
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"Error loading storage file {self.storage_file}: {e}")
+            logger.info("Creating new storage data")
+            return None
+
+    def save_chat(self, chat_key: str, settings: dict, snapshot: Snapshot):
+        self._changed(snapshot)
+
+    def save_chats(self, items: List[Tuple[str, dict]], snapshot: Snapshot):
+        self._changed(snapshot)
+
+    def delete_chat(self, chat_key: str, snapshot: Snapshot):
+        self._changed(snapshot)
+
+    def save_all(self, snapshot: Snapshot):
+        self._changed(snapshot)
+        self.flush()
+
+    def save_metadata(self, key: str, value: str, snapshot: Snapshot):
+        self._changed(snapshot)
+
+    def _changed(self, snapshot: Snapshot):
+        """Write immediately, or mark the store dirty for the flusher"""
+        if not self.write_behind:
+            try:
+                self._write(snapshot())
+            except Exception as e:
+                logger.error(f"Error saving to storage file {self.storage_file}: {e!r}")
+            return
+
+        with self._cond:
+            if self._snapshot is None:
+                self._dirty_since = time.monotonic()
+            self._snapshot = snapshot
+            self._changes += 1
+            self._generation += 1
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='storage-flusher', daemon=True)
+                self._flusher.start()
+            self._cond.notify_all()
+
+    def _flush_loop(self):
+        """Background thread writing snapshots of the dirty store"""
+        while True:
+            with self._cond:
+                while self._snapshot is None and not self._closing:
+                    self._cond.wait()
+
+                # Group further changes into this write until the interval or size cap is hit
+                while (self._snapshot is not None and not self._closing and not self._force
+                       and self._changes < self.flush_max_changes):
+                    remaining = self._dirty_since + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                snapshot = self._snapshot
+                generation = self._generation
+                self._snapshot = None
+                self._changes = 0
+                self._force = False
+
+                if snapshot is None:
+                    return
+
+            # The thread must survive a failed write, or flush() and close() wait forever
+            try:
+                self._write(snapshot())
+                error = None
+            except Exception as e:
+                logger.error(f"Error saving to storage file {self.storage_file}: {e!r}")
+                error = e
+
+            with self._cond:
+                self._flushed_generation = generation
+                self._write_error = error
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Write pending changes now and wait until they are on disk
+
+        Args:
+            timeout: Maximum seconds to wait (optional)
+
+        Returns:
+            bool: True if everything pending was written, False on timeout or a failed write
+        """
+        with self._cond:
+            target = self._generation
+            if self._flushed_generation < target:
+                self._force = True
+                self._cond.notify_all()
+                if not self._cond.wait_for(lambda: self._flushed_generation >= target, timeout):
+                    return False
+            return self._write_error is None
+
+    def close(self):
+        """Flush pending changes and stop the flusher thread"""
+        if not self.flush():
+            logger.error(f"Closing {self.storage_file} with changes that could not be written")
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+
+    def namespace(self, name: str) -> 'JSONFileBackend':
+        """A JSON file next to this one, e.g. bot_settings.json -> bot_settings.acme.json"""
+        root, ext = os.path.splitext(self.storage_file)
+        return JSONFileBackend(f"{root}.{check_namespace(name)}{ext}", self.write_behind,
+                               self.flush_interval, self.flush_max_changes)
+
+    def _write(self, data: dict):
+        """
+        Atomically replace the JSON file with the given data
+
+        Raises:
+            Exception: If the data cannot be serialised or written; the file is left as it was
+        """
+        tmp_file = f"{self.storage_file}.tmp"
+        started = time.perf_counter()
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.storage_file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        STORAGE_FLUSH_SECONDS.observe(time.perf_counter() - started, 'json')
+        logger.debug(f"Data saved to {self.storage_file}")
+
+class _SQLiteWriter:
+    """
+    Thread running queued writes of one connection in order
+
+    Keeps SQLite I/O off the event loop. All writes queued since the last
+    transaction are committed together; if that fails they are retried one
+    per transaction, so one bad write does not take the others with it.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self._conn = conn
+        self._lock = lock
+        self._cond = threading.Condition()
+        self._queue: deque = deque()
+        self._submitted = 0
+        self._written = 0
+        self._error: Optional[Exception] = None
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, write: Callable[[], None]):
+        with self._cond:
+            self._queue.append(write)
+            self._submitted += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _commit(self, writes: List[Callable[[], None]]):
+        started = time.perf_counter()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN')
+            for write in writes:
+                write()
+        STORAGE_FLUSH_SECONDS.observe(time.perf_counter() - started, 'sqlite')
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                writes = list(self._queue)
+                self._queue.clear()
+
+            error = None
+            try:
+                self._commit(writes)
+            except Exception:
+                for write in writes:
+                    try:
+                        self._commit([write])
+                    except Exception as e:
+                        logger.error(f"Error writing to SQLite: {e!r}")
+                        error = e
+
+            with self._cond:
+                self._written += len(writes)
+                self._error = error
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        with self._cond:
+            target = self._submitted
+            if not self._cond.wait_for(lambda: self._written >= target, timeout):
+                return False
+            return self._error is None
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class SQLiteBackend(StorageBackend):
+    """
+    Keeps one row per chat in an SQLite database in WAL mode
+
+    Namespaces are table pairs (chats_<name>, metadata_<name>) in the same
+    database and share its connection. In write-behind mode writes are
+    committed by a background thread instead of the caller's.
+    """
+
+    def __init__(self, db_file: str, namespace: str = '', parent: 'SQLiteBackend' = None,
+                 write_behind: bool = None):
+        """
+        Initialize the backend
+
+        Args:
+            db_file: Path to the database file
+            namespace: Table name suffix; empty for the default tables (optional)
+            parent: Backend whose connection is shared (optional)
+            write_behind: Commit writes in a background thread (optional)
+        """
+        self.db_file = db_file
+        self.location = f"{db_file}#{namespace}" if namespace else db_file
+        suffix = f"_{check_namespace(namespace)}" if namespace else ''
+        self._chats = f"chats{suffix}"
+        self._metadata = f"metadata{suffix}"
+
+        if parent is None:
+            self._lock = threading.Lock()
+            self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            write_behind = Config.STORAGE_WRITE_BEHIND if write_behind is None else write_behind
+            self._writer = _SQLiteWriter(self._conn, self._lock) if write_behind else None
+        else:
+            self._lock = parent._lock
+            self._conn = parent._conn
+            self._writer = parent._writer
+        self._owns_connection = parent is None
+
+        with self._lock:
+            self._conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self._chats} (chat_id TEXT PRIMARY KEY, settings TEXT NOT NULL)'
+            )
+            self._conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self._metadata} (key TEXT PRIMARY KEY, value TEXT)'
+            )
+
+    def load(self) -> Optional[dict]:
+        with self._lock:
+            metadata = dict(self._conn.execute(f'SELECT key, value FROM {self._metadata}'))
+            if not metadata:
+                return None
+
+            chats = {
+                chat_key: json.loads(settings)
+                for chat_key, settings in self._conn.execute(f'SELECT chat_id, settings FROM {self._chats}')
+            }
+
+        logger.info(f"Loaded {len(chats)} chats from {self.location}")
+        return {'chats': chats, 'metadata': metadata}
+
+    def save_chat(self, chat_key: str, settings: dict, snapshot: Snapshot):
+        row = (chat_key, json.dumps(settings, ensure_ascii=False))
+
+        def write():
+            self._conn.execute(f'INSERT OR REPLACE INTO {self._chats} (chat_id, settings) VALUES (?, ?)', row)
+            self._touch()
+        self._submit(write)
+
+    def save_chats(self, items: List[Tuple[str, dict]], snapshot: Snapshot):
+        rows = [(chat_key, json.dumps(settings, ensure_ascii=False)) for chat_key, settings in items]
+
+        def write():
+            self._conn.executemany(f'INSERT OR REPLACE INTO {self._chats} (chat_id, settings) VALUES (?, ?)', rows)
+            self._touch()
+        self._submit(write)
+
+    def delete_chat(self, chat_key: str, snapshot: Snapshot):
+        def write():
+            self._conn.execute(f'DELETE FROM {self._chats} WHERE chat_id = ?', (chat_key,))
+            self._touch()
+        self._submit(write)
+
+    def save_all(self, snapshot: Snapshot):
+        data = snapshot()
+        rows = [(chat_key, json.dumps(settings, ensure_ascii=False)) for chat_key, settings in data['chats'].items()]
+        metadata = [(key, value) for key, value in data['metadata'].items() if value is not None]
+
+        def write():
+            self._conn.execute(f'DELETE FROM {self._chats}')
+            self._conn.executemany(f'INSERT INTO {self._chats} (chat_id, settings) VALUES (?, ?)', rows)
+            self._conn.execute(f'DELETE FROM {self._metadata}')
+            self._conn.executemany(f'INSERT INTO {self._metadata} (key, value) VALUES (?, ?)', metadata)
+        self._submit(write)
+        self.flush()
+
+    def save_metadata(self, key: str, value: str, snapshot: Snapshot):
+        def write():
+            self._conn.execute(f'INSERT OR REPLACE INTO {self._metadata} (key, value) VALUES (?, ?)', (key, value))
+            self._touch()
+        self._submit(write)
+
+    def _submit(self, write: Callable[[], None]):
+        """Hand a write to the writer thread, or commit it right away"""
+        if self._writer is not None:
+            self._writer.submit(write)
+            return
+
+        started = time.perf_counter()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN')
+            write()
+        STORAGE_FLUSH_SECONDS.observe(time.perf_counter() - started, 'sqlite')
+
+    def flush(self, timeout: float = None) -> bool:
+        return self._writer.flush(timeout) if self._writer is not None else True
+
+    def _touch(self):
+        """Update the metadata timestamp inside the current transaction"""
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {self._metadata} (key, value) VALUES ('updated_at', ?)",
+            (datetime.now().isoformat(),)
+        )
+
+    def namespace(self, name: str) -> 'SQLiteBackend':
+        """Tables of a namespace in the same database, sharing this backend's connection"""
+        return SQLiteBackend(self.db_file, name, parent=self)
+
+    def close(self):
+        """Write what is queued and close the connection; namespaces leave it to the backend that opened it"""
+        if not self._owns_connection:
+            return
+        if self._writer is not None:
+            if not self._writer.flush():
+                logger.error(f"Closing {self.db_file} with changes that could not be written")
+            self._writer.close()
+        with self._lock:
+            self._conn.close()
+
+def migrate_json_to_sqlite(json_file: str, db_file: str) -> int:
+    """
+    Copy the contents of a JSON settings file into an SQLite database
+
+    Args:
+        json_file: Path to the existing JSON storage file
+        db_file: Path to the SQLite database (created if missing)
+
+    Returns:
+        int: Number of migrated chats
+    """
+    data = JSONFileBackend(json_file).load()
+    if data is None:
+        raise ValueError(f"No readable data in {json_file}")
+
+    data.setdefault('chats', {})
+    data.setdefault('metadata', {})
+
+    backend = SQLiteBackend(db_file)
+    try:
+        backend.save_all(lambda: data)
+    finally:
+        backend.close()
+
+    logger.info(f"Migrated {len(data['chats'])} chats from {json_file} to {db_file}")
+    return len(data['chats'])
+
+def create_backend(kind: str = None, storage_file: str = None) -> StorageBackend:
+    """
+    Create the configured storage backend
+
+    Args:
+        kind: 'json' or 'sqlite' (optional, defaults to Config.STORAGE_BACKEND)
+        storage_file: Path to the storage file (optional)
+
+    Returns:
+        StorageBackend: Backend instance
+    """
+    kind = (kind or Config.STORAGE_BACKEND).lower()
+
+    if kind == 'json':
+        return JSONFileBackend(storage_file or Config.STORAGE_FILE)
+
+    if kind == 'sqlite':
+        db_file = storage_file or Config.SQLITE_FILE
+        if storage_file is None and not os.path.exists(db_file) and os.path.exists(Config.STORAGE_FILE):
+            # First start on SQLite: carry over the existing JSON settings. Only
+            # for the default store; shards are split from it by sharding.py
+            migrate_json_to_sqlite(Config.STORAGE_FILE, db_file)
+        return SQLiteBackend(db_file)
+
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate the JSON settings file to SQLite")
+    parser.add_argument('json_file', nargs='?', default=Config.STORAGE_FILE)
+    parser.add_argument('db_file', nargs='?', default=Config.SQLITE_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(f"Migrated {migrate_json_to_sqlite(args.json_file, args.db_file)} chats")
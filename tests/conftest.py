@@ -0,0 +1,8 @@
+import pytest
+from storage import Storage
+
+@pytest.fixture
+def storage(tmp_path):
+    store = Storage(storage_file=str(tmp_path / 'bot_settings.json'), lazy=False)
+    yield store
+    store.close()
@@ -0,0 +1,127 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from telegram.constants import ChatMemberStatus
+from telegram.error import NetworkError
+from admin_cache import AdminCache
+
+def member(user_id: int, status: str):
+    return SimpleNamespace(user=SimpleNamespace(id=user_id), status=status)
+
+ROSTER = [member(1, ChatMemberStatus.OWNER), member(2, ChatMemberStatus.ADMINISTRATOR)]
+
+class FakeBot:
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.error = error
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def get_chat_administrators(self, chat_id):
+        self.calls.append(chat_id)
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return ROSTER
+
+def member_update(chat_id: int, old: str, new: str):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id),
+        old_chat_member=SimpleNamespace(status=old),
+        new_chat_member=SimpleNamespace(status=new),
+    )
+
+def test_roster_is_fetched_once_and_cached():
+    async def run():
+        cache, bot = AdminCache(ttl=60, max_chats=10), FakeBot()
+        results = [await cache.is_admin(bot, -100, user_id) for user_id in (1, 2, 3)]
+        return results, bot.calls
+
+    results, calls = asyncio.run(run())
+    assert results == [True, True, False]
+    assert calls == [-100]
+
+def test_concurrent_lookups_share_one_request():
+    async def run():
+        cache, bot = AdminCache(ttl=60, max_chats=10), FakeBot()
+        bot.release.clear()
+        lookups = asyncio.gather(*(cache.admins(bot, -100) for _ in range(5)))
+        await asyncio.sleep(0)
+        bot.release.set()
+        return await lookups, bot.calls
+
+    results, calls = asyncio.run(run())
+    assert results == [frozenset({1, 2})] * 5
+    assert calls == [-100]
+
+def test_expired_and_evicted_rosters_are_fetched_again():
+    async def run():
+        bot = FakeBot()
+        expiring = AdminCache(ttl=0, max_chats=10)
+        await expiring.admins(bot, -100)
+        await expiring.admins(bot, -100)
+
+        small = AdminCache(ttl=60, max_chats=2)
+        for chat_id in (-1, -2, -1, -3, -1, -2):
+            await small.admins(bot, chat_id)
+        return bot.calls, len(small)
+
+    calls, cached = asyncio.run(run())
+    # -2 was the least recently used when -3 came in
+    assert calls == [-100, -100, -1, -2, -3, -2]
+    assert cached == 2
+
+def test_failed_fetch_is_not_cached():
+    async def run():
+        cache, bot = AdminCache(ttl=60, max_chats=10), FakeBot(NetworkError('timed out'))
+        with pytest.raises(NetworkError):
+            await cache.admins(bot, -100)
+        bot.error = None
+        return await cache.admins(bot, -100), bot.calls
+
+    admins, calls = asyncio.run(run())
+    assert admins == frozenset({1, 2})
+    assert calls == [-100, -100]
+
+def test_cancelled_caller_leaves_the_fetch_running():
+    async def run():
+        cache, bot = AdminCache(ttl=60, max_chats=10), FakeBot()
+        bot.release.clear()
+        first = asyncio.ensure_future(cache.admins(bot, -100))
+        second = asyncio.ensure_future(cache.admins(bot, -100))
+        await asyncio.sleep(0)
+        first.cancel()
+        bot.release.set()
+        return await second, first.cancelled(), bot.calls
+
+    admins, cancelled, calls = asyncio.run(run())
+    assert admins == frozenset({1, 2}) and cancelled
+    assert calls == [-100]
+
+def test_admin_changes_drop_the_roster():
+    async def run():
+        cache, bot = AdminCache(ttl=60, max_chats=10), FakeBot()
+        await cache.admins(bot, -100)
+        ignored = cache.on_member_update(member_update(-100, ChatMemberStatus.LEFT, ChatMemberStatus.MEMBER))
+        await cache.admins(bot, -100)
+        promoted = cache.on_member_update(member_update(-100, ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR))
+        await cache.admins(bot, -100)
+        return ignored, promoted, bot.calls
+
+    ignored, promoted, calls = asyncio.run(run())
+    assert not ignored and promoted
+    assert calls == [-100, -100]
+
+def test_fetch_invalidated_in_flight_is_not_cached():
+    async def run():
+        cache, bot = AdminCache(ttl=60, max_chats=10), FakeBot()
+        bot.release.clear()
+        lookup = asyncio.ensure_future(cache.admins(bot, -100))
+        await asyncio.sleep(0)
+        # The roster being fetched may predate the promotion
+        cache.on_member_update(member_update(-100, ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR))
+        bot.release.set()
+        await lookup
+        return len(cache)
+
+    assert asyncio.run(run()) == 0
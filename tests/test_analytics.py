@@ -0,0 +1,72 @@
+import json
+import pytest
+from analytics import DELETED, JOIN, LEAVE, METADATA_KEY, SETTINGS_KEY, ChatAnalytics
+
+# A day boundary, so bucket starts are easy to check
+NOW = 1_700_006_400
+
+def test_windows_count_per_resolution(storage):
+    analytics = ChatAnalytics(storage)
+    analytics.record(1, DELETED, now=NOW - 2 * 86400)
+    analytics.record(1, LEAVE, now=NOW - 2 * 3600)
+    analytics.record(1, JOIN, 3, now=NOW)
+    analytics.record(2, JOIN, now=NOW)
+
+    summary = analytics.chat_summary(1, now=NOW)
+    assert summary['last_hour'] == {'joins': 3, 'leaves': 0, 'deleted': 0}
+    assert summary['last_day'] == {'joins': 3, 'leaves': 1, 'deleted': 0}
+    assert summary['last_30_days'] == {'joins': 3, 'leaves': 1, 'deleted': 1}
+    assert summary['total'] == {'joins': 3, 'leaves': 1, 'deleted': 1}
+
+    assert analytics.global_summary(now=NOW)['last_hour']['joins'] == 4
+    assert analytics.global_summary(now=NOW)['tracked_chats'] == 2
+
+def test_old_buckets_are_reused_without_leftovers(storage):
+    analytics = ChatAnalytics(storage)
+    analytics.record(1, JOIN, now=NOW)
+    # The same minute bucket an hour later
+    analytics.record(1, JOIN, now=NOW + 3600)
+
+    series = analytics.series(1, 'minute', now=NOW + 3600)
+    assert len(series) == 60
+    assert series[-1] == {'start': NOW + 3600, 'joins': 1, 'leaves': 0, 'deleted': 0}
+    assert sum(bucket['joins'] for bucket in series) == 1
+    assert analytics.chat_summary(1, now=NOW + 3600)['last_day']['joins'] == 2
+
+def test_events_from_a_clock_going_backwards_count_as_newest(storage):
+    analytics = ChatAnalytics(storage)
+    analytics.record(1, JOIN, now=NOW)
+    analytics.record(1, LEAVE, now=NOW - 3600)
+    assert analytics.series(1, 'minute', now=NOW)[-1]['leaves'] == 1
+
+def test_unknown_resolution_is_rejected(storage):
+    with pytest.raises(ValueError):
+        ChatAnalytics(storage).series(None, 'week')
+
+def test_rollup_adds_pending_counts_to_storage(storage):
+    analytics = ChatAnalytics(storage)
+    analytics.record(1, JOIN, 2, now=NOW)
+    analytics.record(2, LEAVE, now=NOW)
+    assert analytics.rollup(now=NOW) == 2
+    assert analytics.rollup(now=NOW) == 0
+
+    analytics.record(1, DELETED, now=NOW)
+    analytics.rollup(now=NOW)
+    assert storage.peek_chat_settings(1)[SETTINGS_KEY] == {'joins': 2, 'deleted': 1}
+    assert storage.peek_chat_settings(2)[SETTINGS_KEY] == {'leaves': 1}
+    assert json.loads(storage.get_metadata(METADATA_KEY)) == {'joins': 2, 'leaves': 1, 'deleted': 1}
+
+    # Totals carry over to a new process, pending counts are added on top
+    analytics = ChatAnalytics(storage)
+    analytics.record(1, JOIN, now=NOW)
+    assert analytics.chat_summary(1, now=NOW)['total'] == {'joins': 3, 'leaves': 0, 'deleted': 1}
+    assert analytics.global_summary(now=NOW)['total'] == {'joins': 3, 'leaves': 1, 'deleted': 1}
+
+def test_rollup_forgets_idle_chats(storage):
+    analytics = ChatAnalytics(storage)
+    analytics.record(1, JOIN, now=NOW - 31 * 86400)
+    analytics.record(2, JOIN, now=NOW)
+    analytics.rollup(now=NOW)
+    assert analytics.global_summary(now=NOW)['tracked_chats'] == 1
+    # The all-time total is kept in storage
+    assert analytics.chat_summary(1, now=NOW)['total']['joins'] == 1
@@ -0,0 +1,70 @@
+import pytest
+from backup import FULL, INCREMENTAL, BackupManager
+
+def settings_of(storage) -> dict:
+    return {chat_id: {k: v for k, v in settings.items() if k not in ('created_at', 'updated_at')}
+            for chat_id, settings in storage.get_all_chats().items()}
+
+def test_chain_restores_changes_and_removals(storage, tmp_path):
+    backups = BackupManager(storage, backup_dir=str(tmp_path / 'backups'), full_every=10)
+    for chat_id in range(1, 6):
+        storage.update_chat_settings(chat_id, note='v1')
+    assert backups.backup()['type'] == FULL
+
+    storage.update_chat_settings(2, note='v2')
+    storage.delete_chat_settings(3)
+    storage.update_chat_settings(6, note='new')
+    entry = backups.backup()
+    assert entry['type'] == INCREMENTAL
+    assert entry['removed'] == 1
+    assert entry['chats'] >= 2
+
+    storage.delete_chat_settings(6)
+    storage.update_chat_settings(1, enabled=False)
+    assert backups.backup()['type'] == INCREMENTAL
+    expected = settings_of(storage)
+
+    # Wreck the store, then bring it back
+    for chat_id in list(storage.get_all_chats()):
+        storage.delete_chat_settings(int(chat_id))
+    storage.update_chat_settings(99, note='stray')
+
+    assert backups.restore() == 4
+    assert settings_of(storage) == expected
+    assert not storage.is_enabled(1)
+
+def test_restore_up_to_a_named_backup(storage, tmp_path):
+    backups = BackupManager(storage, backup_dir=str(tmp_path / 'backups'), full_every=10)
+    storage.update_chat_settings(1, note='v1')
+    backups.backup()
+    storage.update_chat_settings(1, note='v2')
+    middle = backups.backup()['file']
+    storage.update_chat_settings(1, note='v3')
+    storage.update_chat_settings(2, note='v1')
+    backups.backup()
+
+    assert backups.restore(middle) == 1
+    assert storage.peek_chat_settings(1)['note'] == 'v2'
+    assert storage.peek_chat_settings(2) is None
+
+    with pytest.raises(FileNotFoundError):
+        backups.restore('backup_missing.jsonl.gz')
+
+def test_full_backup_after_full_every_incrementals(storage, tmp_path):
+    backups = BackupManager(storage, backup_dir=str(tmp_path / 'backups'), full_every=2)
+    storage.update_chat_settings(1, note='v1')
+    kinds = [backups.backup()['type'] for _ in range(5)]
+    assert kinds == [FULL, INCREMENTAL, INCREMENTAL, FULL, INCREMENTAL]
+    assert [entry['type'] for entry in backups.list_backups()] == kinds
+
+def test_new_process_starts_with_a_full_backup(storage, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    storage.update_chat_settings(1, note='v1')
+    BackupManager(storage, backup_dir=backup_dir).backup()
+
+    # No base known in this process, so an incremental one would miss changes
+    assert BackupManager(storage, backup_dir=backup_dir).backup(full=False)['type'] == FULL
+
+def test_restore_without_full_backup_fails(storage, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        BackupManager(storage, backup_dir=str(tmp_path / 'backups')).restore()
@@ -0,0 +1,166 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+import pytest
+from telegram import Chat, Message, Update, User
+from telegram.error import BadRequest
+from bot_handlers import BotHandlers
+from config import Config
+from deletion import DeletionBatcher
+from raid import RaidDetector
+from rendering import INVITE_TEXT, PERMISSION_WARNING_TEXT
+from rights import CAN_DELETE, CANNOT_DELETE
+from scheduler import RequestScheduler
+
+BOT_USER = User(id=999, is_bot=True, first_name='Hider', username='hider_bot')
+GROUP = Chat(id=-100, type=Chat.SUPERGROUP, title='Group')
+RIGHTS = "Message can't be deleted: not enough rights"
+
+class FakeBot:
+    def __init__(self, delete_error: Exception = None):
+        self.bot = BOT_USER
+        self.delete_error = delete_error
+        self.deleted = []
+        self.sent = []
+
+    async def delete_messages(self, chat_id, message_ids):
+        if self.delete_error is not None:
+            raise self.delete_error
+        self.deleted.extend(message_ids)
+        return True
+
+    async def delete_message(self, chat_id, message_id):
+        if self.delete_error is not None:
+            raise self.delete_error
+        self.deleted.append(message_id)
+        return True
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(chat_id=chat_id, message_id=1000 + len(self.sent))
+
+class FakeContext:
+    def __init__(self, bot: FakeBot):
+        self.bot = bot
+        self.tasks = []
+        self.application = SimpleNamespace(create_task=self._create_task)
+
+    def _create_task(self, coroutine, update=None):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.append(task)
+        return task
+
+    async def settle(self):
+        while self.tasks:
+            await self.tasks.pop(0)
+
+def join_update(message_id, chat=GROUP, member=None):
+    member = member or User(id=message_id, is_bot=False, first_name='User')
+    message = Message(message_id, datetime.datetime.now(datetime.timezone.utc), chat, new_chat_members=(member,))
+    return Update(message_id, message=message)
+
+@pytest.fixture
+def handlers(storage):
+    scheduler = RequestScheduler()
+    handlers = BotHandlers(storage, deleter=DeletionBatcher(window=0.01, scheduler=scheduler), scheduler=scheduler)
+    # Raids end quickly, so a test can wait one out
+    handlers.raids = RaidDetector(threshold=3, window=0.1, cooldown=0.2)
+    return handlers
+
+def test_join_message_is_deleted(handlers):
+    async def run():
+        context = FakeContext(FakeBot())
+        await handlers.handle_join_leave(join_update(1), context)
+        await context.settle()
+        await handlers.scheduler.stop()
+        return context.bot
+
+    bot = asyncio.run(run())
+    assert bot.deleted == [1]
+    assert bot.sent == []
+    assert handlers.rights.can_delete(GROUP.id)
+
+def test_private_chat_is_ignored(handlers):
+    async def run():
+        context = FakeContext(FakeBot())
+        private = Chat(id=5, type=Chat.PRIVATE)
+        await handlers.handle_join_leave(join_update(1, chat=private), context)
+        await context.settle()
+        return context
+
+    context = asyncio.run(run())
+    assert context.tasks == [] and context.bot.deleted == []
+
+def test_bot_added_to_group_sends_welcome(handlers):
+    async def run():
+        context = FakeContext(FakeBot())
+        await handlers.handle_join_leave(join_update(1, member=BOT_USER), context)
+        await context.settle()
+        await handlers.scheduler.stop()
+        return context.bot
+
+    bot = asyncio.run(run())
+    assert bot.sent == [(GROUP.id, INVITE_TEXT)]
+    assert bot.deleted == []
+
+def test_missing_rights_warn_once(handlers):
+    async def run():
+        context = FakeContext(FakeBot(BadRequest(RIGHTS)))
+        await handlers.handle_join_leave(join_update(1), context)
+        await context.settle()
+        await handlers.handle_join_leave(join_update(2), context)
+        await context.settle()
+        await handlers.scheduler.stop()
+        return context
+
+    context = asyncio.run(run())
+    assert context.bot.sent == [(GROUP.id, PERMISSION_WARNING_TEXT)]
+    assert handlers.rights.state(GROUP.id) == CANNOT_DELETE
+
+def test_rights_failure_during_raid_warns_after_the_raid(handlers, monkeypatch):
+    monkeypatch.setattr(Config, 'RAID_DELETE_WINDOW_MS', 10)
+
+    async def run():
+        context = FakeContext(FakeBot(BadRequest(RIGHTS)))
+        # Two earlier joins, so the next one starts a raid
+        handlers.raids.record(GROUP.id)
+        handlers.raids.record(GROUP.id)
+        await handlers.handle_join_leave(join_update(1), context)
+        await context.settle()
+        during = (handlers.rights.state(GROUP.id), list(context.bot.sent))
+
+        # Further joins in the raid skip the delete and still don't warn
+        await handlers.handle_join_leave(join_update(2), context)
+        await context.settle()
+        during_skipped = list(context.bot.sent)
+
+        await asyncio.sleep(0.3)
+        await handlers.handle_join_leave(join_update(3), context)
+        await context.settle()
+        await handlers.handle_join_leave(join_update(4), context)
+        await context.settle()
+        await handlers.scheduler.stop()
+        return during, during_skipped, context.bot.sent
+
+    during, during_skipped, sent = asyncio.run(run())
+    assert during == (CANNOT_DELETE, [])
+    assert during_skipped == []
+    assert sent == [(GROUP.id, PERMISSION_WARNING_TEXT)]
+
+def test_regained_rights_resume_deleting(handlers):
+    async def run():
+        bot = FakeBot(BadRequest(RIGHTS))
+        context = FakeContext(bot)
+        await handlers.handle_join_leave(join_update(1), context)
+        await context.settle()
+
+        bot.delete_error = None
+        handlers.rights.on_delete_succeeded(GROUP.id)
+        await handlers.handle_join_leave(join_update(2), context)
+        await context.settle()
+        await handlers.scheduler.stop()
+        return bot
+
+    bot = asyncio.run(run())
+    assert bot.deleted == [2]
+    assert handlers.rights.state(GROUP.id) == CAN_DELETE
@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+from telegram import Chat, Message, Update, User
+from telegram.error import NetworkError
+import catchup
+from catchup import BacklogCatchUp
+
+CHAT = Chat(id=-100, type=Chat.SUPERGROUP)
+
+def make_update(update_id: int, age: float = 0, join: bool = False) -> Update:
+    date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=age)
+    members = (User(id=update_id, is_bot=False, first_name='User'),) if join else ()
+    return Update(update_id, message=Message(update_id, date, CHAT, new_chat_members=members))
+
+class FakeBot:
+    def __init__(self, updates, failing_calls=()):
+        self.pending = list(updates)
+        self.failing_calls = set(failing_calls)
+        self.calls = []
+
+    async def delete_webhook(self, drop_pending_updates):
+        pass
+
+    async def get_webhook_info(self):
+        return SimpleNamespace(pending_update_count=len(self.pending))
+
+    async def get_updates(self, offset, limit, timeout, allowed_updates):
+        self.calls.append((offset, limit))
+        if len(self.calls) in self.failing_calls:
+            raise NetworkError('connection reset')
+        # Like Telegram: an offset confirms every update before it
+        self.pending = [update for update in self.pending if update.update_id >= offset]
+        return tuple(self.pending[:limit])
+
+def make_application(bot: FakeBot):
+    return SimpleNamespace(bot=bot, update_queue=asyncio.Queue(), update_processor=SimpleNamespace())
+
+async def consume(application, processed: list, sizes: list):
+    while True:
+        update = await application.update_queue.get()
+        sizes.append(application.update_queue.qsize() + 1)
+        processed.append(update.update_id)
+        await asyncio.sleep(0)
+        application.update_queue.task_done()
+
+def test_backlog_is_queued_in_order_and_confirmed():
+    async def run():
+        bot = FakeBot([make_update(update_id) for update_id in range(1, 251)])
+        application = make_application(bot)
+        processed, sizes = [], []
+        consumer = asyncio.ensure_future(consume(application, processed, sizes))
+        fetched = await asyncio.wait_for(BacklogCatchUp(application, feed_limit=50).run(), 5)
+        await application.update_queue.join()
+        consumer.cancel()
+        return fetched, processed, sizes, bot
+
+    fetched, processed, sizes, bot = asyncio.run(run())
+    assert fetched == 250
+    assert processed == list(range(1, 251))
+    # Fetching waits for the queue instead of running ahead of processing
+    assert max(sizes) <= catchup.BATCH_SIZE
+    assert bot.calls[-1] == (251, catchup.BATCH_SIZE)
+    assert bot.pending == []
+
+def test_stale_join_messages_are_skipped():
+    async def run():
+        bot = FakeBot([make_update(1, age=3600, join=True), make_update(2, join=True), make_update(3, age=3600)])
+        application = make_application(bot)
+        catch_up = BacklogCatchUp(application, max_age=60)
+        await catch_up.run()
+        queued = []
+        while not application.update_queue.empty():
+            queued.append(application.update_queue.get_nowait().update_id)
+        return catch_up.skipped, queued
+
+    skipped, queued = asyncio.run(run())
+    assert skipped == 1
+    assert queued == [2, 3]
+
+def test_failed_fetch_still_confirms_the_queued_updates(monkeypatch):
+    monkeypatch.setattr(catchup, 'ATTEMPTS', 1)
+
+    async def run():
+        bot = FakeBot([make_update(update_id) for update_id in range(1, 151)], failing_calls={2})
+        application = make_application(bot)
+        fetched = await BacklogCatchUp(application, feed_limit=1000).run()
+        return fetched, application.update_queue.qsize(), bot
+
+    fetched, queued, bot = asyncio.run(run())
+    assert fetched == queued == 100
+    # The Updater gets only what was not queued
+    assert bot.calls[-1] == (101, 1)
+    assert [update.update_id for update in bot.pending] == list(range(101, 151))
@@ -0,0 +1,105 @@
+from chat_index import ChatIndex, to_epoch, to_iso
+
+def test_put_find_and_remove():
+    index = ChatIndex()
+    index.put(-100, True, 1.0, 2.0)
+    index.put(5, False, 3.0, 4.0, {'stats': {'joins': 1}})
+    index.put(-200, True, 5.0, 6.0)
+
+    assert len(index) == 3
+    assert index.enabled_count == 2
+    assert list(index.chat_ids()) == [-200, -100, 5]
+    assert 5 in index and 6 not in index
+    assert index.settings(index.find(5))['stats'] == {'joins': 1}
+
+    assert index.remove(-100)
+    assert not index.remove(-100)
+    assert index.find(-100) == -1
+    assert len(index) == 2
+    assert index.enabled_count == 1
+
+def test_put_replaces_existing_chat():
+    index = ChatIndex()
+    slot = index.put(1, True, 1.0, 1.0, {'stats': {}})
+    assert index.put(1, False, 1.0, 2.0) == slot
+    assert len(index) == 1
+    assert index.enabled_count == 0
+    assert 'stats' not in index.settings(slot)
+
+def test_settings_round_trip_keeps_microseconds():
+    index = ChatIndex()
+    settings = {'enabled': True, 'created_at': '2024-05-01T12:30:45.123456',
+                'updated_at': '2024-05-02T08:00:00.000001', 'stats': {'joins': 3}}
+    slot = index.put_settings(42, settings)
+    assert index.settings(slot) == settings
+    assert index.to_dict() == {'42': settings}
+    assert to_iso(to_epoch(settings['created_at'])) == settings['created_at']
+    assert to_epoch(None) == 0.0 and to_iso(0.0) is None
+
+def test_view_follows_its_chat_across_slot_reuse():
+    index = ChatIndex()
+    index.put(1, True, 1.0, 1.0)
+    view = index.view(1)
+    assert view['enabled'] is True
+
+    index.remove(1)
+    assert dict(view) == {}
+    # The freed slot now belongs to another chat
+    index.put(2, False, 1.0, 1.0)
+    assert len(view) == 0
+    index.put(1, False, 7.0, 7.0)
+    assert view['enabled'] is False
+    assert view['created_at'] == to_iso(7.0)
+
+def test_copy_is_independent():
+    index = ChatIndex()
+    index.put(1, True, 1.0, 1.0, {'stats': {'joins': 1}})
+    clone = index.copy()
+    index.put(1, False, 1.0, 2.0)
+    index.put(2, True, 1.0, 1.0)
+
+    assert len(clone) == 1
+    assert clone.enabled_count == 1
+    assert clone.settings(clone.find(1))['stats'] == {'joins': 1}
+
+def test_put_many_loads_descending_ids():
+    index = ChatIndex()
+    # Supergroup IDs get more negative over time, so files list them descending
+    chat_ids = [-1000000000000 - i for i in range(20000)]
+    settings = {'enabled': True, 'created_at': '2024-01-01T00:00:00', 'updated_at': '2024-01-02T00:00:00'}
+    assert index.put_many((chat_id, settings) for chat_id in chat_ids) == len(chat_ids)
+
+    assert list(index.chat_ids()) == sorted(chat_ids)
+    assert index.enabled_count == len(chat_ids)
+    for chat_id in chat_ids[::997]:
+        slot = index.find(chat_id)
+        assert index.owner(slot) == chat_id
+        assert index.settings(slot) == settings
+
+def test_put_many_merges_with_existing_chats():
+    index = ChatIndex()
+    index.put(5, True, 1.0, 1.0)
+    index.put(-5, True, 1.0, 1.0)
+    added = index.put_many([
+        (7, {'enabled': True}),
+        (5, {'enabled': False}),
+        (-9, {'enabled': True}),
+        (7, {'enabled': False, 'stats': {'joins': 1}}),
+    ])
+
+    assert added == 2
+    assert list(index.chat_ids()) == [-9, -5, 5, 7]
+    assert index.enabled_count == 2
+    assert index.settings(index.find(7))['stats'] == {'joins': 1}
+    assert not index.is_enabled(index.find(5))
+
+def test_remove_many_frees_slots_for_reuse():
+    index = ChatIndex()
+    index.put_many((chat_id, {'enabled': True}) for chat_id in range(10))
+    assert index.remove_many([3, 3, 7, 42]) == 2
+
+    assert list(index.chat_ids()) == [0, 1, 2, 4, 5, 6, 8, 9]
+    assert index.enabled_count == 8
+    slot = index.put(100, False, 1.0, 1.0)
+    assert slot in (3, 7)
+    assert index.find(100) == slot
@@ -0,0 +1,50 @@
+from dedup import UpdateDeduplicator, extract_chat_id, peek_update
+
+def test_peek_update_reads_the_raw_body():
+    body = b'{"update_id": 7, "message": {"message_id": 1, "from": {"id": 9}, "chat": {"id": -100123, "type": "group"}}}'
+    assert peek_update(body) == (7, -100123)
+    assert extract_chat_id(b'{"update_id": 8, "callback_query": {"from": {"id": 9}}}') == 9
+    assert peek_update(b'{}') == (None, None)
+
+def test_replays_inside_the_window_are_dropped():
+    dedup = UpdateDeduplicator(window=3, max_chats=10)
+    assert not dedup.is_replay(1, 100)
+    assert not dedup.is_replay(3, 100)
+    # Slightly out of order, still new
+    assert not dedup.is_replay(2, 100)
+    assert dedup.is_replay(3, 100)
+    assert dedup.dropped == 1
+
+def test_replays_older_than_the_window_use_the_chat_mark():
+    dedup = UpdateDeduplicator(window=2, max_chats=10)
+    for update_id in (10, 11, 12, 13):
+        assert not dedup.is_replay(update_id, 100)
+    # 10 left the window but is not newer than the last update of chat 100
+    assert dedup.is_replay(10, 100)
+    # A chat without a mark cannot tell, so the update is accepted
+    assert not dedup.is_replay(9, 200)
+
+def test_check_body_passes_bodies_without_update_id():
+    dedup = UpdateDeduplicator(window=10, max_chats=10)
+    body = b'{"update_id": 5, "message": {"chat": {"id": 1}}}'
+    assert not dedup.check_body(body)
+    assert dedup.check_body(body)
+    assert not dedup.check_body(b'{"message": {}}')
+    assert not dedup.check_body(b'{"message": {}}')
+
+def test_chat_marks_are_bounded():
+    dedup = UpdateDeduplicator(window=1, max_chats=2)
+    for chat_id in range(5):
+        dedup.is_replay(chat_id + 1, chat_id)
+    assert len(dedup._chat_marks) == 2
+
+def test_forgotten_update_is_accepted_again():
+    dedup = UpdateDeduplicator(window=3, max_chats=10)
+    body = b'{"update_id": 5, "message": {"chat": {"id": 1}}}'
+    assert not dedup.check_body(body)
+    assert not dedup.is_replay(6, 1)
+    dedup.forget_body(body)
+    assert not dedup.check_body(body)
+    assert dedup.check_body(body)
+    # The window still holds exactly the accepted IDs
+    assert list(dedup._recent) == [6, 5]
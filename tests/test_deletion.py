@@ -0,0 +1,128 @@
+import asyncio
+import pytest
+from telegram.error import BadRequest, Forbidden
+from deletion import DeletionBatcher, is_rights_error
+
+RIGHTS = "Message can't be deleted: not enough rights"
+
+class FakeBot:
+    def __init__(self, bulk_error: Exception = None, single_error: Exception = None, hang: bool = False):
+        self.calls = []
+        self.bulk_error = bulk_error
+        self.single_error = single_error
+        self.hang = hang
+
+    async def delete_messages(self, chat_id, message_ids):
+        self.calls.append(('bulk', chat_id, list(message_ids)))
+        if self.hang:
+            await asyncio.Event().wait()
+        if self.bulk_error is not None:
+            raise self.bulk_error
+        return True
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls.append(('single', chat_id, message_id))
+        if self.single_error is not None:
+            raise self.single_error
+        return True
+
+def gather_deletes(batcher, bot, chat_id, message_ids):
+    return asyncio.gather(*(batcher.delete(bot, chat_id, message_id) for message_id in message_ids),
+                          return_exceptions=True)
+
+def test_is_rights_error():
+    assert is_rights_error(BadRequest(RIGHTS))
+    assert is_rights_error(BadRequest("Insufficient rights to delete"))
+    assert not is_rights_error(BadRequest("Message to delete not found"))
+
+def test_deletes_are_coalesced_per_chat():
+    async def run():
+        batcher = DeletionBatcher(window=0.01, max_batch=100)
+        bot = FakeBot()
+        results = await asyncio.gather(
+            gather_deletes(batcher, bot, 1, [10, 11, 12]),
+            gather_deletes(batcher, bot, 2, [20]),
+        )
+        return results, bot.calls
+
+    results, calls = asyncio.run(run())
+    assert results == [[True, True, True], [True]]
+    assert sorted(calls, key=str) == [('bulk', 1, [10, 11, 12]), ('single', 2, 20)]
+
+def test_full_batches_are_flushed_at_once():
+    async def run():
+        batcher = DeletionBatcher(window=60, max_batch=2)
+        bot = FakeBot()
+        results = await asyncio.wait_for(gather_deletes(batcher, bot, 1, [1, 2, 3, 4]), 5)
+        return results, bot.calls
+
+    results, calls = asyncio.run(run())
+    assert results == [True] * 4
+    assert calls == [('bulk', 1, [1, 2]), ('bulk', 1, [3, 4])]
+
+def test_failed_bulk_delete_falls_back_to_single_deletes():
+    async def run():
+        batcher = DeletionBatcher(window=0.01)
+        bot = FakeBot(bulk_error=BadRequest("Message to delete not found"))
+        results = await gather_deletes(batcher, bot, 1, [1, 2])
+        return results, bot.calls
+
+    results, calls = asyncio.run(run())
+    assert results == [True, True]
+    assert calls == [('bulk', 1, [1, 2]), ('single', 1, 1), ('single', 1, 2)]
+
+@pytest.mark.parametrize('error', [BadRequest(RIGHTS), Forbidden("bot was kicked from the supergroup chat")])
+def test_rights_errors_fail_the_whole_batch(error):
+    async def run():
+        batcher = DeletionBatcher(window=0.01)
+        bot = FakeBot(bulk_error=error)
+        results = await gather_deletes(batcher, bot, 1, [1, 2, 3])
+        return results, bot.calls
+
+    results, calls = asyncio.run(run())
+    assert all(result is error for result in results)
+    assert calls == [('bulk', 1, [1, 2, 3])]
+
+def test_rights_error_in_single_deletes_fails_the_rest():
+    async def run():
+        batcher = DeletionBatcher(window=0.01)
+        bot = FakeBot(bulk_error=BadRequest("Bad Request: message_ids are invalid"), single_error=BadRequest(RIGHTS))
+        results = await gather_deletes(batcher, bot, 1, [1, 2, 3])
+        return results, bot.calls
+
+    results, calls = asyncio.run(run())
+    assert all(isinstance(result, BadRequest) for result in results)
+    assert [call[0] for call in calls] == ['bulk', 'single']
+
+def test_unexpected_errors_fail_every_waiter():
+    async def run():
+        batcher = DeletionBatcher(window=0.01)
+        bot = FakeBot(bulk_error=RuntimeError("connection pool closed"))
+        return await asyncio.wait_for(gather_deletes(batcher, bot, 1, [1, 2]), 5)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_cancelled_flush_cancels_its_waiters():
+    async def run():
+        batcher = DeletionBatcher(window=0.01)
+        bot = FakeBot(hang=True)
+        waiters = gather_deletes(batcher, bot, 1, [1, 2])
+        await asyncio.sleep(0.05)
+        for task in list(batcher._flushing):
+            task.cancel()
+        return await asyncio.wait_for(waiters, 5)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+
+def test_flush_all_sends_pending_batches_now():
+    async def run():
+        batcher = DeletionBatcher(window=60)
+        bot = FakeBot()
+        waiters = asyncio.ensure_future(gather_deletes(batcher, bot, 1, [1, 2]))
+        await asyncio.sleep(0)
+        await batcher.flush_all()
+        return await asyncio.wait_for(waiters, 1)
+
+    assert asyncio.run(run()) == [True, True]
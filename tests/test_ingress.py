@@ -0,0 +1,134 @@
+import asyncio
+import os
+from ingress import OTHER, SERVICE, IngressQueue, SpillSegment, classify
+
+JOIN = b'{"update_id": 1, "message": {"new_chat_members": []}}'
+TEXT = b'{"update_id": 2, "message": {"text": "hi"}}'
+
+def test_classify():
+    assert classify(JOIN) == SERVICE
+    assert classify(b'{"my_chat_member": {}}') == SERVICE
+    assert classify(TEXT) == OTHER
+
+def test_spill_segment_reads_back_in_order(tmp_path):
+    path = str(tmp_path / 'test.seg')
+    segment = SpillSegment(path)
+    for i in range(5):
+        segment.append(b'record %d' % i)
+    assert segment.read(2) == [b'record 0', b'record 1']
+    segment.close()
+
+    # Records not read yet survive a restart
+    segment = SpillSegment(path)
+    assert segment.count == 3
+    assert segment.read(10) == [b'record 2', b'record 3', b'record 4']
+    assert segment.size == 0
+    segment.close()
+
+def test_appended_records_reach_the_file_right_away(tmp_path):
+    path = str(tmp_path / 'test.seg')
+    segment = SpillSegment(path, fsync_interval=60)
+    segment.append(b'record')
+    # A crash now must not lose the record to the write buffer
+    with open(path, 'rb') as f:
+        assert f.read() == b'\x00\x00\x00\x06record'
+    segment.close()
+
+def test_appends_are_synced_at_most_once_per_interval(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, 'fsync', synced.append)
+    segment = SpillSegment(str(tmp_path / 'test.seg'), fsync_interval=0)
+    segment.append(b'a')
+    segment.append(b'b')
+    assert len(synced) == 2
+
+    segment.fsync_interval = 60
+    segment.append(b'c')
+    assert len(synced) == 2
+    segment.close()
+    assert len(synced) == 3
+
+def test_close_leaves_unread_records_on_disk(tmp_path):
+    path = str(tmp_path / 'test.seg')
+    segment = SpillSegment(path)
+    for i in range(3):
+        segment.append(b'record %d' % i)
+    size = os.path.getsize(path)
+    assert segment.read(1) == [b'record 0']
+    segment.close()
+
+    # The file is left as it is, only the read position is saved
+    assert os.path.getsize(path) == size
+    segment = SpillSegment(path)
+    assert segment.read(10) == [b'record 1', b'record 2']
+    segment.close()
+    assert not os.path.exists(path + '.offset')
+
+    segment = SpillSegment(path)
+    assert segment.count == 0
+    segment.close()
+
+def test_unreadable_offset_replays_the_whole_file(tmp_path):
+    path = str(tmp_path / 'test.seg')
+    segment = SpillSegment(path)
+    segment.append(b'record')
+    segment.close()
+    with open(path + '.offset', 'w') as f:
+        f.write('garbage')
+
+    segment = SpillSegment(path)
+    assert segment.read(10) == [b'record']
+    segment.close()
+
+def test_service_updates_are_handed_out_first(tmp_path):
+    async def run():
+        queue = IngressQueue(str(tmp_path), high_watermark=100, low_watermark=50)
+        queue.put(TEXT)
+        queue.put(JOIN)
+        bodies = [await queue.get(), await queue.get()]
+        queue.close()
+        return bodies
+
+    assert asyncio.run(run()) == [JOIN, TEXT]
+
+def test_overflow_spills_to_disk_and_keeps_order(tmp_path):
+    async def run():
+        queue = IngressQueue(str(tmp_path), high_watermark=2, low_watermark=1)
+        bodies = [b'{"update_id": %d}' % i for i in range(6)]
+        for body in bodies:
+            assert queue.put(body)
+        spilled = queue.spilled
+        received = [await queue.get() for _ in bodies]
+        queue.close()
+        return bodies, spilled, received
+
+    bodies, spilled, received = asyncio.run(run())
+    assert spilled == 4
+    assert received == bodies
+
+def test_full_spill_drops_only_other_updates(tmp_path):
+    async def run():
+        queue = IngressQueue(str(tmp_path), high_watermark=1, low_watermark=1, max_spill_bytes=1)
+        results = [queue.put(TEXT), queue.put(TEXT), queue.put(TEXT), queue.put(JOIN)]
+        dropped = queue.dropped
+        queue.close()
+        return results, dropped
+
+    results, dropped = asyncio.run(run())
+    assert results == [True, True, False, True]
+    assert dropped == 1
+
+def test_spilled_updates_survive_a_restart(tmp_path):
+    async def run():
+        queue = IngressQueue(str(tmp_path), high_watermark=1, low_watermark=1)
+        queue.put(TEXT)
+        queue.put(JOIN)
+        assert queue.drain_memory() == [TEXT]
+        queue.close()
+
+        queue = IngressQueue(str(tmp_path), high_watermark=1, low_watermark=1)
+        body = await queue.get()
+        queue.close()
+        return body
+
+    assert asyncio.run(run()) == JOIN
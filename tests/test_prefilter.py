@@ -0,0 +1,53 @@
+import json
+import pytest
+import prefilter
+from config import Config
+
+def body(update: dict) -> bytes:
+    return json.dumps(update).encode()
+
+CHAT = {'id': -100, 'type': 'supergroup', 'title': 'Group'}
+USER = {'id': 9, 'is_bot': False, 'first_name': 'A'}
+
+@pytest.mark.parametrize('update', [
+    {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': CHAT, 'new_chat_members': [USER]}},
+    {'update_id': 2, 'message': {'message_id': 2, 'date': 0, 'chat': CHAT, 'left_chat_member': USER}},
+    {'update_id': 3, 'my_chat_member': {'chat': CHAT, 'from': USER, 'date': 0}},
+    {'update_id': 4, 'message': {'message_id': 3, 'date': 0, 'chat': CHAT, 'text': '/start'}},
+    {'update_id': 5, 'message': {'message_id': 4, 'date': 0, 'chat': CHAT, 'text': '/start@hider_bot'}},
+    {'update_id': 6, 'message': {'message_id': 5, 'date': 0, 'chat': CHAT, 'text': '/START'}},
+    {'update_id': 7, 'message': {'message_id': 6, 'date': 0, 'chat': CHAT, 'text': '/Start@Hider_Bot'}},
+])
+def test_handled_updates_are_relevant(update):
+    assert prefilter.is_relevant(body(update))
+
+@pytest.mark.parametrize('update', [
+    {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': CHAT, 'text': 'hello'}},
+    {'update_id': 2, 'message': {'message_id': 2, 'date': 0, 'chat': CHAT, 'text': '/starting'}},
+    {'update_id': 4, 'message': {'message_id': 4, 'date': 0, 'chat': CHAT, 'text': '/STARTING'}},
+    {'update_id': 3, 'edited_message': {'message_id': 3, 'date': 0, 'chat': CHAT, 'text': 'start'}},
+])
+def test_other_updates_are_skipped(update):
+    assert not prefilter.is_relevant(body(update))
+
+def test_chat_member_updates_need_the_admin_cache(monkeypatch):
+    promotion = body({'update_id': 1, 'chat_member': {
+        'chat': CHAT, 'from': USER, 'date': 0,
+        'old_chat_member': {'status': 'member', 'user': USER},
+        'new_chat_member': {'status': 'administrator', 'user': USER},
+    }})
+    member_churn = body({'update_id': 2, 'chat_member': {
+        'chat': CHAT, 'from': USER, 'date': 0,
+        'old_chat_member': {'status': 'left', 'user': USER},
+        'new_chat_member': {'status': 'member', 'user': USER},
+    }})
+
+    monkeypatch.setattr(Config, 'ADMIN_CACHE_ENABLED', False)
+    assert not prefilter.is_relevant(promotion)
+    monkeypatch.setattr(Config, 'ADMIN_CACHE_ENABLED', True)
+    assert prefilter.is_relevant(promotion)
+    assert not prefilter.is_relevant(member_churn)
+
+def test_disabled_prefilter_passes_everything(monkeypatch):
+    monkeypatch.setattr(Config, 'PREFILTER_ENABLED', False)
+    assert prefilter.is_relevant(b'{"update_id": 1, "message": {"text": "hello"}}')
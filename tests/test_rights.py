@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+from telegram.constants import ChatMemberStatus
+from rights import CAN_DELETE, CANNOT_DELETE, NOT_MEMBER, UNKNOWN, RightsTracker
+
+def member_update(chat_id, status, can_delete_messages=False):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id),
+        new_chat_member=SimpleNamespace(status=status, can_delete_messages=can_delete_messages),
+    )
+
+def test_unknown_chat_may_delete_without_creating_a_row(storage):
+    rights = RightsTracker(storage)
+    assert rights.state(-100) == UNKNOWN
+    assert rights.can_delete(-100)
+    assert not rights.needs_warning(-100)
+    assert storage.peek_chat_settings(-100) is None
+
+def test_member_updates_set_the_state(storage):
+    rights = RightsTracker(storage)
+    cases = [
+        (ChatMemberStatus.ADMINISTRATOR, True, CAN_DELETE),
+        (ChatMemberStatus.ADMINISTRATOR, False, CANNOT_DELETE),
+        (ChatMemberStatus.OWNER, False, CAN_DELETE),
+        (ChatMemberStatus.MEMBER, False, CANNOT_DELETE),
+        (ChatMemberStatus.LEFT, False, NOT_MEMBER),
+        (ChatMemberStatus.BANNED, False, NOT_MEMBER),
+    ]
+    for status, can_delete_messages, expected in cases:
+        assert rights.on_member_update(member_update(-100, status, can_delete_messages)) == expected
+        assert rights.state(-100) == expected
+        assert rights.can_delete(-100) == (expected == CAN_DELETE)
+
+def test_warning_is_allowed_once_per_transition(storage):
+    rights = RightsTracker(storage)
+
+    assert rights.on_delete_failed(-100)
+    assert rights.state(-100) == CANNOT_DELETE
+    assert rights.needs_warning(-100)
+    rights.mark_warned(-100)
+    assert not rights.on_delete_failed(-100)
+    assert not rights.needs_warning(-100)
+
+    # Getting the rights back and losing them again allows a new warning
+    rights.on_delete_succeeded(-100)
+    assert rights.state(-100) == CAN_DELETE
+    assert not rights.needs_warning(-100)
+    assert rights.on_delete_failed(-100)
+    assert rights.needs_warning(-100)
+
+def test_successful_delete_in_unknown_chat_writes_nothing(storage):
+    rights = RightsTracker(storage)
+    rights.on_delete_succeeded(-100)
+    assert storage.peek_chat_settings(-100) is None
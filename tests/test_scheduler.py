@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+from telegram.error import RetryAfter
+from scheduler import Priority, RequestScheduler, TokenBucket
+
+def test_token_bucket_starts_full_and_refills():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take()
+
+    assert bucket.delay(now) == 0.5
+    assert bucket.time_to_full(now) == 1.5
+    assert bucket.delay(now + 0.5) == 0
+    # Refilling never goes beyond the capacity
+    assert bucket.time_to_full(now + 100) == 0
+    assert bucket.tokens == 3
+
+def test_requests_of_a_chat_run_in_priority_order():
+    async def run():
+        scheduler = RequestScheduler(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000)
+        order = []
+
+        async def call(name):
+            order.append(name)
+            return name
+
+        results = await asyncio.gather(
+            scheduler.submit(1, Priority.NOTICE, call, 'notice'),
+            scheduler.submit(1, Priority.DELETE, call, 'delete-1'),
+            scheduler.submit(1, Priority.DELETE, call, 'delete-2'),
+        )
+        await scheduler.stop()
+        return results, order
+
+    results, order = asyncio.run(run())
+    assert results == ['notice', 'delete-1', 'delete-2']
+    assert order == ['delete-1', 'delete-2', 'notice']
+
+def test_flood_wait_retries_and_slows_down():
+    async def run():
+        scheduler = RequestScheduler(global_rate=100, global_burst=100, chat_rate=100, chat_burst=100)
+        attempts = []
+
+        async def call():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RetryAfter(0)
+            return True
+
+        result = await scheduler.submit(1, Priority.DELETE, call)
+        rate = scheduler.global_bucket.rate
+        await scheduler.stop()
+        return result, len(attempts), rate
+
+    result, attempts, rate = asyncio.run(run())
+    assert result is True
+    assert attempts == 2
+    # Halved by the flood wait, then grown by 1% for the success
+    assert rate == 51
+
+def test_flood_wait_gives_up_after_max_retries():
+    async def run():
+        scheduler = RequestScheduler(global_rate=100, global_burst=100, chat_rate=100, chat_burst=100, max_retries=1)
+
+        async def call():
+            raise RetryAfter(0)
+
+        try:
+            return await scheduler.submit(1, Priority.DELETE, call)
+        finally:
+            await scheduler.stop()
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(run())
+
+def test_cancelled_caller_after_last_retry_does_not_break_the_lane():
+    async def run():
+        scheduler = RequestScheduler(global_rate=100, global_burst=100, chat_rate=100, chat_burst=100, max_retries=0)
+        started = asyncio.Event()
+
+        async def flood():
+            started.set()
+            await asyncio.sleep(0.05)
+            raise RetryAfter(0)
+
+        caller = asyncio.ensure_future(scheduler.submit(1, Priority.DELETE, flood))
+        await started.wait()
+        caller.cancel()
+
+        async def ok():
+            return 'ok'
+
+        result = await asyncio.wait_for(scheduler.submit(1, Priority.DELETE, ok), 5)
+        await scheduler.stop()
+        return result
+
+    assert asyncio.run(run()) == 'ok'
+
+def test_stop_fails_requests_still_queued():
+    async def run():
+        # One request per chat per hour, so the second one never gets a token
+        scheduler = RequestScheduler(global_rate=100, global_burst=100, chat_rate=1 / 3600, chat_burst=1)
+
+        async def call():
+            return True
+
+        first = await scheduler.submit(1, Priority.NOTICE, call)
+        second = asyncio.ensure_future(scheduler.submit(1, Priority.NOTICE, call))
+        await asyncio.sleep(0.05)
+        await scheduler.stop(timeout=0.1)
+        return first, await asyncio.wait_for(asyncio.gather(second, return_exceptions=True), 1)
+
+    first, (second,) = asyncio.run(run())
+    assert first is True
+    assert isinstance(second, RuntimeError)
+
+def test_deletes_are_not_held_to_the_message_rate():
+    async def run():
+        scheduler = RequestScheduler(global_rate=1000, global_burst=1000, chat_rate=1 / 3600, chat_burst=1,
+                                     delete_rate=1000, delete_burst=50)
+
+        async def call():
+            return True
+
+        started = asyncio.get_running_loop().time()
+        results = await asyncio.wait_for(
+            asyncio.gather(*(scheduler.submit(1, Priority.DELETE, call) for _ in range(20))), 5
+        )
+        elapsed = asyncio.get_running_loop().time() - started
+        await scheduler.stop()
+        return results, elapsed
+
+    results, elapsed = asyncio.run(run())
+    assert results == [True] * 20
+    assert elapsed < 1
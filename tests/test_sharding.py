@@ -0,0 +1,68 @@
+import multiprocessing
+import time
+from collections import Counter
+from sharding import HashRing, WorkerInbox, shard_path
+
+def test_ring_is_deterministic_and_covers_every_worker():
+    ring, again = HashRing(4), HashRing(4)
+    owners = [ring.node_for(chat_id) for chat_id in range(-5000, 5000)]
+    assert owners == [again.node_for(chat_id) for chat_id in range(-5000, 5000)]
+
+    counts = Counter(owners)
+    assert set(counts) == {0, 1, 2, 3}
+    # Virtual nodes keep the split reasonably even
+    assert max(counts.values()) < 2 * min(counts.values())
+
+def test_adding_a_worker_moves_only_its_share():
+    before = HashRing(4)
+    after = HashRing(5)
+    chat_ids = range(10000)
+    moved = [chat_id for chat_id in chat_ids if before.node_for(chat_id) != after.node_for(chat_id)]
+    # Chats only move to the new worker, about a fifth of them
+    assert all(after.node_for(chat_id) == 4 for chat_id in moved)
+    assert len(moved) < 0.3 * len(chat_ids)
+
+def test_single_worker_owns_everything():
+    ring = HashRing(1)
+    assert {ring.node_for(chat_id) for chat_id in range(100)} == {0}
+
+def test_shard_path():
+    assert shard_path('bot_settings.json', 0) == 'bot_settings.shard0.json'
+    assert shard_path('data/bot_settings.db', 2) == 'data/bot_settings.shard2.db'
+
+def _read_one_and_hang(reader, ready):
+    reader.recv_bytes()
+    ready.set()
+    time.sleep(60)
+
+def test_retired_inbox_returns_unread_bodies_in_order():
+    inbox = WorkerInbox()
+    inbox.start()
+    # Far more than the pipe buffer holds, so the feeder blocks on the full pipe
+    bodies = [b'%d:' % i + b'x' * 1000 for i in range(500)]
+    for body in bodies:
+        inbox.put(body)
+    assert inbox.retire() == bodies
+
+def test_killed_worker_leaves_its_unread_bodies_behind():
+    context = multiprocessing.get_context('spawn')
+    inbox = WorkerInbox(context)
+    ready = context.Event()
+    process = context.Process(target=_read_one_and_hang, args=(inbox.reader, ready), daemon=True)
+    process.start()
+    inbox.start()
+    for i in range(4):
+        inbox.put(b'body %d' % i)
+
+    assert ready.wait(30)
+    process.kill()
+    process.join()
+    assert inbox.retire() == [b'body 1', b'body 2', b'body 3']
+
+    # A fresh inbox takes them first
+    fresh = WorkerInbox(context)
+    fresh.put(b'body 4')
+    fresh.requeue([b'body 1', b'body 2', b'body 3'])
+    fresh.start()
+    assert [fresh.reader.recv_bytes() for _ in range(4)] == [b'body 1', b'body 2', b'body 3', b'body 4']
+    fresh.close()
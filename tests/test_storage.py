@@ -0,0 +1,118 @@
+import json
+import pytest
+from config import Config
+from storage import Storage
+from storage_backends import JSONFileBackend, SQLiteBackend, create_backend, migrate_json_to_sqlite
+
+BACKENDS = {
+    'json': lambda path: JSONFileBackend(str(path / 'store.json'), write_behind=False),
+    'json-write-behind': lambda path: JSONFileBackend(str(path / 'store.json'), write_behind=True, flush_interval=60),
+    'sqlite': lambda path: SQLiteBackend(str(path / 'store.db'), write_behind=False),
+    'sqlite-write-behind': lambda path: SQLiteBackend(str(path / 'store.db'), write_behind=True),
+}
+
+@pytest.fixture(params=list(BACKENDS))
+def open_store(request, tmp_path):
+    stores = []
+
+    def open_store():
+        store = Storage(backend=BACKENDS[request.param](tmp_path), lazy=False)
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+def test_changes_survive_a_restart(open_store):
+    store = open_store()
+    store.save_chat_settings(1, {'enabled': False, 'note': 'a'})
+    store.update_chat_settings(2, note='b')
+    store.update_chat_settings(1, note=None)
+    store.add_chat_counters('stats', {1: {'joins': 2}, 3: {'joins': 1}})
+    store.add_chat_counters('stats', {1: {'joins': 3}})
+    store.delete_chat_settings(3)
+    store.set_metadata('key', 'value')
+    store.close()
+
+    store = open_store()
+    assert sorted(store.get_all_chats()) == ['1', '2']
+    assert not store.is_enabled(1)
+    assert store.is_enabled(2)
+    assert 'note' not in store.peek_chat_settings(1)
+    assert store.peek_chat_settings(1)['stats'] == {'joins': 5}
+    assert store.peek_chat_settings(2)['note'] == 'b'
+    assert store.peek_chat_settings(3) is None
+    assert store.get_metadata('key') == 'value'
+    assert store.get_stats()['total_chats'] == 2
+
+def test_created_at_is_kept_on_update(open_store):
+    store = open_store()
+    store.save_chat_settings(1, {'enabled': True})
+    created_at = store.peek_chat_settings(1)['created_at']
+    store.save_chat_settings(1, {'enabled': True, 'created_at': 0})
+    assert store.peek_chat_settings(1)['created_at'] == created_at
+
+def test_peek_does_not_create_a_chat(open_store):
+    store = open_store()
+    assert store.peek_chat_settings(1) is None
+    assert store.is_enabled(1)
+    assert len(store.get_all_chats()) == 0
+    store.get_chat_settings(1)
+    assert len(store.get_all_chats()) == 1
+
+def test_sqlite_namespaces_are_separate_tables(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'store.db'), write_behind=False)
+    shard = backend.namespace('shard1')
+    backend.save_all(lambda: {'chats': {'1': {'enabled': True}}, 'metadata': {'a': '1'}})
+    shard.save_all(lambda: {'chats': {'2': {'enabled': True}}, 'metadata': {'b': '2'}})
+    assert list(backend.load()['chats']) == ['1']
+    assert list(shard.load()['chats']) == ['2']
+    shard.close()
+    backend.close()
+
+    with pytest.raises(ValueError):
+        SQLiteBackend(str(tmp_path / 'store.db'), namespace='x; DROP TABLE chats')
+
+def test_store_in_use_cannot_be_opened_exclusively(tmp_path):
+    path = str(tmp_path / 'store.json')
+    store = Storage(path, lazy=False)
+    with pytest.raises(RuntimeError):
+        Storage(path, lazy=False, exclusive=True)
+    store.close()
+    Storage(path, lazy=False, exclusive=True).close()
+
+def write_json_store(path, chats: dict):
+    with open(path, 'w') as f:
+        json.dump({'chats': chats, 'metadata': {'created_at': '2024-01-01T00:00:00'}}, f)
+
+def test_json_store_migrates_to_sqlite(tmp_path):
+    json_file, db_file = str(tmp_path / 'store.json'), str(tmp_path / 'store.db')
+    write_json_store(json_file, {'1': {'enabled': True}, '-100': {'enabled': False, 'note': 'x'}})
+
+    assert migrate_json_to_sqlite(json_file, db_file) == 2
+    store = Storage(backend=SQLiteBackend(db_file, write_behind=False), lazy=False)
+    assert store.get_all_chats()['-100']['note'] == 'x'
+    assert not store.is_enabled(-100)
+    assert store.get_metadata('created_at') == '2024-01-01T00:00:00'
+    store.close()
+
+    with pytest.raises(ValueError):
+        migrate_json_to_sqlite(str(tmp_path / 'missing.json'), db_file)
+
+def test_first_sqlite_start_carries_over_the_json_store(tmp_path, monkeypatch):
+    json_file, db_file = str(tmp_path / 'store.json'), str(tmp_path / 'store.db')
+    write_json_store(json_file, {'1': {'enabled': False}})
+    monkeypatch.setattr(Config, 'STORAGE_FILE', json_file)
+    monkeypatch.setattr(Config, 'SQLITE_FILE', db_file)
+
+    backend = create_backend('sqlite')
+    assert isinstance(backend, SQLiteBackend)
+    assert backend.load()['chats'] == {'1': {'enabled': False}}
+    backend.close()
+
+    # Later starts use the database, whatever the JSON file says
+    write_json_store(json_file, {})
+    backend = create_backend('sqlite')
+    assert list(backend.load()['chats']) == ['1']
+    backend.close()
@@ -0,0 +1,47 @@
+from timing_wheel import TimingWheel
+
+def test_entries_expire_at_their_deadline():
+    wheel = TimingWheel(tick=1, now=0)
+    wheel.add(5, 1, 10)
+    wheel.add(3, 1, 11)
+    wheel.add(3, 2, 20)
+    assert len(wheel) == 3
+
+    assert wheel.advance(2) == []
+    assert sorted(wheel.advance(3)) == [(1, 11), (2, 20)]
+    assert wheel.advance(4) == []
+    assert wheel.advance(5) == [(1, 10)]
+    assert len(wheel) == 0
+
+def test_entries_cascade_from_the_upper_levels():
+    wheel = TimingWheel(tick=1, levels=3, now=0)
+    # 64 and 4096 ticks are the first deadlines of levels 1 and 2
+    deadlines = [63, 64, 65, 200, 4095, 4096, 5000]
+    for message_id, deadline in enumerate(deadlines):
+        wheel.add(deadline, 1, message_id)
+
+    expired_at = {}
+    for now in range(5001):
+        for _, message_id in wheel.advance(now):
+            expired_at[message_id] = now
+    assert expired_at == dict(enumerate(deadlines))
+
+def test_past_deadlines_expire_on_the_next_tick():
+    wheel = TimingWheel(tick=1, now=100)
+    wheel.add(50, 1, 1)
+    assert wheel.advance(101) == [(1, 1)]
+
+def test_deadlines_beyond_the_horizon_are_kept():
+    wheel = TimingWheel(tick=1, levels=2, now=0)
+    wheel.add(10000, 1, 1)
+    expired = []
+    for now in range(0, 10001, 7):
+        expired.extend(wheel.advance(now))
+    assert expired == []
+    assert wheel.advance(10001) == [(1, 1)]
+
+def test_entries_lists_pending_deadlines():
+    wheel = TimingWheel(tick=0.5, now=0)
+    wheel.add(2, 1, 10)
+    wheel.add(100, 2, 20)
+    assert sorted(wheel.entries()) == [(2.0, 1, 10), (100.0, 2, 20)]
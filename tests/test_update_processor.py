@@ -0,0 +1,63 @@
+import asyncio
+import datetime
+import random
+from telegram import Chat, Message, Update
+from update_processor import ChatOrderedUpdateProcessor
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(id=chat_id, type=Chat.SUPERGROUP)
+    return Update(update_id, message=Message(update_id, datetime.datetime.now(datetime.timezone.utc), chat))
+
+def test_updates_of_one_chat_run_in_order_under_concurrency():
+    random.seed(7)
+    updates = [make_update(update_id, chat_id=update_id % 5) for update_id in range(200)]
+
+    async def run():
+        processor = ChatOrderedUpdateProcessor(workers=8, max_pending=1000)
+        running = {}
+        order = {}
+        peak = 0
+
+        async def handle(update: Update):
+            nonlocal peak
+            chat_id = update.effective_chat.id
+            # No two updates of a chat overlap
+            assert chat_id not in running
+            running[chat_id] = update.update_id
+            peak = max(peak, len(running))
+            await asyncio.sleep(random.random() / 1000)
+            order.setdefault(chat_id, []).append(update.update_id)
+            del running[chat_id]
+
+        # Handed over in arrival order, like the Application does
+        tasks = [asyncio.ensure_future(processor.process_update(update, handle(update))) for update in updates]
+        await asyncio.gather(*tasks)
+        return order, peak, processor
+
+    order, peak, processor = asyncio.run(run())
+    for chat_id, update_ids in order.items():
+        assert update_ids == [update.update_id for update in updates if update.effective_chat.id == chat_id]
+    # Different chats did run at the same time
+    assert peak > 1
+    assert processor.pending == 0 and processor.lane_count == 0
+
+def test_concurrency_is_bounded_by_workers():
+    async def run():
+        processor = ChatOrderedUpdateProcessor(workers=3, max_pending=100)
+        running = 0
+        peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+
+        await asyncio.gather(*(
+            processor.process_update(make_update(update_id, chat_id=update_id), handle())
+            for update_id in range(20)
+        ))
+        return peak
+
+    assert asyncio.run(run()) == 3
@@ -0,0 +1,84 @@
+import asyncio
+import json
+from telegram.ext import Application
+from asgi import Request, WebhookServer
+from ingress import IngressQueue
+
+# Passes the pre-filter, but Update.de_json fails on the message without date and chat
+MALFORMED = b'{"update_id":5,"message":{"new_chat_members":[]}}'
+JOIN = json.dumps({'update_id': 6, 'message': {
+    'message_id': 1, 'date': 0,
+    'chat': {'id': -100, 'type': 'supergroup', 'title': 'Group'},
+    'new_chat_members': [{'id': 9, 'is_bot': False, 'first_name': 'A'}],
+}}).encode()
+
+def make_server(tmp_path) -> WebhookServer:
+    application = Application.builder().token('123:TEST').updater(None).build()
+    return WebhookServer(application, webhook_url='', ingress=IngressQueue(str(tmp_path)))
+
+def post(server: WebhookServer, body: bytes):
+    return server.webhook(Request('POST', '/webhook', {}, body))
+
+def test_malformed_update_does_not_stop_the_pump(tmp_path):
+    async def run():
+        server = make_server(tmp_path)
+        for body in (MALFORMED, JOIN):
+            response = await post(server, body)
+            assert response.status == 200
+
+        server._start_pump()
+        pump = server._pump_task
+        queue = server.application.update_queue
+        # Shorter than the pump restart delay, so only a surviving pump gets the join through
+        for _ in range(50):
+            if not queue.empty():
+                break
+            await asyncio.sleep(0.01)
+        survived = server._pump_task is pump and not pump.done()
+
+        server._stopping = True
+        server._pump_task.cancel()
+        await asyncio.gather(server._pump_task, return_exceptions=True)
+        server.ingress.close()
+        return survived, queue.qsize(), None if queue.empty() else queue.get_nowait()
+
+    survived, queued, update = asyncio.run(run())
+    assert survived
+    assert queued == 1
+    assert update.update_id == 6
+
+def test_invalid_json_is_rejected(tmp_path):
+    async def run():
+        server = make_server(tmp_path)
+        response = await post(server, b'["new_chat_members"]')
+        server.ingress.close()
+        return response
+
+    assert asyncio.run(run()).status == 400
+
+def test_dropped_update_is_accepted_when_redelivered(tmp_path):
+    def start(update_id: int) -> bytes:
+        return json.dumps({'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': 0, 'text': '/start',
+            'chat': {'id': update_id, 'type': 'private'},
+        }}).encode()
+
+    async def run():
+        application = Application.builder().token('123:TEST').updater(None).build()
+        ingress = IngressQueue(str(tmp_path), high_watermark=1, max_spill_bytes=1)
+        server = WebhookServer(application, webhook_url='', ingress=ingress)
+        # The first stays in memory, the second fills the spill, the third is dropped
+        for update_id in (1, 2, 3):
+            await post(server, start(update_id))
+        dropped = ingress.dropped
+
+        assert await ingress.get() == start(1)
+        assert await ingress.get() == start(2)
+        await post(server, start(3))
+        redelivered = await asyncio.wait_for(ingress.get(), 1)
+        ingress.close()
+        return dropped, redelivered
+
+    dropped, redelivered = asyncio.run(run())
+    assert dropped == 1
+    assert redelivered == start(3)
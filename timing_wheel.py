@@ -0,0 +1,266 @@
+"""
+Scheduled deletion of the bot's own messages on a hierarchical timing wheel
+
+Each level of the wheel has 64 slots; a slot of level N spans 64**N ticks.
+An entry goes into the lowest level whose range covers its deadline and is
+moved down a level each time the slot above comes due, so inserting and
+expiring are O(1) per entry and per level. Entries are kept as three
+parallel int64 arrays per slot (deadline, chat ID, message ID) instead of
+one timer handle per message.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import time
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from telegram import Bot
+from config import Config
+from deletion import DeletionBatcher
+from metrics import SELF_DESTRUCT_DELETES, SELF_DESTRUCT_PENDING
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Pending entries are kept in the storage metadata under this key
+METADATA_KEY = 'scheduled_deletions'
+
+_SLOT_BITS = 6
+_SLOTS = 1 << _SLOT_BITS
+_SLOT_MASK = _SLOTS - 1
+
+class _Slot:
+    """Entries of one wheel slot as parallel arrays"""
+
+    __slots__ = ('deadlines', 'chat_ids', 'message_ids')
+
+    def __init__(self):
+        self.deadlines = array('q')
+        self.chat_ids = array('q')
+        self.message_ids = array('q')
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+class TimingWheel:
+    """Hierarchical timing wheel of (chat ID, message ID) entries"""
+
+    def __init__(self, tick: float = None, levels: int = 4, now: float = None):
+        """
+        Initialize the wheel
+
+        Args:
+            tick: Resolution in seconds (optional)
+            levels: Number of levels; the wheel covers 64**levels ticks (optional)
+            now: Current time in seconds since the epoch (optional)
+        """
+        self.tick = tick or Config.TIMING_WHEEL_TICK_MS / 1000
+        self.levels = levels
+        self._wheels: List[List[Optional[_Slot]]] = [[None] * _SLOTS for _ in range(levels)]
+        self._horizon = _SLOTS ** levels - 1
+        self._now = self._to_tick(time.time() if now is None else now)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _to_tick(self, when: float) -> int:
+        return math.ceil(when / self.tick)
+
+    def add(self, when: float, chat_id: int, message_id: int):
+        """
+        Schedule an entry
+
+        Args:
+            when: Expiry time in seconds since the epoch
+            chat_id: Chat the message belongs to
+            message_id: Message to delete
+        """
+        # Deadlines already passed expire on the next tick
+        self._place(max(self._to_tick(when), self._now + 1), chat_id, message_id)
+        self._size += 1
+
+    def _place(self, deadline: int, chat_id: int, message_id: int):
+        delta = min(deadline - self._now, self._horizon)
+        level = 0
+        while delta >= _SLOTS ** (level + 1):
+            level += 1
+
+        index = (deadline >> (_SLOT_BITS * level)) & _SLOT_MASK
+        slot = self._wheels[level][index]
+        if slot is None:
+            slot = self._wheels[level][index] = _Slot()
+        slot.deadlines.append(deadline)
+        slot.chat_ids.append(chat_id)
+        slot.message_ids.append(message_id)
+
+    def advance(self, now: float = None) -> List[Tuple[int, int]]:
+        """
+        Move the wheel forward and take every entry that expired
+
+        Args:
+            now: Current time in seconds since the epoch (optional)
+
+        Returns:
+            list: Expired (chat_id, message_id) pairs
+        """
+        target = math.floor((time.time() if now is None else now) / self.tick)
+        expired: List[Tuple[int, int]] = []
+
+        while self._now < target:
+            self._now += 1
+            if not self._size:
+                # Nothing to cascade, skip straight to the target tick
+                self._now = target
+                break
+
+            # Move due slots of the upper levels down, highest first
+            for level in range(self.levels - 1, 0, -1):
+                if self._now & (_SLOTS ** level - 1) == 0:
+                    self._cascade(level, (self._now >> (_SLOT_BITS * level)) & _SLOT_MASK)
+
+            index = self._now & _SLOT_MASK
+            slot = self._wheels[0][index]
+            if slot is not None:
+                self._wheels[0][index] = None
+                expired.extend(zip(slot.chat_ids, slot.message_ids))
+                self._size -= len(slot)
+
+        return expired
+
+    def _cascade(self, level: int, index: int):
+        slot = self._wheels[level][index]
+        if slot is None:
+            return
+        self._wheels[level][index] = None
+        for deadline, chat_id, message_id in zip(slot.deadlines, slot.chat_ids, slot.message_ids):
+            # Entries clamped to the horizon may still be out of range of the lower levels
+            self._place(max(deadline, self._now), chat_id, message_id)
+
+    def entries(self) -> List[Tuple[float, int, int]]:
+        """
+        Get all pending entries
+
+        Returns:
+            list: (expiry time, chat_id, message_id) tuples in no particular order
+        """
+        result = []
+        for wheel in self._wheels:
+            for slot in wheel:
+                if slot is not None:
+                    result.extend(
+                        (deadline * self.tick, chat_id, message_id)
+                        for deadline, chat_id, message_id in zip(slot.deadlines, slot.chat_ids, slot.message_ids)
+                    )
+        return result
+
+class SelfDestructScheduler:
+    """Deletes the bot's own messages after a delay, surviving restarts through Storage"""
+
+    def __init__(self, storage: Storage, deleter: DeletionBatcher, wheel: TimingWheel = None):
+        """
+        Initialize the scheduler
+
+        Args:
+            storage: Storage the pending entries are persisted in
+            deleter: Batcher the expired messages are deleted through
+            wheel: Timing wheel (optional)
+        """
+        self.storage = storage
+        self.deleter = deleter
+        self.wheel = wheel if wheel is not None else TimingWheel()
+        self._bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._deleting: set = set()
+        self._dirty = False
+        self._persisted_at = 0.0
+        SELF_DESTRUCT_PENDING.set_function(lambda: len(self.wheel))
+
+    def schedule(self, chat_id: int, message_id: int, delay: float):
+        """
+        Delete a message after a delay
+
+        Args:
+            chat_id: Chat the message was sent to
+            message_id: Message to delete
+            delay: Seconds from now
+        """
+        self.wheel.add(time.time() + delay, chat_id, message_id)
+        self._dirty = True
+
+    async def start(self, bot: Bot):
+        """
+        Restore the entries saved by a previous run and start ticking
+
+        Args:
+            bot: Bot the messages are deleted with
+        """
+        self._bot = bot
+        saved = await asyncio.to_thread(self.storage.get_metadata, METADATA_KEY)
+        if saved:
+            try:
+                flat = json.loads(saved)
+            except ValueError as e:
+                logger.error(f"Ignoring unreadable scheduled deletions: {e}")
+            else:
+                for i in range(0, len(flat) - 2, 3):
+                    self.wheel.add(flat[i], flat[i + 1], flat[i + 2])
+                logger.info(f"Restored {len(flat) // 3} scheduled deletions")
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            expired = self.wheel.advance()
+            if expired:
+                self._dirty = True
+                task = asyncio.ensure_future(self._delete(expired))
+                self._deleting.add(task)
+                task.add_done_callback(self._deleting.discard)
+
+            if self._dirty and time.monotonic() - self._persisted_at >= Config.SELF_DESTRUCT_PERSIST_SECONDS:
+                try:
+                    await self.persist()
+                except Exception as e:
+                    logger.error(f"Failed to persist scheduled deletions: {e}")
+
+    async def _delete(self, expired: List[Tuple[int, int]]):
+        """Hand the expired messages to the batcher, which coalesces them per chat"""
+        by_chat: Dict[int, List[int]] = defaultdict(list)
+        for chat_id, message_id in expired:
+            by_chat[chat_id].append(message_id)
+
+        results = await asyncio.gather(*(
+            self.deleter.delete(self._bot, chat_id, message_id)
+            for chat_id, message_ids in by_chat.items() for message_id in message_ids
+        ), return_exceptions=True)
+
+        failed = sum(1 for result in results if isinstance(result, Exception))
+        SELF_DESTRUCT_DELETES.inc('succeeded', amount=len(results) - failed)
+        if failed:
+            # Usually messages already deleted by an admin
+            SELF_DESTRUCT_DELETES.inc('failed', amount=failed)
+            logger.debug(f"{failed} of {len(results)} scheduled deletions failed")
+
+    async def persist(self):
+        """Save the pending entries to storage"""
+        self._dirty = False
+        self._persisted_at = time.monotonic()
+        # Collected on the event loop, which is the only thread changing the wheel
+        flat = []
+        for when, chat_id, message_id in self.wheel.entries():
+            flat.extend((round(when), chat_id, message_id))
+        await asyncio.to_thread(self.storage.set_metadata, METADATA_KEY, json.dumps(flat, separators=(',', ':')))
+
+    async def stop(self):
+        """Stop ticking, finish running deletions and save what is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._deleting:
+            await asyncio.gather(*self._deleting, return_exceptions=True)
+        if self._dirty:
+            await self.persist()
@@ -0,0 +1,138 @@
+"""
+Concurrent update processing with per-chat ordering
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different chats concurrently, each chat in order
+
+    Every chat is a serial lane: an update starts only after the previous
+    update of its chat finished. Updates at the head of their lane share a
+    pool of `workers` concurrent slots, so a slow call in one chat does not
+    hold up other chats. Updates without a chat run without a lane.
+
+    The Application creates a task per update and hands them over in
+    arrival order; `max_pending` bounds how many may be pending at once.
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None):
+        """
+        Initialize the processor
+
+        Args:
+            workers: Updates processed at the same time (optional)
+            max_pending: Updates accepted for processing before new ones wait (optional)
+        """
+        self.workers = workers or Config.UPDATE_CONCURRENCY
+        super().__init__(max(max_pending or Config.UPDATE_MAX_PENDING, self.workers, 2))
+        self._slots = asyncio.Semaphore(self.workers)
+        # Completion future of the last update accepted per chat
+        self._tails: Dict[int, asyncio.Future] = {}
+        self.pending = 0
+        # Set when an update finishes; only created while someone waits for it
+        self._finished: Optional[asyncio.Event] = None
+
+    @property
+    def lane_count(self) -> int:
+        """Number of chats with updates pending or in progress"""
+        return len(self._tails)
+
+    async def wait_finished(self):
+        """Wait until the next pending update finishes"""
+        if self._finished is None:
+            self._finished = asyncio.Event()
+        await self._finished.wait()
+
+    def _finish(self):
+        self.pending -= 1
+        if self._finished is not None:
+            self._finished.set()
+            self._finished = None
+
+    @staticmethod
+    def _lane_key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        chat = update.effective_chat
+        if chat is not None:
+            return chat.id
+        user = update.effective_user
+        return user.id if user is not None else None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._lane_key(update)
+        self.pending += 1
+
+        if key is None:
+            try:
+                async with self._slots:
+                    await coroutine
+            finally:
+                self._finish()
+            return
+
+        # Claiming the lane happens before the first await, so the lane
+        # order is the order the Application handed the updates over
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+
+        started = False
+        try:
+            if previous is not None:
+                # Shielded: cancelling this update must not cancel its predecessor's marker
+                await asyncio.shield(previous)
+            async with self._slots:
+                started = True
+                await coroutine
+        finally:
+            if not started:
+                coroutine.close()
+            self._finish()
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def initialize(self) -> None:
+        """Nothing to set up; lanes are created on demand"""
+
+    async def shutdown(self) -> None:
+        """Nothing to release; the Application waits for the update tasks"""
+
+def in_flight(application: Application) -> int:
+    """
+    Count the updates handed to an Application and not processed yet
+
+    Args:
+        application: Telegram Application
+
+    Returns:
+        int: Queued updates plus those pending in a ChatOrderedUpdateProcessor
+    """
+    pending = getattr(application.update_processor, 'pending', 0)
+    return application.update_queue.qsize() + pending
+
+async def wait_for_capacity(application: Application, limit: int):
+    """
+    Wait until fewer than `limit` updates are in flight
+
+    Args:
+        application: Telegram Application
+        limit: Updates in flight at which feeding more has to wait
+    """
+    processor = application.update_processor
+    while in_flight(application) >= limit:
+        if isinstance(processor, ChatOrderedUpdateProcessor):
+            await processor.wait_finished()
+        else:
+            # Updates are processed one by one straight from the queue
+            await application.update_queue.join()
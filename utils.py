@@ -5,26 +5,37 @@ Utility functions for the Telegram bot
 import logging
 from datetime import datetime
 from telegram import Bot, Chat
-from telegram.constants import ChatMemberStatus
 from telegram.error import TelegramError
+import rendering
+from admin_cache import ADMIN_STATUSES, AdminCache, admin_cache
+from config import Config
 
 logger = logging.getLogger(__name__)
 
-async def is_admin(bot: Bot, chat_id: int, user_id: int) -> bool:
+async def is_admin(bot: Bot, chat_id: int, user_id: int, cache: AdminCache = None) -> bool:
     """
     Check if a user is an administrator in a chat
     
+    With ADMIN_CACHE_ENABLED (or an explicit cache) answered from the
+    chat's cached admin roster, fetched once per ADMIN_CACHE_TTL_SECONDS
+    instead of once per check.
+    
     Args:
         bot: Telegram Bot instance
         chat_id: Chat ID to check
         user_id: User ID to check
+        cache: Roster cache (optional, defaults to the shared one)
         
     Returns:
         bool: True if user is admin, False otherwise
     """
     try:
+        if cache is None and Config.ADMIN_CACHE_ENABLED:
+            cache = admin_cache
+        if cache is not None:
+            return await cache.is_admin(bot, chat_id, user_id)
         member = await bot.get_chat_member(chat_id, user_id)
-        return member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+        return member.status in ADMIN_STATUSES
     except TelegramError as e:
         logger.error(f"Error checking admin status for user {user_id} in chat {chat_id}: {e}")
         return False
@@ -103,13 +114,7 @@ def escape_markdown(text: str) -> str:
     Returns:
         str: Escaped text
     """
-    # Characters that need escaping in Telegram Markdown
-    escape_chars = ['_', '*', '`', '[', ']', '(', ')', '~', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    
-    for char in escape_chars:
-        text = text.replace(char, f'\\{char}')
-    
-    return text
+    return rendering.escape_markdown(text)
 
 def truncate_text(text: str, max_length: int = 4096) -> str:
     """